@@ -1,36 +1,7 @@
-import random
 import sqlite3
-from datetime import datetime, timedelta
-from src.dau.models.user_activity import UserActivity
 from src.dau.tracking.tracker import DAUTracker
 from src.dau.reporting.report import DAUReport
-
-class UserSimulator:
-    """Simulate user activities for testing and demonstration"""
-    PLATFORMS = ['web', 'mobile', 'desktop']
-    ACTIVITY_TYPES = [
-        'login', 
-        'logout', 
-        'purchase', 
-        'view_product', 
-        'add_to_cart', 
-        'view_profile', 
-        'update_settings'
-    ]
-
-    @classmethod
-    def generate_activity(cls, user_id=None):
-        """Generate a random user activity"""
-        return UserActivity(
-            user_id=user_id or f'user_{random.randint(1, 100)}',
-            timestamp=datetime.now() - timedelta(hours=random.randint(0, 24)),
-            activity_type=random.choice(cls.ACTIVITY_TYPES),
-            platform=random.choice(cls.PLATFORMS),
-            metadata={
-                'session_id': f'session_{random.randint(1000, 9999)}',
-                'ip_address': f'192.168.{random.randint(0, 255)}.{random.randint(0, 255)}'
-            }
-        )
+from src.dau.workload.generator import WorkloadGenerator
 
 def main():
     # Initialize DAU Tracker
@@ -40,9 +11,7 @@ def main():
     print("Generating simulated user activities...")
     
     # Generate activities for the past 7 days
-    for _ in range(200):  # 200 random activities
-        activity = UserSimulator.generate_activity()
-        tracker.log_activity(activity)
+    WorkloadGenerator(users=100, days=7).populate(tracker, 200)  # 200 random activities
     
     # Initialize Report Generator
     report = DAUReport()
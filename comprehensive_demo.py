@@ -1,83 +1,37 @@
-import importlib
-import sys
-import os
-import subprocess
-
-def run_script(script_name):
-    """
-    Run a Python script and capture its output
-    
-    Args:
-        script_name (str): Name of the script to run
-    
-    Returns:
-        str: Output of the script
-    """
-    print(f"\n{'='*50}")
-    print(f"🚀 Running {script_name}")
-    print(f"{'='*50}")
-    
-    try:
-        # Use subprocess to run the script
-        result = subprocess.run(
-            [sys.executable, '-m', script_name.replace('.py', '')], 
-            cwd=os.path.dirname(os.path.abspath(__file__)),
-            capture_output=True, 
-            text=True
-        )
-        
-        # Print stdout and stderr
-        print(result.stdout)
-        
-        if result.stderr:
-            print("⚠️ Errors:")
-            print(result.stderr)
-        
-        return result.stdout
-    except Exception as e:
-        print(f"❌ Error running {script_name}: {e}")
-        return ""
+from src.dau.cli import Context, build_parser, print_timings, run
 
 def main():
     """
-    Run all demo scripts in the DAU tracking project
+    Run the whole DAU tracking workflow in one process: ingest, report,
+    predict, segments and visualize share one database connection pool
+    and each other's results
     """
     print("🌟 Comprehensive DAU Tracking System Demo 🌟")
-    
-    # List of scripts to run in order
-    scripts_to_run = [
-        'learning_demo.py',
-        'reporting_demo.py', 
-        'advanced_usage.py',
-        'confidence_visualization.py'
-    ]
-    
-    # Store results for potential further processing
-    script_results = {}
-    
-    # Run each script
-    for script in scripts_to_run:
-        script_results[script] = run_script(script)
-    
+
+    args = build_parser().parse_args(['all', '--events', '500', '--users', '100', '--horizon', '14'])
+    ctx = Context(args.db, args.output_dir)
+    try:
+        run(args, ctx)
+    finally:
+        ctx.close()
+
     # Generate a summary report
     print("\n🏁 Comprehensive Demo Complete!")
     print("Summary of Key Insights:")
     print("-" * 50)
-    
-    # Basic summary extraction (you can customize this)
-    if 'learning_demo.py' in script_results:
-        print("🔮 Prediction Confidence:")
-        print("   - Scenarios tested: Default, High Variance, Consistent, Sparse")
-    
-    if 'reporting_demo.py' in script_results:
-        print("📊 Reporting Insights:")
-        print("   - DAU Trend tracked over 30 days")
-        print("   - Multiple activity types analyzed")
-    
-    if 'confidence_visualization.py' in script_results:
-        print("📈 Confidence Visualization:")
-        print("   - Generated DAU prediction visualization")
-        print(f"   - Visualization saved as 'dau_confidence_visualization.png'")
+
+    print("📊 Reporting Insights:")
+    print(f"   - DAU Trend tracked over {args.days} days")
+    print("   - Multiple activity types analyzed")
+
+    print("🔮 Prediction Confidence:")
+    print(f"   - {args.horizon} days forecast from {args.history_days} days of history")
+
+    print("📈 Confidence Visualization:")
+    print("   - Visualization saved as 'dau_confidence_visualization.png'")
+
+    print()
+    print_timings(ctx.timings)
 
 if __name__ == '__main__':
     main()
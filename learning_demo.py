@@ -1,8 +1,6 @@
 from src.dau.learning.predictor import SimpleDAUPredictor
-from src.dau.models.user_activity import UserActivity
 from src.dau.tracking.tracker import DAUTracker
-import random
-from datetime import datetime, timedelta
+from src.dau.workload.generator import WorkloadGenerator
 
 def generate_sample_data(tracker, num_activities=500, data_scenario='default'):
     """
@@ -14,62 +12,10 @@ def generate_sample_data(tracker, num_activities=500, data_scenario='default'):
     3. 'consistent': Very stable, predictable user behavior
     4. 'sparse': Limited historical data points
     """
-    platforms = ['web', 'mobile', 'desktop']
-    activity_types = ['login', 'purchase', 'view_product', 'add_to_cart', 'update_profile']
-    
-    # Base seed for reproducibility
-    random.seed(42)
-    
-    # Scenario-based data generation
-    if data_scenario == 'default':
-        # Moderate variability
-        base_activities = num_activities
-        variance_factor = 0.3
-    elif data_scenario == 'high_variance':
-        # Large activity fluctuations
-        base_activities = num_activities
-        variance_factor = 0.7
-    elif data_scenario == 'consistent':
-        # Very stable behavior
-        base_activities = num_activities
-        variance_factor = 0.1
-    elif data_scenario == 'sparse':
-        # Limited data points
-        base_activities = num_activities // 4
-        variance_factor = 0.2
-    else:
-        raise ValueError("Invalid data scenario")
-    
-    for _ in range(base_activities):
-        # Simulate activities spread across different dates
-        activity_date = datetime.now() - timedelta(days=random.randint(0, 30))
-        
-        # Variance in activity generation based on scenario
-        if data_scenario == 'high_variance':
-            # More random, less predictable
-            activity_multiplier = random.uniform(0.5, 1.5)
-        elif data_scenario == 'consistent':
-            # Very stable, close to mean
-            activity_multiplier = random.uniform(0.9, 1.1)
-        elif data_scenario == 'sparse':
-            # Fewer activities, more spread out
-            activity_multiplier = random.uniform(0.7, 1.3)
-        else:
-            # Default moderate variability
-            activity_multiplier = random.uniform(0.8, 1.2)
-        
-        activity = UserActivity(
-            timestamp=activity_date,
-            activity_type=random.choice(activity_types),
-            platform=random.choice(platforms),
-            metadata={
-                'session_duration': int(random.randint(10, 300) * activity_multiplier),
-                'device': random.choice(['chrome', 'firefox', 'safari', 'edge', 'mobile_app']),
-                'region': random.choice(['US', 'EU', 'APAC', 'LATAM'])
-            }
-        )
-        
-        tracker.log_activity(activity)
+    # Fixed seed for reproducibility
+    generator = WorkloadGenerator(users=max(1, num_activities // 5), days=31,
+                                  scenario=data_scenario, seed=42)
+    generator.populate(tracker, num_activities)
 
 def main():
     # Demonstrate different data scenarios
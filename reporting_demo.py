@@ -1,30 +1,11 @@
-from src.dau.models.user_activity import UserActivity
 from src.dau.tracking.tracker import DAUTracker
 from src.dau.reporting.report import DAUReport
-import random
-from datetime import datetime, timedelta
+from src.dau.workload.generator import WorkloadGenerator
 
 def generate_sample_data(tracker, num_activities=500):
     """Generate sample user activities for reporting demonstration"""
-    platforms = ['web', 'mobile', 'desktop']
-    activity_types = ['login', 'purchase', 'view_product', 'add_to_cart', 'update_profile', 'share_content']
-    
-    for _ in range(num_activities):
-        # Simulate activities spread across different dates and with varied timestamps
-        activity_date = datetime.now() - timedelta(days=random.randint(0, 30))
-        
-        activity = UserActivity(
-            timestamp=activity_date,
-            activity_type=random.choice(activity_types),
-            platform=random.choice(platforms),
-            metadata={
-                'session_duration': random.randint(10, 300),
-                'device': random.choice(['chrome', 'firefox', 'safari', 'edge', 'mobile_app']),
-                'region': random.choice(['US', 'EU', 'APAC', 'LATAM'])
-            }
-        )
-        
-        tracker.log_activity(activity)
+    generator = WorkloadGenerator(users=max(1, num_activities // 5), days=31)
+    generator.populate(tracker, num_activities)
 
 def main():
     # Initialize tracker and generate sample data
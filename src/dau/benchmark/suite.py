@@ -0,0 +1,317 @@
+"""Reproducible performance benchmarks
+
+Builds a seeded database for every combination of event count and user
+cardinality, measuring ingest throughput along the way, then times the
+tracker, report, predictor and cohort calls on it:
+
+- ``cold``: the first call on a fresh ``ConnectionPool`` (empty SQLite page
+  cache, empty query cache; the OS file cache is not dropped)
+- ``warm``: the median and minimum of ``repeat`` further calls
+- ``peak_rss_mb``: peak resident memory during the calls, per operation
+  where the OS lets the peak be reset (Linux), otherwise process-wide
+
+Results are written as JSON together with the versions and machine they
+ran on; ``--compare`` reports operations that got slower than a baseline::
+
+    python -m src.dau.benchmark --scales small medium --output bench.json
+    python -m src.dau.benchmark --scales small --compare bench.json
+
+The same seed, scale and cardinality always produce the same events,
+relative to the day the benchmark runs.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Sequence
+import numpy as np
+from ..learning.predictor import SimpleDAUPredictor
+from ..models.user_activity import UserActivity
+from ..reporting.cohort import CohortAnalyzer
+from ..reporting.report import DAUReport
+from ..storage.cache import QueryCache
+from ..storage.pool import ConnectionPool
+from ..tracking.tracker import DAUTracker
+from ..workload.generator import ACTIVITY_TYPES, PLATFORMS, WorkloadGenerator
+
+SCALES = {
+    'small': 10_000,
+    'medium': 1_000_000,
+    'large': 10_000_000,
+}
+
+# Distinct users as a fraction of events
+USER_RATIOS = (0.01, 0.1)
+
+def _reset_peak_rss() -> bool:
+    """Reset the process's peak RSS counter, where the OS supports it"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def peak_rss_mb() -> Optional[float]:
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+def build_database(path: str, events: int, users: int, days: int = 90, seed: int = 42,
+                   batch_size: int = 10000) -> Dict[str, Any]:
+    """Create a seeded database at path, return its ingest measurements
+
+    Only DAUTracker.log_activities is timed, not generating the events.
+    """
+    _reset_peak_rss()
+    elapsed = 0.0
+    generator = WorkloadGenerator(users, days, seed=seed)
+    with DAUTracker(path, batch_size=batch_size) as tracker:
+        for batch in generator.batches(events):
+            started = time.perf_counter()
+            tracker.log_activities(batch)
+            elapsed += time.perf_counter() - started
+    with sqlite3.connect(path) as conn:
+        distinct = conn.execute('SELECT COUNT(*) FROM users').fetchone()[0]
+    return {
+        'operation': 'tracker.log_activities',
+        'events': events,
+        'distinct_users': distinct,
+        'seconds': elapsed,
+        'events_per_sec': events / elapsed if elapsed else None,
+        'peak_rss_mb': peak_rss_mb(),
+        'db_bytes': os.path.getsize(path),
+    }
+
+def operations(today: datetime) -> Dict[str, Callable[[Dict[str, Any]], Any]]:
+    """Timed calls by name, each taking the objects opened on a fresh pool"""
+    month_ago = today - timedelta(days=29)
+    return {
+        'tracker.get_daily_active_users': lambda o: o['tracker'].get_daily_active_users(today),
+        'tracker.get_active_user_count': lambda o: o['tracker'].get_active_user_count(month_ago, today),
+        'report.get_dau_trend': lambda o: o['report'].get_dau_trend(30),
+        'report.get_activity_distribution': lambda o: o['report'].get_activity_distribution(month_ago, today),
+        'report.get_platform_performance': lambda o: o['report'].get_platform_performance(30),
+        'report.get_breakdown': lambda o: o['report'].get_breakdown('region', 30),
+        'predictor.predict_dau': lambda o: o['predictor'].predict_dau(7),
+        'predictor.analyze_user_segments': lambda o: o['predictor'].analyze_user_segments(30),
+        'cohort.retention_matrix': lambda o: o['cohort'].retention_matrix(90, 'week'),
+    }
+
+def _open(path: str, cache: bool, output_dir: str) -> Dict[str, Any]:
+    pool = ConnectionPool(path, cache=QueryCache() if cache else None)
+    return {
+        'pool': pool,
+        'tracker': DAUTracker(pool=pool),
+        'report': DAUReport(output_dir=output_dir, pool=pool),
+        'predictor': SimpleDAUPredictor(pool=pool),
+        'cohort': CohortAnalyzer(pool),
+    }
+
+def time_operation(path: str, name: str, call: Callable[[Dict[str, Any]], Any], repeat: int = 5,
+                   cache: bool = False, output_dir: str = 'reports') -> Dict[str, Any]:
+    objects = _open(path, cache, output_dir)
+    try:
+        per_operation_peak = _reset_peak_rss()
+        started = time.perf_counter()
+        call(objects)
+        cold = time.perf_counter() - started
+        warm = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            call(objects)
+            warm.append(time.perf_counter() - started)
+        return {
+            'operation': name,
+            'cold_s': cold,
+            'warm_s': statistics.median(warm) if warm else None,
+            'warm_min_s': min(warm) if warm else None,
+            'runs': repeat,
+            'peak_rss_mb': peak_rss_mb(),
+            'peak_rss_scope': 'operation' if per_operation_peak else 'process',
+        }
+    finally:
+        objects['tracker'].close()
+        objects['pool'].close()
+
+def time_log_activity(path: str, calls: int = 1000, seed: int = 42) -> Dict[str, Any]:
+    """Latency of unbuffered single-event writes, each its own transaction"""
+    rng = random.Random(seed)
+    latencies = []
+    _reset_peak_rss()
+    with DAUTracker(path) as tracker:
+        for _ in range(calls):
+            activity = UserActivity(user_id=f'user_{rng.randrange(1 << 20)}', timestamp=datetime.now(),
+                                    activity_type=rng.choice(ACTIVITY_TYPES), platform=rng.choice(PLATFORMS))
+            started = time.perf_counter()
+            tracker.log_activity(activity)
+            latencies.append(time.perf_counter() - started)
+    cold, warm = latencies[0], sorted(latencies[1:])
+    return {
+        'operation': 'tracker.log_activity',
+        'cold_s': cold,
+        'warm_s': statistics.median(warm),
+        'p99_s': warm[min(len(warm) - 1, int(0.99 * len(warm)))],
+        'runs': len(warm),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def environment() -> Dict[str, Any]:
+    return {
+        'revision': _git_revision(),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+    }
+
+def run_suite(scales: Sequence[str] = ('small', 'medium'), user_ratios: Sequence[float] = USER_RATIOS,
+              days: int = 90, seed: int = 42, repeat: int = 5, cache: bool = False,
+              work_dir: Optional[str] = None, keep: bool = False,
+              log: Callable[[str], None] = print) -> Dict[str, Any]:
+    """Build and time every scale x cardinality, return the results document"""
+    work_dir = work_dir or tempfile.mkdtemp(prefix='dau-bench-')
+    os.makedirs(work_dir, exist_ok=True)
+    output_dir = os.path.join(work_dir, 'reports')
+    today = datetime.now()
+    results = []
+
+    for scale in scales:
+        events = SCALES[scale]
+        for ratio in user_ratios:
+            users = max(1, int(events * ratio))
+            path = os.path.join(work_dir, f'bench_{scale}_{users}u_{seed}.db')
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+            run = {'scale': scale, 'events': events, 'users': users}
+
+            log(f"{scale}: {events} events, {users} users")
+            ingest = build_database(path, events, users, days, seed)
+            results.append({**run, **ingest})
+            log(f"  ingest {ingest['events_per_sec']:.0f} events/s")
+
+            for name, call in operations(today).items():
+                result = time_operation(path, name, call, repeat, cache, output_dir)
+                results.append({**run, **result})
+                log(f"  {name}: cold {result['cold_s'] * 1000:.1f} ms, warm {result['warm_s'] * 1000:.1f} ms")
+
+            result = time_log_activity(path, seed=seed)
+            results.append({**run, **result})
+            log(f"  tracker.log_activity: p50 {result['warm_s'] * 1000:.2f} ms, p99 {result['p99_s'] * 1000:.2f} ms")
+
+            if not keep:
+                for suffix in ('', '-wal', '-shm'):
+                    if os.path.exists(path + suffix):
+                        os.remove(path + suffix)
+
+    return {
+        'environment': environment(),
+        'parameters': {
+            'scales': list(scales),
+            'user_ratios': list(user_ratios),
+            'days': days,
+            'seed': seed,
+            'repeat': repeat,
+            'cache': cache,
+        },
+        'results': results,
+    }
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], threshold: float = 1.2,
+            min_seconds: float = 0.001) -> List[Dict[str, Any]]:
+    """Operations at least threshold times and min_seconds slower than in baseline
+
+    min_seconds keeps timer noise on sub-millisecond calls out of the report.
+    """
+    def key(result):
+        return result['scale'], result['users'], result['operation']
+
+    def duration(result):
+        return result.get('warm_s') or result.get('seconds')
+
+    previous = {key(result): result for result in baseline['results']}
+    regressions = []
+    for result in results['results']:
+        before = previous.get(key(result))
+        if before is None or not duration(before) or duration(result) is None:
+            continue
+        ratio = duration(result) / duration(before)
+        if ratio >= threshold and duration(result) - duration(before) >= min_seconds:
+            regressions.append({
+                'scale': result['scale'],
+                'users': result['users'],
+                'operation': result['operation'],
+                'before_s': duration(before),
+                'after_s': duration(result),
+                'ratio': ratio,
+            })
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark DAU ingest, reports and predictions')
+    parser.add_argument('--scales', nargs='+', choices=list(SCALES), default=['small', 'medium'])
+    parser.add_argument('--user-ratios', nargs='+', type=float, default=list(USER_RATIOS),
+                        help='Distinct users as a fraction of events')
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--repeat', type=int, default=5, help='Warm runs per operation')
+    parser.add_argument('--cache', action='store_true', help='Give the pool a QueryCache')
+    parser.add_argument('--work-dir', help='Where to build the databases (default: a temp directory)')
+    parser.add_argument('--keep', action='store_true', help='Keep the databases afterwards')
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', help='Baseline results to check for regressions')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='Slowdown ratio reported as a regression')
+    parser.add_argument('--min-delta-ms', type=float, default=1.0,
+                        help='Smallest slowdown in milliseconds reported as a regression')
+    args = parser.parse_args()
+
+    results = run_suite(args.scales, args.user_ratios, args.days, args.seed, args.repeat,
+                        args.cache, args.work_dir, args.keep)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold, args.min_delta_ms / 1000)
+        for regression in regressions:
+            print(f"REGRESSION {regression['scale']}/{regression['users']}u {regression['operation']}: "
+                  f"{regression['before_s'] * 1000:.1f} ms -> {regression['after_s'] * 1000:.1f} ms "
+                  f"({regression['ratio']:.2f}x)")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {args.compare}")
+
+if __name__ == '__main__':
+    main()
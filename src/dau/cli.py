@@ -0,0 +1,362 @@
+"""The ``dau`` command: the whole workflow in one process
+
+Subcommands run one stage each; ``all`` runs ingest, report, predict,
+segments and visualize in that order::
+
+    python -m src.dau ingest --events 100000 --scenario default
+    python -m src.dau report --days 30
+    python -m src.dau --db dau_tracking_default.db all --events 1000 --activity-model
+
+Stages share one ``ConnectionPool`` with a ``QueryCache`` and hand their
+results on through ``Context``: visualize plots the predictions and the
+activity distribution that predict and report already computed instead of
+querying them again. Modules are imported by the stages that use them, so
+``dau report`` never imports matplotlib or scikit-learn. The wall time of
+every stage, imports included, is printed at the end.
+"""
+import argparse
+import os
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+SCENARIOS = ('default', 'high_variance', 'consistent', 'sparse')
+
+class Context:
+    """Connection pool, API objects and stage results shared by one run"""
+
+    def __init__(self, db_path: str = 'dau_tracking.db', output_dir: str = 'reports',
+                 timezone: Optional[str] = None):
+        self.db_path = db_path
+        self.output_dir = output_dir
+        self.timezone = timezone
+        self.timings: List[Tuple[str, float]] = []
+        self._objects: Dict[str, Any] = {}
+        self._results: Dict[Hashable, Any] = {}
+
+    def _get(self, name: str, create: Callable[[], Any]) -> Any:
+        if name not in self._objects:
+            self._objects[name] = create()
+        return self._objects[name]
+
+    @property
+    def pool(self):
+        def create():
+            from .storage.cache import QueryCache
+            from .storage.pool import ConnectionPool
+            return ConnectionPool(self.db_path, cache=QueryCache())
+        return self._get('pool', create)
+
+    @property
+    def tracker(self):
+        def create():
+            from .tracking.tracker import DAUTracker
+            return DAUTracker(pool=self.pool, batch_size=100000)
+        return self._get('tracker', create)
+
+    @property
+    def report(self):
+        def create():
+            from .reporting.report import DAUReport
+            return DAUReport(output_dir=self.output_dir, pool=self.pool)
+        return self._get('report', create)
+
+    @property
+    def predictor(self):
+        def create():
+            from .learning.predictor import SimpleDAUPredictor
+            return SimpleDAUPredictor(pool=self.pool)
+        return self._get('predictor', create)
+
+    def result(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """compute() once per run; later stages get the same value"""
+        if key not in self._results:
+            self._results[key] = compute()
+        return self._results[key]
+
+    def invalidate(self):
+        """Forget stage results after the data changed"""
+        self._results.clear()
+
+    def comprehensive_report(self, days: int) -> Dict[str, Any]:
+        return self.result(('report', days), lambda: self.report.generate_comprehensive_report(days))
+
+    def predictions(self, days_to_predict: int, history_days: int) -> List[Dict[str, Any]]:
+        return self.result(
+            ('predictions', days_to_predict, history_days),
+            lambda: self.predictor.forecast(days_to_predict, history_days, self.timezone).to_records()
+        )
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings.append((name, time.perf_counter() - started))
+
+    def close(self):
+        tracker = self._objects.get('tracker')
+        if tracker is not None:
+            tracker.close()
+        pool = self._objects.get('pool')
+        if pool is not None:
+            pool.close()
+
+def ingest(ctx: Context, args: argparse.Namespace):
+    """Fill the database with a synthetic workload"""
+    from .workload.generator import WorkloadGenerator
+
+    if not args.events:
+        print('Ingest: no events requested')
+        return
+    generator = WorkloadGenerator(args.users or max(1, args.events // 10), args.span_days,
+                                  args.scenario, args.seed)
+    inserted = generator.populate(ctx.tracker, args.events)
+    ctx.invalidate()
+    print(f"Ingest: {inserted} events for {generator.users} users over {args.span_days} days "
+          f"({args.scenario})")
+
+def report(ctx: Context, args: argparse.Namespace):
+    """DAU trend, activity distribution and platform performance"""
+    result = ctx.comprehensive_report(args.days)
+    trend = result['dau_trend'] if ctx.timezone is None else ctx.report.get_dau_trend(args.days, ctx.timezone)
+
+    print(f"DAU trend{'' if ctx.timezone is None else f' ({ctx.timezone})'}:")
+    for day in trend:
+        print(f"  {day['date']}: {day['daily_active_users']} users")
+
+    print('Activity distribution:')
+    for activity, stats in result['activity_distribution'].items():
+        print(f"  {activity}: {stats['unique_users']} unique users, {stats['total_activities']} total activities")
+
+    print('Platform performance:')
+    for platform, performance in result['platform_performance'].items():
+        print(f"  {platform}: {performance['unique_users']} unique users, "
+              f"{performance['total_activities']} total activities, "
+              f"avg metadata size {performance['avg_metadata_size']:.2f}")
+
+    ctx.report.export_csv(trend, 'dau_trend.csv')
+    print(f"Reports written to {ctx.output_dir}/")
+
+def predict(ctx: Context, args: argparse.Namespace):
+    """Forecast DAU, optionally fitting the activity model"""
+    print(f"DAU forecast ({args.history_days} days of history):")
+    for prediction in ctx.predictions(args.horizon, args.history_days):
+        print(f"  {prediction['date']}: {prediction['predicted_dau']} users, "
+              f"{prediction['confidence_level']} confidence ({prediction['confidence_score']:.2f})")
+
+    if args.activity_model:
+        try:
+            activity_model(ctx, args.days)
+        except ImportError as e:
+            print(f"Skipping activity model: {e}")
+
+def activity_model(ctx: Context, days: int):
+    """Linear model of event counts by weekday, hour and platform"""
+    try:
+        import numpy as np
+        from sklearn.linear_model import LinearRegression
+        from sklearn.model_selection import train_test_split
+    except ImportError:
+        raise ImportError('The activity model requires scikit-learn: pip install scikit-learn')
+    from .storage.partition import activity_source
+    from .storage.schema import epoch_day
+
+    end_day = epoch_day(datetime.now())
+    start_day = end_day - days
+    with ctx.pool.snapshot() as conn:
+        # Sunday = 0; 1970-01-01 was a Thursday
+        rows = conn.execute(f'''
+            SELECT (day + 4) % 7, CAST(substr(timestamp, 12, 2) AS INTEGER), platform, COUNT(*)
+            FROM {activity_source(conn, start_day, end_day)}
+            WHERE day BETWEEN ? AND ?
+            GROUP BY 1, 2, 3
+        ''', (start_day, end_day)).fetchall()
+    if len(rows) < 10:
+        print('Activity model: not enough data')
+        return
+
+    platforms = sorted({row[2] for row in rows}, key=str)
+    features = np.array([
+        [weekday, hour] + [platform == value for value in platforms]
+        for weekday, hour, platform, _ in rows
+    ], dtype=np.float64)
+    counts = np.array([row[3] for row in rows], dtype=np.float64)
+    train_x, test_x, train_y, test_y = train_test_split(features, counts, test_size=0.2, random_state=42)
+    model = LinearRegression().fit(train_x, train_y)
+    print(f"Activity model: R^2 {model.score(train_x, train_y):.2f} train, "
+          f"{model.score(test_x, test_y):.2f} test over {len(rows)} weekday/hour/platform cells")
+
+def segments(ctx: Context, args: argparse.Namespace):
+    """User segments by active days and day-N retention"""
+    from .reporting.cohort import CohortAnalyzer
+
+    result = ctx.predictor.analyze_user_segments(args.days)
+    print(f"User segments ({result['total_users']} users):")
+    for segment, percentage in result['segment_percentages'].items():
+        print(f"  {segment.replace('_', ' ')}: {percentage:.2f}%")
+
+    retention = CohortAnalyzer(ctx.pool).day_n_retention(days=args.days)
+    print('Retention: ' + ', '.join(
+        f"day {n} {'n/a' if rate is None else f'{rate:.1%}'}" for n, rate in retention.items()
+    ))
+
+def visualize(ctx: Context, args: argparse.Namespace):
+    """Forecast confidence chart and platform / activity type charts"""
+    try:
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+    except ImportError:
+        raise ImportError('Charts require matplotlib: pip install matplotlib')
+    from .storage.rollup import RollupManager
+    from .storage.schema import day_to_date, epoch_day
+
+    os.makedirs(args.figures_dir, exist_ok=True)
+    predictions = ctx.predictions(args.horizon, args.history_days)
+    dates = [prediction['date'] for prediction in predictions]
+    colors = [{'low': 'red', 'medium': 'orange', 'high': 'green'}[prediction['confidence_level']]
+              for prediction in predictions]
+
+    plt.figure(figsize=(15, 10))
+    plt.subplot(2, 1, 1)
+    plt.bar(dates, [prediction['predicted_dau'] for prediction in predictions], color=colors)
+    plt.title('Daily Active Users (DAU) Prediction with Confidence', fontsize=16)
+    plt.ylabel('Predicted DAU', fontsize=12)
+    plt.xticks(rotation=45)
+    plt.grid(axis='y', linestyle='--', alpha=0.7)
+    plt.subplot(2, 1, 2)
+    plt.bar(dates, [prediction['confidence_score'] for prediction in predictions], color=colors)
+    plt.title('Prediction Confidence Scores', fontsize=16)
+    plt.ylabel('Confidence Score', fontsize=12)
+    plt.xticks(rotation=45)
+    plt.ylim(0, 1)
+    plt.grid(axis='y', linestyle='--', alpha=0.7)
+    plt.tight_layout()
+    confidence_path = os.path.join(args.figures_dir, 'dau_confidence_visualization.png')
+    plt.savefig(confidence_path, dpi=150, bbox_inches='tight')
+    plt.close()
+
+    end_day = epoch_day(datetime.now())
+    start_day = end_day - args.days
+    with ctx.pool.snapshot() as conn:
+        platform_users = RollupManager.daily_dimension_users(conn, 'platform', start_day, end_day)
+    distribution = ctx.comprehensive_report(args.days)['activity_distribution']
+
+    plt.figure(figsize=(12, 5))
+    plt.subplot(1, 2, 1)
+    for platform in sorted({row[0] for row in platform_users}, key=str):
+        days = [(day, users) for value, day, users in platform_users if value == platform]
+        plt.plot([day_to_date(day) for day, _ in days], [users for _, users in days], label=platform)
+    plt.title('Daily Active Users by Platform')
+    plt.xlabel('Date')
+    plt.ylabel('Active Users')
+    plt.xticks(rotation=45)
+    plt.legend()
+    plt.subplot(1, 2, 2)
+    plt.pie([stats['total_activities'] for stats in distribution.values()],
+            labels=list(distribution), autopct='%1.1f%%')
+    plt.title('Activity Type Distribution')
+    plt.tight_layout()
+    analysis_path = os.path.join(args.figures_dir, 'dau_advanced_analysis.png')
+    plt.savefig(analysis_path)
+    plt.close()
+    print(f"Charts saved to {confidence_path} and {analysis_path}")
+
+STAGES: Dict[str, Callable[[Context, argparse.Namespace], None]] = {
+    'ingest': ingest,
+    'report': report,
+    'predict': predict,
+    'segments': segments,
+    'visualize': visualize,
+}
+
+def build_parser() -> argparse.ArgumentParser:
+    ingest_options = argparse.ArgumentParser(add_help=False)
+    ingest_options.add_argument('--events', type=int, default=10000, help='Events to generate (0 skips ingest)')
+    ingest_options.add_argument('--users', type=int, help='Distinct users (default: events / 10)')
+    ingest_options.add_argument('--span-days', type=int, default=31, help='Days the generated events cover')
+    ingest_options.add_argument('--scenario', choices=SCENARIOS, default='default')
+    ingest_options.add_argument('--seed', type=int, default=42)
+
+    window_options = argparse.ArgumentParser(add_help=False)
+    window_options.add_argument('--days', type=int, default=30, help='Days analyzed, ending today')
+
+    forecast_options = argparse.ArgumentParser(add_help=False)
+    forecast_options.add_argument('--horizon', type=int, default=7, help='Days to forecast')
+    forecast_options.add_argument('--history-days', type=int, default=30, help='Days of history to fit on')
+
+    predict_options = argparse.ArgumentParser(add_help=False)
+    predict_options.add_argument('--activity-model', action='store_true',
+                                 help='Also fit a linear model of activity by weekday, hour and platform '
+                                      '(needs scikit-learn)')
+
+    visualize_options = argparse.ArgumentParser(add_help=False)
+    visualize_options.add_argument('--figures-dir', default='.', help='Where to save the charts')
+
+    parser = argparse.ArgumentParser(prog='dau', description='Track, report and forecast daily active users')
+    parser.add_argument('--db', default='dau_tracking.db')
+    parser.add_argument('--output-dir', default='reports', help='Directory for JSON and CSV reports')
+    parser.add_argument('--timezone', help='Count days in this timezone (see storage.timezones)')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('ingest', parents=[ingest_options], help=ingest.__doc__)
+    commands.add_parser('report', parents=[window_options], help=report.__doc__)
+    commands.add_parser('predict', parents=[window_options, forecast_options, predict_options],
+                        help=predict.__doc__)
+    commands.add_parser('segments', parents=[window_options], help=segments.__doc__)
+    commands.add_parser('visualize', parents=[window_options, forecast_options, visualize_options],
+                        help=visualize.__doc__)
+    commands.add_parser('all', parents=[ingest_options, window_options, forecast_options,
+                                        predict_options, visualize_options],
+                        help='Run every stage in one process')
+    return parser
+
+def run(args: argparse.Namespace, ctx: Optional[Context] = None) -> Context:
+    """Run the stages of args.command on ctx (a new one from args by default)
+
+    With ``all``, a stage whose optional dependency is missing is skipped.
+    """
+    if ctx is None:
+        ctx = Context(args.db, args.output_dir, args.timezone)
+    names = list(STAGES) if args.command == 'all' else [args.command]
+    for name in names:
+        with ctx.stage(name):
+            try:
+                STAGES[name](ctx, args)
+            except ImportError as e:
+                if args.command != 'all':
+                    raise
+                print(f"Skipping {name}: {e}")
+    return ctx
+
+def print_timings(timings: List[Tuple[str, float]]):
+    width = max(len(name) for name, _ in timings + [('total', 0.0)])
+    print('Stage timings:')
+    for name, seconds in timings:
+        print(f"  {name:<{width}}  {seconds:8.3f}s")
+    print(f"  {'total':<{width}}  {sum(seconds for _, seconds in timings):8.3f}s")
+
+def main(argv: Optional[List[str]] = None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.timezone is not None:
+        from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+        try:
+            ZoneInfo(args.timezone)
+        except (ValueError, ZoneInfoNotFoundError):
+            parser.error(f'Unknown timezone {args.timezone}')
+    ctx = Context(args.db, args.output_dir, args.timezone)
+    try:
+        run(args, ctx)
+    except (ImportError, ValueError) as e:
+        print(f"dau {args.command}: {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        ctx.close()
+    print_timings(ctx.timings)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""Load generator for the HTTP collector
+
+Opens ``connections`` keep-alive connections to the collector and posts
+batches of synthetic events for ``duration`` seconds, then reports
+requests/sec, events/sec and latency percentiles::
+
+    python -m src.dau.collector.loadgen --url http://127.0.0.1:8080 --connections 16 --batch 100
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from datetime import datetime
+from typing import Any, Dict, List
+from urllib.parse import urlsplit
+
+ACTIVITY_TYPES = ['login', 'view', 'purchase', 'share']
+PLATFORMS = ['web', 'ios', 'android']
+
+def make_payload(batch: int, users: int) -> bytes:
+    now = datetime.now().isoformat()
+    return json.dumps([
+        {
+            'user_id': f'user_{random.randrange(users)}',
+            'timestamp': now,
+            'activity_type': random.choice(ACTIVITY_TYPES),
+            'platform': random.choice(PLATFORMS),
+            'metadata': {'session_duration': random.randint(1, 600)}
+        } for _ in range(batch)
+    ]).encode()
+
+async def _worker(host: str, port: int, path: str, deadline: float, batch: int,
+                  users: int, latencies: List[float], errors: List[int]):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while time.perf_counter() < deadline:
+            body = make_payload(batch, users)
+            started = time.perf_counter()
+            writer.write(
+                f'POST {path} HTTP/1.1\r\nHost: {host}\r\n'
+                f'Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n'.encode() + body
+            )
+            await writer.drain()
+
+            status = int((await reader.readline()).split()[1])
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                if name.lower() == 'content-length':
+                    length = int(value)
+            await reader.readexactly(length)
+
+            latencies.append(time.perf_counter() - started)
+            if status >= 300:
+                errors.append(status)
+    finally:
+        writer.close()
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+async def run_load(url: str, connections: int = 16, batch: int = 100, duration: float = 10.0,
+                   users: int = 100000) -> Dict[str, Any]:
+    """Post batches from every connection for duration seconds, return the measurements"""
+    parts = urlsplit(url)
+    path = (parts.path.rstrip('/') or '') + '/events'
+    latencies, errors = [], []
+    started = time.perf_counter()
+    deadline = started + duration
+    await asyncio.gather(*[
+        _worker(parts.hostname, parts.port or 80, path, deadline, batch, users, latencies, errors)
+        for _ in range(connections)
+    ])
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'requests_per_sec': len(latencies) / elapsed,
+        'events_per_sec': len(latencies) * batch / elapsed,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'max_ms': (latencies[-1] if latencies else 0.0) * 1000,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate load against a DAU collector')
+    parser.add_argument('--url', default='http://127.0.0.1:8080')
+    parser.add_argument('--connections', type=int, default=16)
+    parser.add_argument('--batch', type=int, default=100, help='Events per request')
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds to run')
+    parser.add_argument('--users', type=int, default=100000, help='Distinct synthetic users')
+    args = parser.parse_args()
+
+    result = asyncio.run(run_load(args.url, args.connections, args.batch, args.duration, args.users))
+    print(f"{result['requests']} requests ({result['errors']} errors) in {args.duration:.0f}s")
+    print(f"{result['requests_per_sec']:.0f} requests/sec, {result['events_per_sec']:.0f} events/sec")
+    print(f"latency p50 {result['p50_ms']:.1f} ms, p99 {result['p99_ms']:.1f} ms, max {result['max_ms']:.1f} ms")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+"""HTTP collector for user activities
+
+A small asyncio HTTP/1.1 server (keep-alive, no dependencies) in front of
+``AsyncDAUTracker``. Events from every connection land on the tracker's
+shared queue, so requests carrying a handful of events each still reach
+SQLite as large transactions.
+
+Endpoints:
+
+- ``POST /events``: a JSON array of activities, a JSON object with an
+  ``events`` array, or NDJSON (one activity per line). Each activity has
+  the fields of ``UserActivity.to_dict``; a missing timestamp means now.
+  Answers ``202`` with ``{"accepted": n}`` once the events are queued, or
+  ``200`` after they are committed when the query string has ``sync=1``.
+- ``GET /dau?date=YYYY-MM-DD``: daily active users (default today)
+- ``GET /trend?days=30``: ``DAUReport.get_dau_trend``
+- ``GET /health``: queue depth
+
+Request bodies need a ``Content-Length`` of at most 64 MiB; chunked
+uploads are answered with ``411``.
+
+Both ``/dau`` and ``/trend`` take ``timezone=UTC`` (or any zone added with
+``TimezoneManager``) to count by days in that timezone.
+
+Run it with::
+
+    python -m src.dau.collector --db dau_tracking.db --port 8080
+"""
+import argparse
+import asyncio
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+from zoneinfo import ZoneInfoNotFoundError
+from ..models.user_activity import UserActivity
+from ..reporting.report import DAUReport
+from ..storage.timezones import now
+from ..tracking.async_tracker import AsyncDAUTracker
+from ..tracking.tracker import DAUTracker
+
+MAX_BODY = 64 * 1024 * 1024
+
+REASONS = {
+    200: 'OK',
+    202: 'Accepted',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    411: 'Length Required',
+    413: 'Payload Too Large',
+    500: 'Internal Server Error',
+    501: 'Not Implemented',
+}
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+def parse_events(body: bytes, content_type: str = '') -> List[tuple]:
+    """Decode a JSON or NDJSON payload into tracker rows
+
+    Every event is converted before any is queued, so an invalid event
+    rejects the whole payload instead of leaving part of it committed.
+    """
+    text = body.decode('utf-8')
+    try:
+        if 'ndjson' in content_type or 'jsonlines' in content_type:
+            items = [json.loads(line) for line in text.splitlines() if line.strip()]
+        else:
+            items = json.loads(text)
+            if isinstance(items, dict):
+                items = items['events'] if 'events' in items else [items]
+        rows = []
+        for item in items:
+            activity = UserActivity.from_dict(item)
+            if not isinstance(activity.metadata, dict):
+                raise TypeError(f'metadata must be an object, got {type(activity.metadata).__name__}')
+            rows.append(DAUTracker._to_row(activity))
+        return rows
+    except (ValueError, KeyError, TypeError, AttributeError) as exc:
+        raise HTTPError(400, f'Invalid events payload: {exc}')
+
+class CollectorServer:
+    def __init__(self, db_path: str = 'dau_tracking.db', host: str = '127.0.0.1', port: int = 8080,
+                 max_queue: int = 100000, batch_size: int = 10000,
+                 rollup_interval: Optional[float] = 60.0):
+        self.host = host
+        self.port = port
+        self.tracker = AsyncDAUTracker(db_path, max_queue=max_queue, batch_size=batch_size,
+                                       rollup_interval=rollup_interval)
+        self.report = DAUReport(pool=self.tracker.tracker.pool)
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        # Port 0 picks a free port
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        await self.tracker.close()
+        self.report.close()
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Optional[Tuple[str, str, Dict[str, str], bytes]]:
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        try:
+            method, target, _ = request_line.decode('latin-1').split(' ', 2)
+        except ValueError:
+            raise HTTPError(400, 'Malformed request line')
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        encoding = headers.get('transfer-encoding')
+        if encoding is not None:
+            if 'chunked' in encoding.lower():
+                raise HTTPError(411, 'Chunked bodies are not supported, send a Content-Length')
+            raise HTTPError(501, f'Unsupported Transfer-Encoding: {encoding}')
+        value = headers.get('content-length', '0')
+        # int() alone would take signs, spaces and underscores
+        if not (value.isascii() and value.isdigit()):
+            raise HTTPError(400, f'Invalid Content-Length: {value}')
+        length = int(value)
+        if length > MAX_BODY:
+            raise HTTPError(413, 'Payload too large')
+        body = await reader.readexactly(length) if length else b''
+        return method, target, headers, body
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                    if request is None:
+                        break
+                    method, target, headers, body = request
+                    status, payload = await self.dispatch(method, target, headers, body)
+                    keep_alive = headers.get('connection', '').lower() != 'close'
+                except HTTPError as exc:
+                    status, payload, keep_alive = exc.status, {'error': str(exc)}, False
+                except Exception as exc:
+                    status, payload, keep_alive = 500, {'error': str(exc)}, False
+
+                data = json.dumps(payload).encode()
+                writer.write(
+                    f'HTTP/1.1 {status} {REASONS[status]}\r\n'
+                    f'Content-Type: application/json\r\n'
+                    f'Content-Length: {len(data)}\r\n'
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + data
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, method: str, target: str, headers: Dict[str, str], body: bytes) -> Tuple[int, Any]:
+        url = urlsplit(target)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        loop = asyncio.get_running_loop()
+
+        if url.path == '/events':
+            if method != 'POST':
+                raise HTTPError(405, 'Use POST')
+            rows = parse_events(body, headers.get('content-type', ''))
+            accepted = await self.tracker.log_rows(rows)
+            if query.get('sync') == '1':
+                await self.tracker.flush()
+                return 200, {'accepted': accepted}
+            return 202, {'accepted': accepted}
+
+        if method != 'GET':
+            raise HTTPError(405, 'Use GET')
+
+        if url.path == '/dau':
+            timezone = query.get('timezone')
+            try:
+                date = datetime.fromisoformat(query['date']) if 'date' in query else None
+            except ValueError:
+                raise HTTPError(400, f"Invalid date: {query['date']}")
+            try:
+                date = date or now(timezone)
+                count = await self.tracker.get_daily_active_user_count(date, timezone)
+            except (ValueError, ZoneInfoNotFoundError) as e:
+                raise HTTPError(400, str(e))
+            return 200, {'date': date.date().isoformat(), 'daily_active_users': count}
+        if url.path == '/trend':
+            try:
+                days = int(query.get('days', 30))
+            except ValueError:
+                raise HTTPError(400, f"Invalid days: {query['days']}")
+            await self.tracker.flush()
+            try:
+                return 200, await loop.run_in_executor(None, self.report.get_dau_trend, days,
+                                                       query.get('timezone'))
+            except (ValueError, ZoneInfoNotFoundError) as e:
+                raise HTTPError(400, str(e))
+        if url.path == '/health':
+            return 200, {'status': 'ok', 'queued': self.tracker.queued}
+        raise HTTPError(404, f'No route for {url.path}')
+
+async def serve(args):
+    server = CollectorServer(args.db, args.host, args.port, args.max_queue, args.batch_size,
+                             args.rollup_interval)
+    await server.start()
+    print(f"Collecting into {args.db} on http://{server.host}:{server.port}")
+    try:
+        await server.serve_forever()
+    finally:
+        await server.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='HTTP collector for DAU events')
+    parser.add_argument('--db', default='dau_tracking.db')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--max-queue', type=int, default=100000)
+    parser.add_argument('--batch-size', type=int, default=10000)
+    parser.add_argument('--rollup-interval', type=float, default=60.0,
+                        help='Seconds between rollup refreshes after writes')
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -1,126 +1,154 @@
-import sqlite3
-from datetime import datetime, timedelta
-from typing import List, Dict, Any
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import groupby
+from operator import itemgetter
+from typing import List, Dict, Any, Optional, Sequence, Tuple
+import numpy as np
+from .engine import Forecast, ForecastEngine, forecast_segments
+from ..metrics.instrumentation import instrumented
+from ..storage.cache import cached, daily_active_users
+from ..storage.partition import activity_source
+from ..storage.pool import ConnectionPool
+from ..storage.rollup import DIMENSIONS, RollupManager
+from ..storage.schema import epoch_day
+from ..storage.timezones import now
 
 class SimpleDAUPredictor:
-    def __init__(self, db_path: str = 'dau_tracking.db'):
-        self.db_path = db_path
+    def __init__(self, db_path: str = 'dau_tracking.db', pool: Optional[ConnectionPool] = None):
+        self._owns_pool = pool is None
+        self.pool = pool or ConnectionPool(db_path)
+        self.db_path = self.pool.db_path
 
-    def _get_historical_dau(self, days: int = 30) -> List[Dict[str, Any]]:
-        """Retrieve historical Daily Active Users data"""
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=days)
+    def close(self):
+        if self._owns_pool:
+            self.pool.close()
 
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute('''
-                SELECT 
-                    date(timestamp) as activity_date, 
-                    COUNT(DISTINCT user_id) as daily_active_users,
-                    strftime('%w', timestamp) as day_of_week,
-                    strftime('%m', timestamp) as month
-                FROM user_activities
-                WHERE timestamp >= ? AND timestamp <= ?
-                GROUP BY activity_date
-                ORDER BY activity_date
-            ''', (start_date.isoformat(), end_date.isoformat()))
-
-            return [
-                {
-                    'date': row[0], 
-                    'dau': row[1],
-                    'day_of_week': int(row[2]),
-                    'month': int(row[3])
-                } for row in cursor.fetchall()
-            ]
-
-    def predict_dau(self, days_to_predict: int = 7) -> List[Dict[str, Any]]:
-        """Simple DAU prediction based on historical patterns with confidence calculation"""
-        historical_data = self._get_historical_dau()
-        
-        # Basic prediction strategies
-        predictions = []
-        
-        # Strategy 1: Average DAU
-        avg_dau = sum(day['dau'] for day in historical_data) / len(historical_data)
-        
-        # Strategy 2: Day of Week Pattern
-        day_of_week_avg = {}
-        day_of_week_std = {}
-        for day in historical_data:
-            day_of_week_avg.setdefault(day['day_of_week'], []).append(day['dau'])
-        
-        # Calculate mean and standard deviation for each day of week
-        day_of_week_stats = {}
-        for dow, daus in day_of_week_avg.items():
-            mean_dau = sum(daus) / len(daus)
-            std_dau = (sum((x - mean_dau) ** 2 for x in daus) / len(daus)) ** 0.5
-            day_of_week_stats[dow] = {
-                'mean': mean_dau,
-                'std': std_dau
-            }
-        
-        for i in range(days_to_predict):
-            prediction_date = datetime.now() + timedelta(days=i)
-            day_of_week = prediction_date.weekday()
-            
-            # Blend strategies with weighted average
-            day_week_stats = day_of_week_stats.get(day_of_week, {'mean': avg_dau, 'std': 0})
-            predicted_dau = (
-                avg_dau * 0.4 + 
-                day_week_stats['mean'] * 0.6
-            )
-            
-            # Confidence Calculation
-            # Lower standard deviation means higher confidence
-            confidence_score = 1 - min(1, day_week_stats['std'] / (predicted_dau + 1))
-            
-            # Adjust confidence based on data richness
-            data_points_for_day = len(day_of_week_avg.get(day_of_week, []))
-            data_richness_factor = min(1, data_points_for_day / len(historical_data))
-            
-            confidence_level = (
-                confidence_score * 0.7 +  # Prediction stability
-                data_richness_factor * 0.3  # Data availability
-            )
-            
-            # Map confidence to descriptive levels
-            if confidence_level > 0.8:
-                confidence_desc = 'high'
-            elif confidence_level > 0.5:
-                confidence_desc = 'medium'
+    def _get_historical_series(self, days: int = 30,
+                               timezone: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Historical (day numbers, DAU) as arrays"""
+        end_day = epoch_day(now(timezone))
+        start_day = end_day - days
+
+        history = daily_active_users(self.pool, start_day, end_day, timezone)
+        series = np.array(history, dtype=np.int64).reshape(-1, 2)
+        return series[:, 0], series[:, 1]
+
+    @instrumented
+    def forecast(self, days_to_predict: int = 7, history_days: int = 30,
+                 timezone: Optional[str] = None) -> Forecast:
+        """Forecast the next days_to_predict days as arrays, by days in timezone if given"""
+        engine = ForecastEngine(*self._get_historical_series(history_days, timezone))
+        return engine.forecast(epoch_day(now(timezone)), days_to_predict)
+
+    def _get_segment_series(self, dimensions: Sequence[str], days: int = 30) -> List[Tuple[tuple, np.ndarray, np.ndarray]]:
+        """(segment key, day numbers, DAU) for every segment, from one grouped query
+
+        A single dimension is read from the daily rollups; combinations of
+        dimensions are grouped from the raw events.
+        """
+        for dimension in dimensions:
+            if dimension not in DIMENSIONS:
+                raise ValueError(f"Cannot segment by {dimension}, choose from {', '.join(DIMENSIONS)}")
+        end_day = epoch_day(datetime.now())
+        start_day = end_day - days
+        dimensions = tuple(dimensions)
+        return cached(self.pool, ('segment_series', dimensions, start_day, end_day), start_day, end_day,
+                      lambda: self._segment_series(dimensions, start_day, end_day))
+
+    def _segment_series(self, dimensions: Tuple[str, ...], start_day: int,
+                        end_day: int) -> List[Tuple[tuple, np.ndarray, np.ndarray]]:
+        # Missing values group as '', like the rollups of a single dimension
+        columns = ', '.join(f"COALESCE({dimension}, '')" for dimension in dimensions)
+        with self.pool.snapshot() as conn:
+            if len(dimensions) == 1:
+                cursor = RollupManager.daily_dimension_users(conn, dimensions[0], start_day, end_day)
             else:
-                confidence_desc = 'low'
-            
-            predictions.append({
-                'date': prediction_date.date(),
-                'predicted_dau': int(predicted_dau),
-                'confidence_score': round(confidence_level, 2),
-                'confidence_level': confidence_desc,
-                'prediction_details': {
-                    'avg_dau': round(avg_dau, 2),
-                    'day_of_week_mean': round(day_week_stats['mean'], 2),
-                    'day_of_week_std': round(day_week_stats['std'], 2)
-                }
-            })
-        
-        return predictions
+                cursor = conn.execute(f'''
+                    SELECT {columns}, day, COUNT(DISTINCT user_id)
+                    FROM {activity_source(conn, start_day, end_day)}
+                    WHERE day BETWEEN ? AND ?
+                    GROUP BY {columns}, day
+                    ORDER BY {columns}, day
+                ''', (start_day, end_day))
+
+            width = len(dimensions)
+            segments = []
+            for key, rows in groupby(cursor, key=itemgetter(*range(width))):
+                series = np.array([row[width:] for row in rows], dtype=np.int64)
+                key = key if width > 1 else (key,)
+                segments.append((key, series[:, 0], series[:, 1]))
+            return segments
+
+    @instrumented
+    def predict_segments(self, dimensions: Sequence[str] = ('platform',), days_to_predict: int = 7,
+                         history_days: int = 30, max_workers: Optional[int] = None,
+                         parallel_threshold: int = 64) -> List[Dict[str, Any]]:
+        """Forecast DAU separately for every combination of the given dimensions
+
+        All segment series come from a single grouped query. When there are
+        at least parallel_threshold segments, fitting and forecasting is
+        spread over a process pool of max_workers (default: all cores).
+        Returns one tidy row per segment and forecast day.
+        """
+        segments = self._get_segment_series(dimensions, history_days)
+        start_day = epoch_day(datetime.now())
+
+        if len(segments) < parallel_threshold:
+            results = forecast_segments(segments, start_day, days_to_predict)
+        else:
+            workers = max_workers or os.cpu_count() or 1
+            # A few chunks per worker keeps them busy without per-segment IPC
+            chunk_size = max(1, -(-len(segments) // (workers * 4)))
+            chunks = [segments[i:i + chunk_size] for i in range(0, len(segments), chunk_size)]
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = [
+                    result
+                    for chunk_results in executor.map(
+                        forecast_segments, chunks,
+                        [start_day] * len(chunks), [days_to_predict] * len(chunks)
+                    )
+                    for result in chunk_results
+                ]
+
+        rows = []
+        for key, forecast in results:
+            segment = dict(zip(dimensions, key))
+            for record in forecast.to_records():
+                rows.append({
+                    **segment,
+                    'date': record['date'],
+                    'predicted_dau': record['predicted_dau'],
+                    'confidence_score': record['confidence_score'],
+                    'confidence_level': record['confidence_level']
+                })
+        return rows
+
+    @instrumented
+    def predict_dau(self, days_to_predict: int = 7, timezone: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Simple DAU prediction based on historical patterns with confidence calculation"""
+        return self.forecast(days_to_predict, timezone=timezone).to_records()
 
+    @instrumented
     def analyze_user_segments(self, days: int = 30) -> Dict[str, Any]:
         """Analyze user segments based on activity frequency"""
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=days)
+        end_day = epoch_day(datetime.now())
+        start_day = end_day - days
+        return cached(self.pool, ('user_segments', start_day, end_day), start_day, end_day,
+                      lambda: self._analyze_user_segments(start_day, end_day))
 
-        with sqlite3.connect(self.db_path) as conn:
+    def _analyze_user_segments(self, start_day: int, end_day: int) -> Dict[str, Any]:
+        with self.pool.snapshot() as conn:
             # User activity frequency analysis
-            cursor = conn.execute('''
+            cursor = conn.execute(f'''
                 SELECT 
                     user_id, 
-                    COUNT(DISTINCT date(timestamp)) as activity_days,
+                    COUNT(DISTINCT day) as activity_days,
                     COUNT(*) as total_activities
-                FROM user_activities
-                WHERE timestamp >= ? AND timestamp <= ?
+                FROM {activity_source(conn, start_day, end_day)}
+                WHERE day BETWEEN ? AND ?
                 GROUP BY user_id
-            ''', (start_date.isoformat(), end_date.isoformat()))
+            ''', (start_day, end_day))
 
             user_data = cursor.fetchall()
 
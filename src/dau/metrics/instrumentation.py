@@ -0,0 +1,521 @@
+"""Timing of methods, SQL statements and connection waits
+
+Pass an ``Instrumentation`` to ``ConnectionPool`` to turn it on for
+everything sharing the pool::
+
+    registry = MetricsRegistry()
+    instrumentation = Instrumentation([registry, PrometheusFileSink('dau.prom', registry)],
+                                      slow_query_seconds=0.5)
+    pool = ConnectionPool('dau_tracking.db', instrumentation=instrumentation)
+    DAUReport(pool=pool).get_dau_trend(30)
+    print(registry.to_prometheus())
+
+What is recorded:
+
+- every public ``DAUTracker``, ``DAUReport`` and ``SimpleDAUPredictor``
+  call: duration and whether it raised
+- every statement run on a pool connection: duration from ``execute``
+  until its rows are consumed (time spent by the caller between fetches
+  excluded), rows returned, and SQLite virtual machine steps as a measure
+  of the work done (rows scanned, approximately, in units of
+  ``STEP_GRANULARITY`` instructions), labelled with the innermost
+  instrumented method
+- time spent waiting for the writer or a reader connection
+- statements slower than ``slow_query_seconds`` with their
+  ``EXPLAIN QUERY PLAN``, captured once per statement
+
+Sinks receive each measurement as it happens: ``MetricsRegistry``
+aggregates histograms and counters in process, ``LoggingSink`` writes log
+lines and ``PrometheusFileSink`` keeps a Prometheus text-format file
+current for the node exporter's textfile collector.
+
+A pool without instrumentation hands out plain ``sqlite3`` connections and
+instrumented methods only check ``pool.instrumentation``, so the layer
+costs nothing measurable when it is off.
+"""
+import functools
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+# Latency histogram buckets in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# SQLite VM instructions between progress callbacks
+STEP_GRANULARITY = 1000
+
+# Rows fetched per step when a cursor is iterated
+ITERATION_CHUNK = 256
+
+_WHITESPACE = re.compile(r'\s+')
+_PARTITION = re.compile(r'\buser_activities_[dm]\d+\b')
+_PARTITION_UNION = re.compile(r'(SELECT \* FROM user_activities_\* UNION ALL )+')
+_PLACEHOLDERS = re.compile(r'\?(, \?)+')
+
+def statement_key(sql: str) -> str:
+    """SQL collapsed to one line, with partition names and IN lists folded
+
+    Statements that differ only in which partitions or how many values
+    they name share a key, which keeps metric labels bounded.
+    """
+    key = _WHITESPACE.sub(' ', sql).strip()
+    key = _PARTITION.sub('user_activities_*', key)
+    key = _PARTITION_UNION.sub('', key)
+    return _PLACEHOLDERS.sub('?, ...', key)
+
+class Sink:
+    """Receives measurements; every hook defaults to doing nothing"""
+
+    def method(self, name: str, seconds: float, error: bool):
+        pass
+
+    def statement(self, method: str, statement: str, seconds: float, rows: int, steps: int):
+        pass
+
+    def connection_wait(self, kind: str, seconds: float):
+        pass
+
+    def slow_query(self, method: str, statement: str, seconds: float, plan: Optional[List[str]]):
+        pass
+
+class Histogram:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        index = 0
+        while index < len(BUCKETS) and value > BUCKETS[index]:
+            index += 1
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, fraction: float) -> Optional[float]:
+        """Upper bound of the bucket holding the fraction-th observation"""
+        if not self.count:
+            return None
+        target = fraction * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS + (float('inf'),), self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float('inf')
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+class MetricsRegistry(Sink):
+    """In-process histograms and counters of everything reported to it"""
+
+    def __init__(self, slow_queries: int = 100):
+        self._lock = threading.Lock()
+        # metric -> label values -> Histogram or count
+        self.histograms: Dict[str, Dict[tuple, Histogram]] = defaultdict(lambda: defaultdict(Histogram))
+        self.counters: Dict[str, Dict[tuple, float]] = defaultdict(lambda: defaultdict(float))
+        self.slow_queries = deque(maxlen=slow_queries)
+
+    def method(self, name: str, seconds: float, error: bool):
+        with self._lock:
+            self.histograms['dau_method_seconds'][(name,)].observe(seconds)
+            if error:
+                self.counters['dau_method_errors_total'][(name,)] += 1
+
+    def statement(self, method: str, statement: str, seconds: float, rows: int, steps: int):
+        labels = (method, statement)
+        with self._lock:
+            self.histograms['dau_statement_seconds'][labels].observe(seconds)
+            self.counters['dau_statement_rows_total'][labels] += rows
+            self.counters['dau_statement_vm_steps_total'][labels] += steps
+
+    def connection_wait(self, kind: str, seconds: float):
+        with self._lock:
+            self.histograms['dau_connection_wait_seconds'][(kind,)].observe(seconds)
+
+    def slow_query(self, method: str, statement: str, seconds: float, plan: Optional[List[str]]):
+        with self._lock:
+            self.counters['dau_slow_queries_total'][(method, statement)] += 1
+            self.slow_queries.append({
+                'method': method,
+                'statement': statement,
+                'seconds': seconds,
+                'plan': plan,
+                'at': time.time(),
+            })
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+            self.slow_queries.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Plain-data copy: per series count, sum, p50/p99 bucket bounds and counters"""
+        with self._lock:
+            return {
+                'histograms': {
+                    metric: [
+                        {
+                            'labels': dict(zip(LABEL_NAMES[metric], labels)),
+                            'count': histogram.count,
+                            'sum': histogram.sum,
+                            'p50': histogram.quantile(0.5),
+                            'p99': histogram.quantile(0.99),
+                        } for labels, histogram in series.items()
+                    ] for metric, series in self.histograms.items()
+                },
+                'counters': {
+                    metric: [
+                        {'labels': dict(zip(LABEL_NAMES[metric], labels)), 'value': value}
+                        for labels, value in series.items()
+                    ] for metric, series in self.counters.items()
+                },
+                'slow_queries': list(self.slow_queries),
+            }
+
+    def slowest_statements(self, limit: int = 10) -> List[Dict[str, Any]]:
+        """Statements by total time, the first place to look when a dashboard is slow"""
+        with self._lock:
+            series = self.histograms.get('dau_statement_seconds', {})
+            rows = self.counters.get('dau_statement_rows_total', {})
+            steps = self.counters.get('dau_statement_vm_steps_total', {})
+            ranked = sorted(series.items(), key=lambda item: item[1].sum, reverse=True)[:limit]
+            return [
+                {
+                    'method': labels[0],
+                    'statement': labels[1],
+                    'calls': histogram.count,
+                    'total_seconds': histogram.sum,
+                    'p99_seconds': histogram.quantile(0.99),
+                    'rows': int(rows.get(labels, 0)),
+                    'vm_steps': int(steps.get(labels, 0)),
+                } for labels, histogram in ranked
+            ]
+
+    def to_prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            for metric, series in sorted(self.histograms.items()):
+                lines.append(f'# HELP {metric} {HELP[metric]}')
+                lines.append(f'# TYPE {metric} histogram')
+                names = LABEL_NAMES[metric]
+                for labels, histogram in series.items():
+                    cumulative = 0
+                    for bound, count in zip(BUCKETS + (float('inf'),), histogram.counts):
+                        cumulative += count
+                        le = '+Inf' if bound == float('inf') else repr(bound)
+                        bucket_labels = _labels(names, labels, f'le="{le}"')
+                        lines.append(f'{metric}_bucket{bucket_labels} {cumulative}')
+                    lines.append(f'{metric}_sum{_labels(names, labels)} {histogram.sum}')
+                    lines.append(f'{metric}_count{_labels(names, labels)} {histogram.count}')
+            for metric, series in sorted(self.counters.items()):
+                lines.append(f'# HELP {metric} {HELP[metric]}')
+                lines.append(f'# TYPE {metric} counter')
+                names = LABEL_NAMES[metric]
+                for labels, value in series.items():
+                    lines.append(f'{metric}{_labels(names, labels)} {value:g}')
+        return '\n'.join(lines) + '\n'
+
+LABEL_NAMES = {
+    'dau_method_seconds': ('method',),
+    'dau_method_errors_total': ('method',),
+    'dau_statement_seconds': ('method', 'statement'),
+    'dau_statement_rows_total': ('method', 'statement'),
+    'dau_statement_vm_steps_total': ('method', 'statement'),
+    'dau_connection_wait_seconds': ('kind',),
+    'dau_slow_queries_total': ('method', 'statement'),
+}
+
+HELP = {
+    'dau_method_seconds': 'Duration of DAU tracker, report and predictor calls',
+    'dau_method_errors_total': 'Calls that raised',
+    'dau_statement_seconds': 'Duration of SQL statements until their rows were consumed',
+    'dau_statement_rows_total': 'Rows returned by SQL statements',
+    'dau_statement_vm_steps_total': 'Approximate SQLite VM instructions executed by SQL statements',
+    'dau_connection_wait_seconds': 'Time spent waiting for a pool connection',
+    'dau_slow_queries_total': 'Statements slower than the slow query threshold',
+}
+
+class LoggingSink(Sink):
+    """Log lines: slow queries at WARNING, everything else at DEBUG"""
+
+    def __init__(self, logger: Optional[logging.Logger] = None):
+        self.logger = logger or logging.getLogger('dau.metrics')
+
+    def method(self, name: str, seconds: float, error: bool):
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug('method=%s seconds=%.6f error=%s', name, seconds, error)
+
+    def statement(self, method: str, statement: str, seconds: float, rows: int, steps: int):
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug('method=%s seconds=%.6f rows=%d vm_steps=%d statement=%s',
+                              method, seconds, rows, steps, statement)
+
+    def connection_wait(self, kind: str, seconds: float):
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug('connection=%s wait_seconds=%.6f', kind, seconds)
+
+    def slow_query(self, method: str, statement: str, seconds: float, plan: Optional[List[str]]):
+        self.logger.warning('slow query method=%s seconds=%.3f statement=%s%s', method, seconds, statement,
+                            ''.join(f'\n  {line}' for line in plan or ()))
+
+class PrometheusFileSink(Sink):
+    """Rewrite a Prometheus text-format file from a registry every interval seconds
+
+    Pass the registry that also receives the measurements (listed before
+    this sink). The file is replaced atomically, so a scraper never reads
+    half of it; ``write`` forces an update, e.g. at shutdown.
+    """
+
+    def __init__(self, path: str, registry: MetricsRegistry, interval: float = 15.0):
+        self.path = path
+        self.registry = registry
+        self.interval = interval
+        self._last_write = 0.0
+        self._lock = threading.Lock()
+
+    def _maybe_write(self):
+        if time.monotonic() - self._last_write >= self.interval:
+            self.write()
+
+    def write(self):
+        with self._lock:
+            self._last_write = time.monotonic()
+            temporary = f'{self.path}.{os.getpid()}.tmp'
+            with open(temporary, 'w') as f:
+                f.write(self.registry.to_prometheus())
+            os.replace(temporary, self.path)
+
+    def method(self, name: str, seconds: float, error: bool):
+        self._maybe_write()
+
+    def statement(self, method: str, statement: str, seconds: float, rows: int, steps: int):
+        self._maybe_write()
+
+class Instrumentation:
+    """Fans measurements out to sinks and tracks the current method per thread"""
+
+    def __init__(self, sinks: Iterable[Sink] = (), slow_query_seconds: Optional[float] = None,
+                 explain: bool = True):
+        self.sinks = list(sinks) or [MetricsRegistry()]
+        self.slow_query_seconds = slow_query_seconds
+        self.explain = explain
+        self._local = threading.local()
+        self._keys: Dict[str, str] = {}
+        self._plans: Dict[str, List[str]] = {}
+
+    @property
+    def registry(self) -> Optional[MetricsRegistry]:
+        """The first MetricsRegistry among the sinks"""
+        return next((sink for sink in self.sinks if isinstance(sink, MetricsRegistry)), None)
+
+    def current_method(self) -> str:
+        stack = getattr(self._local, 'stack', None)
+        return stack[-1] if stack else ''
+
+    def key(self, sql: str) -> str:
+        key = self._keys.get(sql)
+        if key is None:
+            if len(self._keys) >= 4096:
+                self._keys.clear()
+            key = self._keys[sql] = statement_key(sql)
+        return key
+
+    def call(self, name: str, function: Callable, *args, **kwargs):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        stack.append(name)
+        error = True
+        started = time.perf_counter()
+        try:
+            result = function(*args, **kwargs)
+            error = False
+            return result
+        finally:
+            seconds = time.perf_counter() - started
+            stack.pop()
+            for sink in self.sinks:
+                sink.method(name, seconds, error)
+
+    def record_wait(self, kind: str, seconds: float):
+        for sink in self.sinks:
+            sink.connection_wait(kind, seconds)
+
+    def record_statement(self, conn: sqlite3.Connection, sql: str, parameters: Any, method: str,
+                         seconds: float, rows: int, steps: int):
+        key = self.key(sql)
+        for sink in self.sinks:
+            sink.statement(method, key, seconds, rows, steps)
+        if self.slow_query_seconds is not None and seconds >= self.slow_query_seconds:
+            plan = self._plan(conn, sql, parameters, key) if self.explain else None
+            for sink in self.sinks:
+                sink.slow_query(method, key, seconds, plan)
+
+    def _plan(self, conn: sqlite3.Connection, sql: str, parameters: Any, key: str) -> Optional[List[str]]:
+        plan = self._plans.get(key)
+        if plan is None:
+            try:
+                plan = [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', parameters or ())]
+            except sqlite3.Error:
+                return None
+            self._plans[key] = plan
+        return plan
+
+    @staticmethod
+    def install(conn: sqlite3.Connection) -> List[int]:
+        """Count VM steps on conn in the returned counter, in STEP_GRANULARITY units"""
+        counter = [0]
+
+        def progress():
+            counter[0] += 1
+            return 0
+
+        conn.set_progress_handler(progress, STEP_GRANULARITY)
+        return counter
+
+    def wrap(self, conn: sqlite3.Connection, counter: List[int]) -> 'InstrumentedConnection':
+        return InstrumentedConnection(conn, self, counter)
+
+class InstrumentedCursor:
+    """Cursor that times its fetches and reports once its rows are consumed or it is dropped"""
+    __slots__ = ('_cursor', '_connection', '_sql', '_parameters', '_method', '_seconds',
+                 '_rows', '_steps', '_done')
+
+    def __init__(self, cursor: sqlite3.Cursor, connection: 'InstrumentedConnection', sql: str,
+                 parameters: Any, method: str, seconds: float, steps: int):
+        self._cursor = cursor
+        self._connection = connection
+        self._sql = sql
+        self._parameters = parameters
+        self._method = method
+        self._seconds = seconds
+        self._rows = 0
+        self._steps = steps
+        self._done = False
+
+    def _finish(self):
+        if not self._done:
+            self._done = True
+            connection = self._connection
+            connection._instrumentation.record_statement(
+                connection._conn, self._sql, self._parameters, self._method, self._seconds, self._rows,
+                connection.steps() - self._steps
+            )
+
+    def _timed(self, fetch: Callable, *args) -> Any:
+        started = time.perf_counter()
+        result = fetch(*args)
+        self._seconds += time.perf_counter() - started
+        return result
+
+    def fetchone(self):
+        row = self._timed(self._cursor.fetchone)
+        if row is None:
+            self._finish()
+        else:
+            self._rows += 1
+        return row
+
+    def fetchmany(self, size: Optional[int] = None):
+        size = self._cursor.arraysize if size is None else size
+        rows = self._timed(self._cursor.fetchmany, size)
+        self._rows += len(rows)
+        if len(rows) < size:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(self._cursor.fetchall)
+        self._rows += len(rows)
+        self._finish()
+        return rows
+
+    def __iter__(self):
+        while True:
+            rows = self.fetchmany(ITERATION_CHUNK)
+            yield from rows
+            if len(rows) < ITERATION_CHUNK:
+                return
+
+    def close(self):
+        self._cursor.close()
+        self._finish()
+
+    def __del__(self):
+        try:
+            self._finish()
+        except Exception:
+            pass
+
+    def __getattr__(self, name: str):
+        return getattr(self._cursor, name)
+
+class InstrumentedConnection:
+    """sqlite3.Connection stand-in that reports every statement"""
+    __slots__ = ('_conn', '_instrumentation', '_counter')
+
+    def __init__(self, conn: sqlite3.Connection, instrumentation: Instrumentation, counter: List[int]):
+        self._conn = conn
+        self._instrumentation = instrumentation
+        self._counter = counter
+
+    def steps(self) -> int:
+        return self._counter[0] * STEP_GRANULARITY
+
+    def execute(self, sql: str, parameters: Any = ()) -> InstrumentedCursor:
+        steps = self.steps()
+        started = time.perf_counter()
+        raw = self._conn.execute(sql, parameters)
+        cursor = InstrumentedCursor(raw, self, sql, parameters, self._instrumentation.current_method(),
+                                    time.perf_counter() - started, steps)
+        if raw.description is None:
+            # No result rows (DDL or DML): the statement already ran to completion
+            cursor._rows = max(raw.rowcount, 0)
+            cursor._finish()
+        return cursor
+
+    def executemany(self, sql: str, parameters: Iterable[Any]) -> sqlite3.Cursor:
+        steps = self.steps()
+        started = time.perf_counter()
+        cursor = self._conn.executemany(sql, parameters)
+        self._instrumentation.record_statement(
+            self._conn, sql, None, self._instrumentation.current_method(), time.perf_counter() - started,
+            max(cursor.rowcount, 0), self.steps() - steps
+        )
+        return cursor
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return self._conn.__exit__(exc_type, exc, tb)
+
+    def __getattr__(self, name: str):
+        return getattr(self._conn, name)
+
+def instrumented(method: Callable) -> Callable:
+    """Time a method of a class with a ``pool`` when the pool is instrumented"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        instrumentation = self.pool.instrumentation
+        if instrumentation is None:
+            return method(self, *args, **kwargs)
+        return instrumentation.call(f'{type(self).__name__}.{method.__name__}', method, self, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,212 @@
+"""Columnar batch of user activities for high-volume ingestion
+
+An ``ActivityBatch`` keeps one array per field instead of one object per
+event: timestamps as doubles, user ids, activity types, platforms, regions
+and devices as dictionary codes, session durations as integers. Metadata
+keys other than the promoted ones are kept as encoded JSON, and only for
+batches that have any. ``DAUTracker.log_activities`` accepts a batch
+directly and reads rows straight from the arrays.
+
+Timestamps are wall-clock times stored as seconds since
+1970-01-01T00:00:00, so the day number is simply ``seconds // 86400``.
+Timezone-aware timestamps keep their UTC offset alongside, so a batch
+stores the same timestamp and day as ``DAUTracker.log_activity`` would.
+"""
+from array import array
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence
+from .metadata import decode_metadata, encode_metadata
+from .user_activity import UserActivity
+
+EPOCH = datetime(1970, 1, 1)
+SECONDS_PER_DAY = 86400
+
+# Marks a missing session_duration in the integer column
+MISSING = -(1 << 63)
+
+def to_wall_seconds(timestamp: datetime) -> float:
+    """Seconds since the epoch of the wall-clock time, at the timestamp's own offset if any"""
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.replace(tzinfo=None)
+    return (timestamp - EPOCH).total_seconds()
+
+def from_wall_seconds(seconds: float) -> datetime:
+    return EPOCH + timedelta(seconds=seconds)
+
+class DictionaryColumn:
+    """Interned values with a compact array of codes"""
+    __slots__ = ('values', 'index', 'codes')
+
+    def __init__(self, typecode: str = 'I', values: Sequence[Any] = ()):
+        self.values = list(values)
+        self.index = {value: code for code, value in enumerate(self.values)}
+        self.codes = array(typecode)
+
+    @classmethod
+    def from_codes(cls, values: Sequence[Any], codes: Any, typecode: str = 'I') -> 'DictionaryColumn':
+        """Column over existing values from a buffer of codes, e.g. a NumPy array
+
+        The value index is only built if values are appended later, so
+        large shared value lists are cheap to wrap.
+        """
+        column = cls.__new__(cls)
+        column.values = values if isinstance(values, list) else list(values)
+        column.index = None
+        column.codes = array(typecode)
+        column.codes.frombytes(memoryview(codes).cast('B'))
+        return column
+
+    def code(self, value: Any) -> int:
+        if self.index is None:
+            self.index = {value: code for code, value in enumerate(self.values)}
+        code = self.index.get(value)
+        if code is None:
+            code = self.index[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def append(self, value: Any):
+        self.codes.append(self.code(value))
+
+    def __getitem__(self, i: int) -> Any:
+        return self.values[self.codes[i]]
+
+    def decoded(self) -> Iterator[Any]:
+        return map(self.values.__getitem__, self.codes)
+
+class ActivityBatch:
+    def __init__(self):
+        self.user_ids = DictionaryColumn('I')
+        self.timestamps = array('d')
+        self.activity_types = DictionaryColumn('H')
+        self.platforms = DictionaryColumn('H')
+        self.regions = DictionaryColumn('H', [None])
+        self.devices = DictionaryColumn('H', [None])
+        self.session_durations = array('q')
+        # Encoded non-promoted metadata, allocated on first use
+        self.extra_metadata: Optional[List[Optional[str]]] = None
+        # ISO UTC offsets ('-05:00') of aware timestamps, allocated on first use
+        self.offsets: Optional[List[Optional[str]]] = None
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def append(self, user_id: str, timestamp: datetime, activity_type: str = '',
+               platform: str = '', metadata: Optional[Dict[str, Any]] = None):
+        region, device, session_duration, extra = encode_metadata(metadata)
+        if extra is not None and self.extra_metadata is None:
+            self.extra_metadata = [None] * len(self)
+        if self.extra_metadata is not None:
+            self.extra_metadata.append(extra)
+
+        if timestamp.tzinfo is not None and self.offsets is None:
+            self.offsets = [None] * len(self)
+        if self.offsets is not None:
+            wall_clock = timestamp.replace(tzinfo=None).isoformat()
+            self.offsets.append(timestamp.isoformat()[len(wall_clock):] or None)
+
+        self.user_ids.append(user_id)
+        self.timestamps.append(to_wall_seconds(timestamp))
+        self.activity_types.append(activity_type)
+        self.platforms.append(platform)
+        self.regions.append(region)
+        self.devices.append(device)
+        self.session_durations.append(MISSING if session_duration is None else session_duration)
+
+    def add(self, activity: UserActivity):
+        self.append(activity.user_id, activity.timestamp, activity.activity_type,
+                    activity.platform, activity.metadata)
+
+    @classmethod
+    def from_columns(cls, user_ids: DictionaryColumn, timestamps: Any, activity_types: DictionaryColumn,
+                     platforms: DictionaryColumn, regions: Optional[DictionaryColumn] = None,
+                     devices: Optional[DictionaryColumn] = None,
+                     session_durations: Any = None) -> 'ActivityBatch':
+        """Batch over ready-made columns without touching events one by one
+
+        timestamps are wall-clock seconds (float64 buffer) and
+        session_durations int64 with MISSING for gaps. regions and devices
+        must have None as code 0, like the columns of an empty batch.
+        """
+        batch = cls()
+        batch.user_ids = user_ids
+        batch.timestamps.frombytes(memoryview(timestamps).cast('B'))
+        batch.activity_types = activity_types
+        batch.platforms = platforms
+        count = len(batch.timestamps)
+        for name, column in (('regions', regions), ('devices', devices)):
+            if column is None:
+                column = DictionaryColumn('H', [None])
+                column.codes.frombytes(bytes(2 * count))
+            setattr(batch, name, column)
+        if session_durations is None:
+            batch.session_durations = array('q', [MISSING]) * count
+        else:
+            batch.session_durations.frombytes(memoryview(session_durations).cast('B'))
+        return batch
+
+    @classmethod
+    def from_activities(cls, activities: Iterable[UserActivity]) -> 'ActivityBatch':
+        batch = cls()
+        for activity in activities:
+            batch.add(activity)
+        return batch
+
+    def _durations(self) -> Iterator[Optional[int]]:
+        return (None if value == MISSING else value for value in self.session_durations)
+
+    def _extras(self) -> Iterable[Optional[str]]:
+        if self.extra_metadata is None:
+            return (None for _ in range(len(self)))
+        return self.extra_metadata
+
+    def _offsets(self) -> Iterable[Optional[str]]:
+        if self.offsets is None:
+            return (None for _ in range(len(self)))
+        return self.offsets
+
+    def _timestamp(self, seconds: float, offset: Optional[str]) -> str:
+        timestamp = from_wall_seconds(seconds).isoformat()
+        return timestamp if offset is None else timestamp + offset
+
+    def rows(self) -> Iterator[tuple]:
+        """Rows in DAUTracker insert order, built straight from the columns"""
+        for user_id, seconds, offset, activity_type, platform, region, device, duration, extra in zip(
+                self.user_ids.decoded(), self.timestamps, self._offsets(), self.activity_types.decoded(),
+                self.platforms.decoded(), self.regions.decoded(), self.devices.decoded(),
+                self._durations(), self._extras()):
+            yield (
+                user_id,
+                self._timestamp(seconds, offset),
+                int(seconds // SECONDS_PER_DAY),
+                activity_type,
+                platform,
+                region,
+                device,
+                duration,
+                extra
+            )
+
+    def __getitem__(self, i: int) -> UserActivity:
+        duration = self.session_durations[i]
+        return UserActivity(
+            user_id=self.user_ids[i],
+            timestamp=datetime.fromisoformat(
+                self._timestamp(self.timestamps[i], self.offsets[i] if self.offsets is not None else None)
+            ),
+            activity_type=self.activity_types[i],
+            platform=self.platforms[i],
+            metadata=decode_metadata(
+                self.extra_metadata[i] if self.extra_metadata is not None else None,
+                self.regions[i],
+                self.devices[i],
+                None if duration == MISSING else duration
+            )
+        )
+
+    def __iter__(self) -> Iterator[UserActivity]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def to_dicts(self) -> List[Dict[str, Any]]:
+        return [activity.to_dict() for activity in self]
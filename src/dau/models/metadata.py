@@ -0,0 +1,63 @@
+"""Storage encoding for UserActivity.metadata
+
+Hot keys listed in ``PROMOTED_FIELDS`` are stored in their own columns of
+``user_activities`` so reports can filter and group on them directly. The
+remaining keys are stored as compact JSON, or NULL when nothing is left.
+Rows written before the schema change hold a Python ``repr`` of the dict,
+which ``decode_metadata`` still reads.
+"""
+import ast
+import json
+from typing import Any, Dict, Optional, Tuple
+
+# Column name -> type the value must have to be promoted
+PROMOTED_FIELDS = {
+    'region': str,
+    'device': str,
+    'session_duration': int,
+}
+
+def _promotable(value: Any, kind: type) -> bool:
+    return isinstance(value, kind) and not isinstance(value, bool)
+
+def encode_metadata(metadata: Optional[Dict[str, Any]]) -> Tuple[Any, ...]:
+    """Split metadata into (region, device, session_duration, encoded rest)"""
+    if not metadata:
+        return (None,) * len(PROMOTED_FIELDS) + (None,)
+
+    rest = dict(metadata)
+    promoted = []
+    for field, kind in PROMOTED_FIELDS.items():
+        value = rest.get(field)
+        if value is not None and _promotable(value, kind):
+            promoted.append(rest.pop(field))
+        else:
+            promoted.append(None)
+
+    encoded = json.dumps(rest, separators=(',', ':'), default=str) if rest else None
+    return tuple(promoted) + (encoded,)
+
+def _parse_blob(blob: Optional[str]) -> Dict[str, Any]:
+    if not blob:
+        return {}
+    try:
+        result = json.loads(blob)
+    except ValueError:
+        # Legacy rows store str(dict)
+        try:
+            result = ast.literal_eval(blob)
+        except (ValueError, SyntaxError):
+            result = None
+    if not isinstance(result, dict):
+        raise ValueError(f"Unreadable metadata: {blob[:80]!r}")
+    return result
+
+def decode_metadata(blob: Optional[str], *promoted: Any) -> Dict[str, Any]:
+    """Rebuild the metadata dict from the stored blob and promoted column values"""
+    metadata = {
+        field: value
+        for field, value in zip(PROMOTED_FIELDS, promoted)
+        if value is not None
+    }
+    metadata.update(_parse_blob(blob))
+    return metadata
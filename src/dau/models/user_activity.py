@@ -2,7 +2,7 @@ from dataclasses import dataclass, field
 from datetime import datetime
 import uuid
 
-@dataclass
+@dataclass(slots=True)
 class UserActivity:
     user_id: str = field(default_factory=lambda: str(uuid.uuid4()))
     timestamp: datetime = field(default_factory=datetime.now)
@@ -18,3 +18,15 @@ class UserActivity:
             'platform': self.platform,
             'metadata': self.metadata
         }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'UserActivity':
+        """Inverse of to_dict; a missing timestamp means now"""
+        timestamp = data.get('timestamp')
+        return cls(
+            user_id=str(data['user_id']),
+            timestamp=datetime.fromisoformat(timestamp) if timestamp else datetime.now(),
+            activity_type=data.get('activity_type', ''),
+            platform=data.get('platform', ''),
+            metadata=data.get('metadata') or {}
+        )
@@ -0,0 +1,174 @@
+"""Cohort, retention and stickiness analysis
+
+Users are numbered by the ``users`` table, which ``DAUTracker`` keeps up
+to date with every user's first-seen day. ``CohortAnalyzer`` loads the set
+of active user ids of every day in a window once from the daily user
+bitmaps (see ``storage.bitmap``), as sorted NumPy arrays, and answers
+everything with array operations over dense per-user vectors instead of
+SQL self-joins:
+
+- ``retention_matrix``: for each daily or weekly cohort of new users, how
+  many were active in each following period
+- ``day_n_retention``: share of new users active exactly N days later
+- ``stickiness``: DAU / MAU per day
+- ``rolling_active_users``: exact distinct users over a trailing window
+"""
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence
+import numpy as np
+from ..storage.bitmap import BitmapIndex
+from ..storage.cache import cached
+from ..storage.schema import day_to_date, epoch_day
+
+PERIODS = {'day': 1, 'week': 7}
+
+class CohortAnalyzer:
+    def __init__(self, pool, chunk_size: int = 100000):
+        self.pool = pool
+        self.chunk_size = chunk_size
+
+    def _first_days(self, conn) -> np.ndarray:
+        """First-seen day indexed by user id (-1 for unused ids)"""
+        count = conn.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM users').fetchone()[0]
+        first_days = np.full(count, -1, dtype=np.int64)
+        cursor = conn.execute('SELECT id, first_day FROM users')
+        while True:
+            rows = cursor.fetchmany(self.chunk_size)
+            if not rows:
+                break
+            ids, days = np.array(rows, dtype=np.int64).T
+            first_days[ids] = days
+        return first_days
+
+    def daily_active_ids(self, start_day: int, end_day: int, conn=None) -> Dict[int, np.ndarray]:
+        """{day: sorted user ids active that day} for every active day in the range
+
+        With a QueryCache on the pool each day is cached on its own, so
+        sliding or overlapping windows only load the days they add.
+        """
+        if conn is None:
+            with self.pool.snapshot() as conn:
+                return self.daily_active_ids(start_day, end_day, conn)
+        if self.pool.cache is None:
+            return self._load_active_ids(conn, start_day, end_day)
+
+        active = {}
+        for day in range(start_day, end_day + 1):
+            ids = cached(self.pool, ('active_ids', day), day, day,
+                         lambda: self._load_active_ids(conn, day, day).get(day))
+            if ids is not None:
+                active[day] = ids
+        return active
+
+    def _load_active_ids(self, conn, start_day: int, end_day: int) -> Dict[int, np.ndarray]:
+        return {day: bitmap.to_ids() for day, bitmap in BitmapIndex.load(conn, start_day, end_day).items()}
+
+    def retention_matrix(self, days: int = 90, period: str = 'week',
+                         end_date: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """One row per cohort of users first seen in a period of the window
+
+        ``retained[k]`` counts the cohort's users active in the k-th period
+        after (and including) the cohort's own; ``rates`` divides by the
+        cohort size.
+        """
+        if period not in PERIODS:
+            raise ValueError(f"Unknown period {period}, choose from {', '.join(PERIODS)}")
+        length = PERIODS[period]
+        end_day = epoch_day(end_date or datetime.now())
+        start_day = end_day - days + 1
+        periods = -(-days // length)
+
+        with self.pool.snapshot() as conn:
+            first_days = self._first_days(conn)
+            active = self.daily_active_ids(start_day, end_day, conn)
+
+        # Cohort index per user id, -1 outside the window
+        in_window = (first_days >= start_day) & (first_days <= end_day)
+        cohort_of = np.where(in_window, (first_days - start_day) // length, -1)
+        sizes = np.bincount(cohort_of[in_window], minlength=periods)
+
+        retained = np.zeros((periods, periods), dtype=np.int64)
+        for index in range(periods):
+            period_days = [active[day] for day in range(start_day + index * length,
+                                                        min(start_day + (index + 1) * length, end_day + 1))
+                           if day in active]
+            if not period_days:
+                continue
+            ids = np.unique(np.concatenate(period_days))
+            cohorts = cohort_of[ids]
+            counts = np.bincount(cohorts[(cohorts >= 0) & (cohorts <= index)], minlength=periods)
+            # Cohort c is in its (index - c)-th period
+            retained[np.arange(index + 1), index - np.arange(index + 1)] = counts[:index + 1]
+
+        return [
+            {
+                'cohort': day_to_date(start_day + cohort * length).isoformat(),
+                'size': int(sizes[cohort]),
+                'retained': retained[cohort, :periods - cohort].tolist(),
+                'rates': (retained[cohort, :periods - cohort] / sizes[cohort]).round(4).tolist()
+            } for cohort in range(periods) if sizes[cohort]
+        ]
+
+    def day_n_retention(self, n_values: Sequence[int] = (1, 7, 30), days: int = 90,
+                        end_date: Optional[datetime] = None) -> Dict[int, Optional[float]]:
+        """Share of users first seen in the window who were active exactly N days later
+
+        Only users first seen at least N days before the end of the window
+        count towards day N.
+        """
+        end_day = epoch_day(end_date or datetime.now())
+        start_day = end_day - days + 1
+
+        with self.pool.snapshot() as conn:
+            first_days = self._first_days(conn)
+            active = self.daily_active_ids(start_day, end_day, conn)
+
+        result = {}
+        for n in n_values:
+            eligible = (first_days >= start_day) & (first_days <= end_day - n)
+            returned = 0
+            for day in range(start_day + n, end_day + 1):
+                ids = active.get(day)
+                if ids is not None:
+                    returned += int(np.count_nonzero(first_days[ids] == day - n))
+            total = int(np.count_nonzero(eligible))
+            result[n] = returned / total if total else None
+        return result
+
+    def rolling_active_users(self, days: int = 30, window: int = 7,
+                             end_date: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """Exact distinct users over the window days ending at each of the last days"""
+        end_day = epoch_day(end_date or datetime.now())
+        start_day = end_day - days + 1
+        first_loaded = start_day - window + 1
+
+        with self.pool.snapshot() as conn:
+            user_count = conn.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM users').fetchone()[0]
+            active = self.daily_active_ids(first_loaded, end_day, conn)
+
+        # Last active day per user; a user counts while it is inside the window
+        last_seen = np.full(user_count, first_loaded - window, dtype=np.int64)
+        result = []
+        for day in range(first_loaded, end_day + 1):
+            ids = active.get(day)
+            if ids is not None:
+                last_seen[ids] = day
+            if day >= start_day:
+                result.append({
+                    'date': day_to_date(day).isoformat(),
+                    'daily_active_users': 0 if ids is None else len(ids),
+                    'active_users': int(np.count_nonzero(last_seen > day - window))
+                })
+        return result
+
+    def stickiness(self, days: int = 30, window: int = 30,
+                   end_date: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """DAU / MAU per day, MAU being distinct users over the trailing window"""
+        return [
+            {
+                'date': row['date'],
+                'dau': row['daily_active_users'],
+                'mau': row['active_users'],
+                'stickiness': row['daily_active_users'] / row['active_users'] if row['active_users'] else 0.0
+            } for row in self.rolling_active_users(days, window, end_date)
+        ]
@@ -0,0 +1,287 @@
+"""Columnar in-memory analytics over a window of user activities
+
+``ColumnarStore`` loads the events of a day range once into NumPy arrays:
+day numbers, dictionary codes for user_id, activity_type, platform, region
+and device, session durations and stored metadata sizes. Report methods
+with the same names and result shapes as ``DAUReport`` and
+``SimpleDAUPredictor.analyze_user_segments`` are answered from those
+arrays, as is any ad-hoc ``group_by`` with filters, so dashboards slicing
+one window many ways don't go back to SQLite for each slice.
+
+``refresh`` appends only the rows inserted since the last load (tracked
+by rowid per table), so keeping the store current is cheap. Moving events
+into partitions or dropping partitions invalidates those rowids, so the
+next refresh after either reloads the whole window.
+
+    store = ColumnarStore(pool, days=90)
+    store.get_dau_trend(30)
+    store.group_by(['platform', 'region'], filters={'activity_type': 'purchase'})
+"""
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from ..storage.partition import activity_tables, layout_generation
+from ..storage.rollup import DIMENSIONS
+from ..storage.schema import day_to_date, epoch_day
+
+class _Dictionary:
+    """Value -> code mapping that grows as new values are seen"""
+    __slots__ = ('index', '_values')
+
+    def __init__(self):
+        self.index = {}
+        self._values = []
+
+    def encode(self, values: Sequence[Any]) -> np.ndarray:
+        index = self.index
+        setdefault = index.setdefault
+        return np.fromiter((setdefault(value, len(index)) for value in values),
+                           dtype=np.int32, count=len(values))
+
+    def values(self) -> List[Any]:
+        if len(self._values) != len(self.index):
+            self._values = list(self.index)
+        return self._values
+
+    def code(self, value: Any) -> int:
+        return self.index.get(value, -1)
+
+# Group-by results up to this many combinations use dense counters
+DENSE_GROUPS = 1 << 20
+
+# Cells of the group x user bitmap before falling back to sorting
+BITMAP_CELLS = 1 << 28
+
+def _distinct_per_group(group: np.ndarray, users: np.ndarray, group_count: int,
+                        user_count: int) -> np.ndarray:
+    """Distinct users in each of group_count groups"""
+    cells = group.astype(np.int64) * user_count + users
+    if group_count * user_count <= BITMAP_CELLS:
+        seen = np.zeros(group_count * user_count, dtype=bool)
+        seen[cells] = True
+        return np.count_nonzero(seen.reshape(group_count, user_count), axis=1)
+    pairs = np.unique(cells)
+    return np.bincount(pairs // user_count, minlength=group_count)
+
+class ColumnarStore:
+    def __init__(self, pool, days: int = 90, start_date: Optional[datetime] = None,
+                 chunk_size: int = 100000):
+        """Load events from start_date (default: days ago) onwards"""
+        self.pool = pool
+        self.chunk_size = chunk_size
+        if start_date is None:
+            start_date = datetime.now() - timedelta(days=days)
+        self.start_day = epoch_day(start_date)
+
+        self._reset()
+        self.refresh()
+
+    def _reset(self):
+        self.dictionaries = {name: _Dictionary() for name in ('user_id',) + DIMENSIONS}
+        self.columns: Dict[str, np.ndarray] = {
+            'day': np.empty(0, dtype=np.int32),
+            'user_id': np.empty(0, dtype=np.int32),
+            **{name: np.empty(0, dtype=np.int32) for name in DIMENSIONS},
+            'session_duration': np.empty(0, dtype=np.float64),
+            'metadata_size': np.empty(0, dtype=np.int64),
+        }
+        # table -> highest rowid loaded
+        self._high_water: Dict[str, int] = {}
+        self._layout: Optional[int] = None
+
+    def __len__(self) -> int:
+        return len(self.columns['day'])
+
+    def refresh(self) -> int:
+        """Append the events written since the last load, return how many
+
+        After events were moved or dropped, reloads the whole window and
+        returns the number of events loaded.
+        """
+        added = 0
+        with self.pool.snapshot() as conn:
+            layout = layout_generation(conn)
+            if layout != self._layout:
+                self._reset()
+                self._layout = layout
+            chunks = {name: [column] for name, column in self.columns.items()}
+            for table in activity_tables(conn):
+                cursor = conn.execute(f'''
+                    SELECT rowid, day, user_id, activity_type, platform, region, device,
+                           session_duration, COALESCE(LENGTH(metadata), 0)
+                    FROM {table}
+                    WHERE rowid > ? AND day >= ?
+                    ORDER BY rowid
+                ''', (self._high_water.get(table, 0), self.start_day))
+                while True:
+                    rows = cursor.fetchmany(self.chunk_size)
+                    if not rows:
+                        break
+                    (rowids, days, users, activity_types, platforms, regions, devices,
+                     durations, metadata_sizes) = zip(*rows)
+                    self._high_water[table] = rowids[-1]
+                    chunks['day'].append(np.array(days, dtype=np.int32))
+                    chunks['user_id'].append(self.dictionaries['user_id'].encode(users))
+                    for name, values in zip(DIMENSIONS, (activity_types, platforms, regions, devices)):
+                        chunks[name].append(self.dictionaries[name].encode(values))
+                    chunks['session_duration'].append(np.array(
+                        [np.nan if value is None else value for value in durations], dtype=np.float64
+                    ))
+                    chunks['metadata_size'].append(np.array(metadata_sizes, dtype=np.int64))
+                    added += len(rows)
+
+        if added:
+            self.columns = {name: np.concatenate(parts) for name, parts in chunks.items()}
+        return added
+
+    def _mask(self, start_day: Optional[int] = None, end_day: Optional[int] = None,
+              filters: Optional[Dict[str, Any]] = None) -> np.ndarray:
+        day = self.columns['day']
+        mask = np.ones(len(day), dtype=bool)
+        if start_day is not None:
+            mask &= day >= start_day
+        if end_day is not None:
+            mask &= day <= end_day
+        for name, wanted in (filters or {}).items():
+            if name not in self.dictionaries:
+                raise ValueError(f"Cannot filter on {name}, choose from {', '.join(self.dictionaries)}")
+            if not isinstance(wanted, (list, tuple, set)):
+                wanted = [wanted]
+            codes = [self.dictionaries[name].code(value) for value in wanted]
+            mask &= np.isin(self.columns[name], codes)
+        return mask
+
+    def group_by(self, dimensions: Sequence[str] = (), filters: Optional[Dict[str, Any]] = None,
+                 start_day: Optional[int] = None, end_day: Optional[int] = None) -> Dict[tuple, Dict[str, Any]]:
+        """{values of dimensions: unique_users, total_activities, avg_session_duration}
+
+        dimensions may include 'day'; filters maps a dimension to a value or
+        a list of accepted values.
+        """
+        mask = self._mask(start_day, end_day, filters)
+        users = self.columns['user_id'][mask]
+        keys = [self.columns[name][mask] for name in dimensions]
+
+        # Mixed-radix group id over the selected dimensions
+        group = np.zeros(len(users), dtype=np.int64)
+        radices = []
+        for key in keys:
+            offset = int(key.min()) if len(key) else 0
+            radix = int(key.max()) - offset + 1 if len(key) else 1
+            group = group * radix + (key - offset)
+            radices.append((offset, radix))
+        group_count = int(np.prod([radix for _, radix in radices], dtype=np.int64))
+        if group_count > DENSE_GROUPS:
+            # Too many combinations for dense counters: renumber the ones present
+            group_ids, group = np.unique(group, return_inverse=True)
+            group_count = len(group_ids)
+        else:
+            group_ids = None
+
+        events = np.bincount(group, minlength=group_count)
+        unique_users = _distinct_per_group(group, users, group_count,
+                                           len(self.dictionaries['user_id'].index))
+        durations = self.columns['session_duration'][mask]
+        present = ~np.isnan(durations)
+        duration_sums = np.bincount(group[present], weights=durations[present], minlength=group_count)
+        duration_counts = np.bincount(group[present], minlength=group_count)
+        if group_ids is None:
+            indices = group_ids = np.flatnonzero(events)
+        else:
+            indices = np.arange(group_count)
+
+        result = {}
+        for i, group_id in zip(indices, group_ids):
+            remainder = int(group_id)
+            decoded = []
+            for name, (offset, radix) in reversed(list(zip(dimensions, radices))):
+                remainder, code = divmod(remainder, radix)
+                decoded.append(self._decode(name, code + offset))
+            result[tuple(reversed(decoded))] = {
+                'unique_users': int(unique_users[i]),
+                'total_activities': int(events[i]),
+                'avg_session_duration': duration_sums[i] / duration_counts[i] if duration_counts[i] else None
+            }
+        return result
+
+    def _decode(self, name: str, code: int) -> Any:
+        if name == 'day':
+            return code
+        return self.dictionaries[name].values()[code]
+
+    def _window(self, days: int) -> Tuple[int, int]:
+        end_day = epoch_day(datetime.now())
+        return end_day - days, end_day
+
+    def get_dau_trend(self, days: int = 30) -> List[Dict[str, Any]]:
+        start_day, end_day = self._window(days)
+        return [
+            {
+                'date': day_to_date(day).isoformat(),
+                'daily_active_users': stats['unique_users']
+            } for (day,), stats in sorted(self.group_by(['day'], start_day=start_day, end_day=end_day).items())
+        ]
+
+    def get_activity_distribution(self, start_date: datetime = None,
+                                  end_date: datetime = None) -> Dict[str, Dict[str, int]]:
+        if start_date is None:
+            start_date = datetime.now() - timedelta(days=30)
+        if end_date is None:
+            end_date = datetime.now()
+        groups = self.group_by(['activity_type'], start_day=epoch_day(start_date), end_day=epoch_day(end_date))
+        return {
+            activity_type: {
+                'unique_users': stats['unique_users'],
+                'total_activities': stats['total_activities']
+            } for (activity_type,), stats in groups.items()
+        }
+
+    def get_platform_performance(self, days: int = 30) -> Dict[str, Dict[str, Any]]:
+        start_day, end_day = self._window(days)
+        groups = self.group_by(['platform'], start_day=start_day, end_day=end_day)
+        mask = self._mask(start_day, end_day)
+        platform = self.columns['platform'][mask]
+        metadata_bytes = np.bincount(platform, weights=self.columns['metadata_size'][mask])
+        return {
+            value: {
+                'unique_users': stats['unique_users'],
+                'total_activities': stats['total_activities'],
+                'avg_metadata_size': metadata_bytes[self.dictionaries['platform'].code(value)] / stats['total_activities']
+            } for (value,), stats in groups.items()
+        }
+
+    def get_breakdown(self, dimension: str = 'region', days: int = 30) -> Dict[str, Dict[str, Any]]:
+        if dimension not in DIMENSIONS:
+            raise ValueError(f"Cannot break down by {dimension}, choose one of {', '.join(DIMENSIONS)}")
+        start_day, end_day = self._window(days)
+        return {
+            value: stats
+            for (value,), stats in self.group_by([dimension], start_day=start_day, end_day=end_day).items()
+        }
+
+    def analyze_user_segments(self, days: int = 30) -> Dict[str, Any]:
+        """Same segments as SimpleDAUPredictor.analyze_user_segments"""
+        start_day, end_day = self._window(days)
+        mask = self._mask(start_day, end_day)
+        span = end_day - start_day + 1
+        # Transposed: each user is a group, each day a member
+        activity_days = _distinct_per_group(
+            self.columns['user_id'][mask], self.columns['day'][mask] - start_day,
+            len(self.dictionaries['user_id'].index), span
+        )
+        activity_days = activity_days[activity_days > 0]
+
+        segments = {
+            'inactive': 0,
+            'occasional': int(np.count_nonzero(activity_days <= 3)),
+            'regular': int(np.count_nonzero((activity_days > 3) & (activity_days <= 10))),
+            'power_users': int(np.count_nonzero(activity_days > 10))
+        }
+        return {
+            'total_users': len(activity_days),
+            'segments': segments,
+            'segment_percentages': {
+                segment: count / len(activity_days) * 100
+                for segment, count in segments.items()
+            }
+        }
@@ -0,0 +1,272 @@
+"""Streaming export of raw events and aggregate views
+
+Rows are pulled from a SQLite cursor with ``fetchmany`` and handed to a
+writer one chunk at a time, so peak memory depends on ``chunk_size`` and
+not on how many rows are exported. Every export runs inside one read
+transaction and sees a consistent snapshot while ingestion continues.
+
+Formats:
+
+- ``csv``: header line plus one line per row
+- ``ndjson``: one JSON object per line
+- ``columnar``: gzip-compressed; a header line with the column names, then
+  one line per chunk holding a JSON array per column
+- ``parquet``: one row group per chunk, needs the optional ``pyarrow``
+
+``csv`` and ``ndjson`` are gzip-compressed when the path ends in ``.gz``.
+
+Export from the command line with::
+
+    python -m src.dau.reporting.export dau_tracking.db activities events.csv --days 90
+"""
+import argparse
+import csv
+import gzip
+import json
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Sequence, Tuple
+from ..storage.partition import activity_source
+from ..storage.rollup import DIMENSIONS, TOTAL, RollupManager
+from ..storage.schema import epoch_day, day_to_date
+
+def _dirty_rollups(source: str) -> str:
+    """UNION ALL branches aggregating dirty days from source the way rollups do"""
+    values = [(TOTAL, "''")] + [(name, f"COALESCE({name}, '')") for name in DIMENSIONS]
+    return ''.join(f'''
+                UNION ALL
+                SELECT day, '{dimension}', {value}, COUNT(DISTINCT user_id), COUNT(*)
+                FROM {source}
+                WHERE day BETWEEN ?1 AND ?2
+                  AND day IN (SELECT day FROM rollup_dirty WHERE day BETWEEN ?1 AND ?2)
+                GROUP BY day, {value}''' for dimension, value in values)
+
+# name -> (columns, query over a [start_day, end_day] range from {source});
+# daily_rollups takes its dirty days, such as today, from {dirty_rollups}
+VIEWS: Dict[str, Tuple[Tuple[str, ...], str]] = {
+    'activities': (
+        ('user_id', 'timestamp', 'activity_type', 'platform', 'region',
+         'device', 'session_duration', 'metadata'),
+        '''
+            SELECT user_id, timestamp, activity_type, platform, region,
+                   device, session_duration, metadata
+            FROM {source}
+            WHERE day BETWEEN ? AND ?
+        '''
+    ),
+    'daily_rollups': (
+        ('day', 'dimension', 'value', 'users', 'events'),
+        '''
+            SELECT * FROM (
+                SELECT day, dimension, value, users, events
+                FROM daily_rollups
+                WHERE day BETWEEN ?1 AND ?2
+                  AND day NOT IN (SELECT day FROM rollup_dirty WHERE day BETWEEN ?1 AND ?2)
+                {dirty_rollups}
+            )
+            ORDER BY day, dimension, value
+        '''
+    ),
+    'user_segments': (
+        ('user_id', 'first_day', 'last_day', 'active_days', 'total_activities', 'platforms'),
+        '''
+            SELECT user_id, MIN(day), MAX(day), COUNT(DISTINCT day), COUNT(*),
+                   COUNT(DISTINCT platform)
+            FROM {source}
+            WHERE day BETWEEN ? AND ?
+            GROUP BY user_id
+        '''
+    ),
+}
+
+# View columns holding day numbers, written as ISO dates
+DAY_COLUMNS = {'day', 'first_day', 'last_day'}
+
+class CsvWriter:
+    binary = False
+    compressed = False
+
+    def __init__(self, stream, columns: Sequence[str]):
+        self.writer = csv.writer(stream)
+        self.writer.writerow(columns)
+
+    def write(self, rows: List[tuple]):
+        self.writer.writerows(rows)
+
+    def close(self):
+        pass
+
+class NdjsonWriter:
+    binary = False
+    compressed = False
+
+    def __init__(self, stream, columns: Sequence[str]):
+        self.stream = stream
+        self.columns = list(columns)
+        self.encoder = json.JSONEncoder(separators=(',', ':'), default=str)
+
+    def write(self, rows: List[tuple]):
+        encode, columns = self.encoder.encode, self.columns
+        self.stream.write(''.join(encode(dict(zip(columns, row))) + '\n' for row in rows))
+
+    def close(self):
+        pass
+
+class ColumnarWriter:
+    """Gzip-compressed chunks of columns; each line decodes on its own"""
+    binary = False
+    compressed = True
+
+    def __init__(self, stream, columns: Sequence[str]):
+        self.stream = stream
+        self.encoder = json.JSONEncoder(separators=(',', ':'), default=str)
+        stream.write(self.encoder.encode({'columns': list(columns)}) + '\n')
+
+    def write(self, rows: List[tuple]):
+        self.stream.write(self.encoder.encode({
+            'rows': len(rows),
+            'data': [list(column) for column in zip(*rows)]
+        }) + '\n')
+
+    def close(self):
+        pass
+
+class ParquetWriter:
+    binary = True
+    compressed = False
+
+    def __init__(self, stream, columns: Sequence[str]):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError('Parquet export requires pyarrow: pip install pyarrow')
+        self.pyarrow = pyarrow
+        self.stream = stream
+        self.columns = list(columns)
+        # The schema is inferred from the first chunk
+        self.writer = None
+
+    def write(self, rows: List[tuple]):
+        table = self.pyarrow.table(
+            [list(column) for column in zip(*rows)], names=self.columns
+        )
+        if self.writer is None:
+            self.writer = self.pyarrow.parquet.ParquetWriter(self.stream, table.schema)
+        self.writer.write_table(table.cast(self.writer.schema))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+FORMATS = {
+    'csv': CsvWriter,
+    'ndjson': NdjsonWriter,
+    'columnar': ColumnarWriter,
+    'parquet': ParquetWriter,
+}
+
+def _open(path: str, writer_class):
+    if writer_class.binary:
+        return open(path, 'wb')
+    if writer_class.compressed or path.endswith('.gz'):
+        return gzip.open(path, 'wt', compresslevel=6, newline='', encoding='utf-8')
+    return open(path, 'w', newline='', encoding='utf-8')
+
+def _iso_days(rows: List[tuple], positions: Sequence[int]) -> List[tuple]:
+    converted = []
+    for row in rows:
+        row = list(row)
+        for i in positions:
+            if row[i] is not None:
+                row[i] = day_to_date(row[i]).isoformat()
+        converted.append(tuple(row))
+    return converted
+
+class Exporter:
+    def __init__(self, pool, chunk_size: int = 10000):
+        self.pool = pool
+        self.chunk_size = chunk_size
+
+    def write_rows(self, chunks: Iterable[List[tuple]], columns: Sequence[str],
+                   path: str, format: str = 'csv') -> int:
+        """Write chunks of rows to path, return the number of rows written"""
+        if format not in FORMATS:
+            raise ValueError(f"Unknown export format {format}, choose from {', '.join(FORMATS)}")
+        writer_class = FORMATS[format]
+        count = 0
+        with _open(path, writer_class) as stream:
+            writer = writer_class(stream, columns)
+            try:
+                for rows in chunks:
+                    writer.write(rows)
+                    count += len(rows)
+            finally:
+                writer.close()
+        return count
+
+    def export_query(self, sql: str, params: Sequence[Any], path: str,
+                     format: str = 'csv') -> int:
+        """Stream the result of any SELECT to path, columns named by the query"""
+        with self.pool.snapshot() as conn:
+            cursor = conn.execute(sql, params)
+            columns = [description[0] for description in cursor.description]
+            return self.write_rows(self._chunks(cursor), columns, path, format)
+
+    def export_view(self, view: str, path: str, start_date: datetime = None,
+                    end_date: datetime = None, format: str = 'csv') -> int:
+        """Stream one of VIEWS over a date range (default: the last 30 days) to path"""
+        if view not in VIEWS:
+            raise ValueError(f"Unknown export view {view}, choose from {', '.join(VIEWS)}")
+        if end_date is None:
+            end_date = datetime.now()
+        if start_date is None:
+            start_date = end_date - timedelta(days=30)
+        columns, sql = VIEWS[view]
+
+        start_day, end_day = epoch_day(start_date), epoch_day(end_date)
+        if view == 'daily_rollups':
+            # Closed days are read from the rollups, only today from raw events
+            RollupManager(self.pool).refresh_closed(start_day, end_day)
+
+        with self.pool.snapshot() as conn:
+            source = activity_source(conn, start_day, end_day)
+            sql = sql.format(source=source, dirty_rollups=_dirty_rollups(source))
+            cursor = conn.execute(sql, (start_day, end_day))
+            day_positions = [i for i, column in enumerate(columns) if column in DAY_COLUMNS]
+            return self.write_rows(self._chunks(cursor, day_positions), columns, path, format)
+
+    def _chunks(self, cursor, day_positions: Sequence[int] = ()) -> Iterable[List[tuple]]:
+        while True:
+            rows = cursor.fetchmany(self.chunk_size)
+            if not rows:
+                break
+            yield _iso_days(rows, day_positions) if day_positions else rows
+
+def read_columnar(path: str) -> Iterable[Dict[str, list]]:
+    """Yield {column: values} for each chunk of a columnar export"""
+    with gzip.open(path, 'rt', encoding='utf-8') as stream:
+        columns = json.loads(stream.readline())['columns']
+        for line in stream:
+            yield dict(zip(columns, json.loads(line)['data']))
+
+def main():
+    from ..storage.pool import ConnectionPool
+
+    parser = argparse.ArgumentParser(description='Stream DAU data to a file')
+    parser.add_argument('db_path')
+    parser.add_argument('view', choices=sorted(VIEWS))
+    parser.add_argument('output')
+    parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+    parser.add_argument('--days', type=int, default=30, help='Export the last DAYS days')
+    parser.add_argument('--chunk-size', type=int, default=10000)
+    args = parser.parse_args()
+
+    with ConnectionPool(args.db_path) as pool:
+        start_date = datetime.now() - timedelta(days=args.days)
+        count = Exporter(pool, args.chunk_size).export_view(
+            args.view, args.output, start_date, format=args.format
+        )
+    print(f"Exported {count} rows to {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -1,55 +1,111 @@
-import sqlite3
 from datetime import datetime, timedelta
-from typing import List, Dict, Any
-import json
+from typing import List, Dict, Any, Iterable, Optional
 import os
+from ..metrics.instrumentation import instrumented
+from ..storage.cache import cached, daily_active_users
+from ..storage.partition import activity_source
+from ..storage.pool import ConnectionPool
+from .engine import Aggregator, ReportEngine
+from .export import Exporter
+from ..storage.rollup import DIMENSIONS, RollupManager
+from ..storage.schema import epoch_day, day_to_date
+from ..storage.timezones import now
 
 class DAUReport:
-    def __init__(self, db_path: str = 'dau_tracking.db', output_dir: str = 'reports'):
-        self.db_path = db_path
+    def __init__(self, db_path: str = 'dau_tracking.db', output_dir: str = 'reports',
+                 pool: Optional[ConnectionPool] = None):
+        self._owns_pool = pool is None
+        self.pool = pool or ConnectionPool(db_path)
+        self.db_path = self.pool.db_path
         self.output_dir = output_dir
-        os.makedirs(output_dir, exist_ok=True)
 
-    def get_dau_trend(self, days: int = 30) -> List[Dict[str, int]]:
-        """Get Daily Active Users trend over specified days"""
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=days)
+    def close(self):
+        if self._owns_pool:
+            self.pool.close()
 
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute('''
-                SELECT 
-                    date(timestamp) as activity_date, 
-                    COUNT(DISTINCT user_id) as daily_active_users
-                FROM user_activities
-                WHERE timestamp >= ? AND timestamp <= ?
-                GROUP BY activity_date
-                ORDER BY activity_date
-            ''', (start_date.isoformat(), end_date.isoformat()))
-
-            return [
-                {
-                    'date': row[0], 
-                    'daily_active_users': row[1]
-                } for row in cursor.fetchall()
-            ]
+    def _output_path(self, filename: str) -> str:
+        """Path of filename in output_dir, created on first write"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        return os.path.join(self.output_dir, filename)
+
+    @instrumented
+    def get_dau_trend(self, days: int = 30, timezone: Optional[str] = None) -> List[Dict[str, int]]:
+        """Get Daily Active Users trend over specified days, by days in timezone if given"""
+        end_day = epoch_day(now(timezone))
+        start_day = end_day - days
+
+        return [
+            {
+                'date': day_to_date(day).isoformat(), 
+                'daily_active_users': users
+            } for day, users in daily_active_users(self.pool, start_day, end_day, timezone)
+        ]
+
+    @instrumented
+    def get_rolling_active_users(self, days: int = 30, window: int = 7) -> List[Dict[str, int]]:
+        """Approximate rolling actives (WAU for window=7, MAU for 28/30) for each of the last days"""
+        end_day = epoch_day(datetime.now())
+        start_day = end_day - days
 
-    def get_activity_distribution(self, start_date: datetime = None, end_date: datetime = None) -> Dict[str, int]:
+        def compute():
+            with self.pool.snapshot() as conn:
+                return RollupManager.rolling_active_users(conn, start_day, end_day, window)
+
+        rolling = cached(self.pool, ('rolling_active_users', start_day, end_day, window),
+                         start_day - window + 1, end_day, compute)
+        return [
+            {
+                'date': day_to_date(day).isoformat(),
+                'active_users': users
+            } for day, users in rolling
+        ]
+
+    def _approximate_breakdown(self, dimension: str, start_day: int, end_day: int) -> Dict[str, Dict[str, Any]]:
+        with self.pool.snapshot() as conn:
+            users = RollupManager.approximate_unique_users(conn, start_day, end_day, dimension)
+            totals = RollupManager.dimension_totals(conn, start_day, end_day, dimension)
+        return {
+            value: {
+                'unique_users': users.get(value, 0),
+                'total_activities': events,
+                'metadata_bytes': metadata_bytes
+            } for value, (events, metadata_bytes) in totals.items()
+        }
+
+    @instrumented
+    def get_activity_distribution(self, start_date: datetime = None, end_date: datetime = None,
+                                  approximate: bool = False) -> Dict[str, int]:
         """Get distribution of unique users across different activity types"""
         if start_date is None:
             start_date = datetime.now() - timedelta(days=30)
         if end_date is None:
             end_date = datetime.now()
 
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute('''
+        start_day, end_day = epoch_day(start_date), epoch_day(end_date)
+        return cached(self.pool, ('activity_distribution', start_day, end_day, approximate),
+                      start_day, end_day,
+                      lambda: self._activity_distribution(start_day, end_day, approximate))
+
+    def _activity_distribution(self, start_day: int, end_day: int, approximate: bool) -> Dict[str, Any]:
+        if approximate:
+            breakdown = self._approximate_breakdown('activity_type', start_day, end_day)
+            return {
+                activity_type: {
+                    'unique_users': stats['unique_users'],
+                    'total_activities': stats['total_activities']
+                } for activity_type, stats in breakdown.items()
+            }
+
+        with self.pool.snapshot() as conn:
+            cursor = conn.execute(f'''
                 SELECT 
                     activity_type, 
                     COUNT(DISTINCT user_id) as unique_users,
                     COUNT(*) as total_activities
-                FROM user_activities
-                WHERE timestamp >= ? AND timestamp <= ?
+                FROM {activity_source(conn, start_day, end_day)}
+                WHERE day BETWEEN ? AND ?
                 GROUP BY activity_type
-            ''', (start_date.isoformat(), end_date.isoformat()))
+            ''', (start_day, end_day))
 
             return {
                 row[0]: {
@@ -58,22 +114,38 @@ class DAUReport:
                 } for row in cursor.fetchall()
             }
 
-    def get_platform_performance(self, days: int = 30) -> Dict[str, Dict[str, Any]]:
+    @instrumented
+    def get_platform_performance(self, days: int = 30, approximate: bool = False) -> Dict[str, Dict[str, Any]]:
         """Analyze performance across different platforms"""
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=days)
+        end_day = epoch_day(datetime.now())
+        start_day = end_day - days
 
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute('''
+        return cached(self.pool, ('platform_performance', start_day, end_day, approximate),
+                      start_day, end_day,
+                      lambda: self._platform_performance(start_day, end_day, approximate))
+
+    def _platform_performance(self, start_day: int, end_day: int, approximate: bool) -> Dict[str, Dict[str, Any]]:
+        if approximate:
+            breakdown = self._approximate_breakdown('platform', start_day, end_day)
+            return {
+                platform: {
+                    'unique_users': stats['unique_users'],
+                    'total_activities': stats['total_activities'],
+                    'avg_metadata_size': stats['metadata_bytes'] / stats['total_activities']
+                } for platform, stats in breakdown.items()
+            }
+
+        with self.pool.snapshot() as conn:
+            cursor = conn.execute(f'''
                 SELECT 
                     platform, 
                     COUNT(DISTINCT user_id) as unique_users,
                     COUNT(*) as total_activities,
-                    AVG(LENGTH(metadata)) as avg_metadata_size
-                FROM user_activities
-                WHERE timestamp >= ? AND timestamp <= ?
+                    AVG(COALESCE(LENGTH(metadata), 0)) as avg_metadata_size
+                FROM {activity_source(conn, start_day, end_day)}
+                WHERE day BETWEEN ? AND ?
                 GROUP BY platform
-            ''', (start_date.isoformat(), end_date.isoformat()))
+            ''', (start_day, end_day))
 
             return {
                 row[0]: {
@@ -83,37 +155,96 @@ class DAUReport:
                 } for row in cursor.fetchall()
             }
 
-    def generate_comprehensive_report(self, days: int = 30) -> Dict[str, Any]:
-        """Generate a comprehensive report of DAU metrics"""
-        report = {
-            'dau_trend': self.get_dau_trend(days),
-            'activity_distribution': self.get_activity_distribution(),
-            'platform_performance': self.get_platform_performance(days),
-            'report_generated_at': datetime.now().isoformat()
-        }
+    @instrumented
+    def get_breakdown(self, dimension: str = 'region', days: int = 30) -> Dict[str, Dict[str, Any]]:
+        """Unique users, activities and average session duration per value of an indexed column"""
+        if dimension not in DIMENSIONS:
+            raise ValueError(f"Cannot break down by {dimension}, choose one of {', '.join(DIMENSIONS)}")
+        end_day = epoch_day(datetime.now())
+        start_day = end_day - days
+
+        return cached(self.pool, ('breakdown', dimension, start_day, end_day), start_day, end_day,
+                      lambda: self._breakdown(dimension, start_day, end_day))
 
-        # Save report to JSON file
-        report_path = os.path.join(self.output_dir, f'dau_report_{datetime.now().strftime("%Y%m%d_%H%M%S")}.json')
-        with open(report_path, 'w') as f:
-            json.dump(report, f, indent=2)
+    def _breakdown(self, dimension: str, start_day: int, end_day: int) -> Dict[str, Dict[str, Any]]:
+        with self.pool.snapshot() as conn:
+            cursor = conn.execute(f'''
+                SELECT 
+                    {dimension}, 
+                    COUNT(DISTINCT user_id) as unique_users,
+                    COUNT(*) as total_activities,
+                    AVG(session_duration) as avg_session_duration
+                FROM {activity_source(conn, start_day, end_day)}
+                WHERE day BETWEEN ? AND ?
+                GROUP BY {dimension}
+            ''', (start_day, end_day))
+
+            return {
+                row[0]: {
+                    'unique_users': row[1],
+                    'total_activities': row[2],
+                    'avg_session_duration': row[3]
+                } for row in cursor.fetchall()
+            }
+
+    @instrumented
+    def generate_comprehensive_report(self, days: int = 30, approximate: bool = False,
+                                      aggregators: Optional[List[Aggregator]] = None) -> Dict[str, Any]:
+        """Generate a comprehensive report of DAU metrics
+
+        Exact reports compute every section in one pass over the window;
+        aggregators replaces the default sections, so new sections don't
+        add another scan.
+        """
+        end_day = epoch_day(datetime.now())
+        start_day = end_day - days
+
+        if approximate:
+            start_date = datetime.now() - timedelta(days=days)
+            report = {
+                'dau_trend': self.get_dau_trend(days),
+                'activity_distribution': self.get_activity_distribution(start_date, approximate=True),
+                'platform_performance': self.get_platform_performance(days, approximate=True),
+            }
+        else:
+            report = ReportEngine(self.pool).run(start_day, end_day, aggregators)
+        report['report_generated_at'] = datetime.now().isoformat()
+
+        # One JSON line per section, written as it is encoded
+        report_path = self._output_path(f'dau_report_{datetime.now().strftime("%Y%m%d_%H%M%S")}.ndjson')
+        Exporter(self.pool).write_rows(([section] for section in report.items()), ('section', 'data'),
+                                       report_path, 'ndjson')
 
         return report
 
-    def export_csv(self, data: List[Dict[str, Any]], filename: str):
-        """Export data to CSV for external analysis"""
+    def export_csv(self, data: Iterable[Dict[str, Any]], filename: str):
+        """Export data to CSV for external analysis, one row at a time"""
         import csv
-        csv_path = os.path.join(self.output_dir, filename)
-        
-        if not data:
+        csv_path = self._output_path(filename)
+
+        rows = iter(data)
+        first = next(rows, None)
+        if first is None:
             return
 
         with open(csv_path, 'w', newline='') as csvfile:
-            fieldnames = data[0].keys()
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            
+            writer = csv.DictWriter(csvfile, fieldnames=first.keys())
+
             writer.writeheader()
-            for row in data:
-                writer.writerow(row)
+            writer.writerow(first)
+            writer.writerows(rows)
+
+    @instrumented
+    def export(self, view: str, filename: str, days: int = 30, format: str = 'csv') -> int:
+        """Stream raw events or an aggregate view of the last days to output_dir
+
+        See ``export.VIEWS`` for the views and ``export.FORMATS`` for the
+        formats; memory use does not grow with the number of rows.
+        """
+        start_date = datetime.now() - timedelta(days=days)
+        return Exporter(self.pool).export_view(
+            view, self._output_path(filename), start_date, format=format
+        )
 
 def main():
     report = DAUReport()
@@ -0,0 +1,330 @@
+"""Compressed per-day sets of active users
+
+Every user has a dense integer id in the ``users`` table. ``user_bitmaps``
+stores, for every day, the ids of the users active that day, and for every
+day and platform the ids of the users active on that platform, as
+roaring-style bitmaps: ids are split by their high 16 bits into chunks,
+and each chunk is kept either as a sorted array of its low 16 bits (sparse
+chunks) or as a 65536-bit bitmap (dense chunks). One row holds one chunk,
+so ``DAUTracker`` updates only the chunks a write touches, in the same
+transaction as the events.
+
+``UserBitmap`` supports union, intersection and difference chunk by chunk
+with NumPy, so questions like "active on both days" or "active on web but
+not on mobile" never read raw events:
+
+    web = tracker.get_active_user_set(day, platform='web')
+    mobile = tracker.get_active_user_set(day, platform='mobile')
+    tracker.resolve_users(web - mobile)
+
+Bitmaps outlive compaction (see ``PartitionManager.apply_retention``), so
+set queries keep working over days whose raw events are gone. Rebuild
+them from the raw events by hand with::
+
+    python -m src.dau.storage.bitmap dau_tracking.db
+"""
+import argparse
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+from .partition import activity_source
+
+# Key of the bitmaps over all platforms
+ALL_PLATFORMS = ''
+
+# Chunks with fewer values are stored as sorted uint16 arrays
+ARRAY_LIMIT = 4096
+
+WORDS = 1 << 10
+
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.int64)
+
+def _is_dense(chunk: np.ndarray) -> bool:
+    return chunk.dtype == np.uint64
+
+def _words(chunk: np.ndarray) -> np.ndarray:
+    if _is_dense(chunk):
+        return chunk
+    bits = np.zeros(WORDS * 64, dtype=bool)
+    bits[chunk] = True
+    return np.packbits(bits, bitorder='little').view('<u8')
+
+def _values(chunk: np.ndarray) -> np.ndarray:
+    if not _is_dense(chunk):
+        return chunk
+    bits = np.unpackbits(chunk.view(np.uint8), bitorder='little')
+    return np.flatnonzero(bits).astype(np.uint16)
+
+def _cardinality(chunk: np.ndarray) -> int:
+    if _is_dense(chunk):
+        return int(_POPCOUNT[chunk.view(np.uint8)].sum())
+    return len(chunk)
+
+def _compact(words: np.ndarray) -> Optional[np.ndarray]:
+    """Array form for sparse chunks, None for empty ones"""
+    count = _cardinality(words)
+    if count == 0:
+        return None
+    if count < ARRAY_LIMIT:
+        return _values(words)
+    return words
+
+def _contains(chunk: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """Membership mask of values (uint16) in chunk"""
+    if _is_dense(chunk):
+        return ((chunk[values >> 6] >> (values & 63).astype(np.uint64)) & 1).astype(bool)
+    return np.isin(values, chunk, assume_unique=True)
+
+def chunk_to_bytes(chunk: np.ndarray) -> bytes:
+    return chunk.astype('<u8' if _is_dense(chunk) else '<u2').tobytes()
+
+def chunk_from_bytes(data: bytes) -> np.ndarray:
+    # Sparse chunks hold fewer than ARRAY_LIMIT values, so only dense ones are this long
+    if len(data) == WORDS * 8:
+        return np.frombuffer(data, dtype='<u8').astype(np.uint64)
+    return np.frombuffer(data, dtype='<u2').astype(np.uint16)
+
+class UserBitmap:
+    """Set of user ids stored as roaring-style chunks"""
+    __slots__ = ('chunks',)
+
+    def __init__(self, chunks: Optional[Dict[int, np.ndarray]] = None):
+        # high 16 bits -> sorted uint16 array or 1024 uint64 words
+        self.chunks = chunks or {}
+
+    @classmethod
+    def from_ids(cls, ids: Iterable[int]) -> 'UserBitmap':
+        ids = np.unique(np.fromiter(ids, dtype=np.int64) if not isinstance(ids, np.ndarray) else ids)
+        chunks = {}
+        keys = ids >> 16
+        boundaries = np.flatnonzero(np.diff(keys)) + 1
+        for part in np.split(ids, boundaries) if len(ids) else []:
+            low = (part & 0xFFFF).astype(np.uint16)
+            chunks[int(part[0] >> 16)] = low if len(low) < ARRAY_LIMIT else _words(low)
+        return cls(chunks)
+
+    def to_ids(self) -> np.ndarray:
+        """Sorted ids as an int64 array"""
+        parts = [
+            (np.int64(key) << 16) + _values(self.chunks[key]).astype(np.int64)
+            for key in sorted(self.chunks)
+        ]
+        return np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return sum(_cardinality(chunk) for chunk in self.chunks.values())
+
+    def __bool__(self) -> bool:
+        return bool(self.chunks)
+
+    def __contains__(self, user_id: int) -> bool:
+        chunk = self.chunks.get(user_id >> 16)
+        return chunk is not None and bool(_contains(chunk, np.array([user_id & 0xFFFF], dtype=np.uint16))[0])
+
+    def __iter__(self):
+        return iter(self.to_ids().tolist())
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, UserBitmap):
+            return NotImplemented
+        return np.array_equal(self.to_ids(), other.to_ids())
+
+    def __repr__(self) -> str:
+        return f'UserBitmap({len(self)} users in {len(self.chunks)} chunks)'
+
+    @classmethod
+    def union(cls, *bitmaps: 'UserBitmap') -> 'UserBitmap':
+        by_key = defaultdict(list)
+        for bitmap in bitmaps:
+            for key, chunk in bitmap.chunks.items():
+                by_key[key].append(chunk)
+        chunks = {}
+        for key, parts in by_key.items():
+            if len(parts) == 1:
+                chunks[key] = parts[0]
+            elif not any(map(_is_dense, parts)) and sum(map(len, parts)) < ARRAY_LIMIT:
+                chunks[key] = np.unique(np.concatenate(parts))
+            else:
+                words = np.zeros(WORDS, dtype=np.uint64)
+                for part in parts:
+                    words |= _words(part)
+                chunks[key] = _compact(words)
+        return cls(chunks)
+
+    @classmethod
+    def intersection(cls, first: 'UserBitmap', *others: 'UserBitmap') -> 'UserBitmap':
+        chunks = dict(first.chunks)
+        for other in others:
+            result = {}
+            for key, chunk in chunks.items():
+                other_chunk = other.chunks.get(key)
+                if other_chunk is None:
+                    continue
+                if _is_dense(chunk) and _is_dense(other_chunk):
+                    merged = _compact(chunk & other_chunk)
+                elif _is_dense(chunk):
+                    merged = other_chunk[_contains(chunk, other_chunk)]
+                else:
+                    merged = chunk[_contains(other_chunk, chunk)]
+                if merged is not None and len(merged):
+                    result[key] = merged
+            chunks = result
+        return cls(chunks)
+
+    def difference(self, *others: 'UserBitmap') -> 'UserBitmap':
+        chunks = dict(self.chunks)
+        for other in others:
+            for key, other_chunk in other.chunks.items():
+                chunk = chunks.get(key)
+                if chunk is None:
+                    continue
+                if _is_dense(chunk):
+                    merged = _compact(chunk & ~_words(other_chunk))
+                else:
+                    merged = chunk[~_contains(other_chunk, chunk)]
+                if merged is not None and len(merged):
+                    chunks[key] = merged
+                else:
+                    del chunks[key]
+        return UserBitmap(chunks)
+
+    def __or__(self, other: 'UserBitmap') -> 'UserBitmap':
+        return UserBitmap.union(self, other)
+
+    def __and__(self, other: 'UserBitmap') -> 'UserBitmap':
+        return UserBitmap.intersection(self, other)
+
+    def __sub__(self, other: 'UserBitmap') -> 'UserBitmap':
+        return self.difference(other)
+
+def lookup_ids(conn, user_ids: Iterable[str], chunk_size: int = 500) -> Dict[str, int]:
+    """{user_id: dense id} for the known users among user_ids"""
+    user_ids = list(user_ids)
+    ids = {}
+    for i in range(0, len(user_ids), chunk_size):
+        part = user_ids[i:i + chunk_size]
+        ids.update(conn.execute(
+            f"SELECT user_id, id FROM users WHERE user_id IN ({', '.join('?' * len(part))})", part
+        ))
+    return ids
+
+def lookup_user_ids(conn, ids: Sequence[int], chunk_size: int = 500) -> List[str]:
+    """user_id strings of dense ids, in id order"""
+    ids = [int(user_id) for user_id in ids]
+    user_ids = []
+    for i in range(0, len(ids), chunk_size):
+        part = ids[i:i + chunk_size]
+        user_ids.extend(row[0] for row in conn.execute(
+            f"SELECT user_id FROM users WHERE id IN ({', '.join('?' * len(part))}) ORDER BY id", part
+        ))
+    return user_ids
+
+class BitmapIndex:
+    def __init__(self, pool, days_per_transaction: int = 7):
+        self.pool = pool
+        self.days_per_transaction = days_per_transaction
+
+    @staticmethod
+    def add(conn, groups: Dict[Tuple[int, str], UserBitmap]):
+        """Merge {(day, platform): ids} into the stored bitmaps"""
+        for (day, platform), bitmap in groups.items():
+            stored = dict(conn.execute(
+                'SELECT chunk, bits FROM user_bitmaps WHERE day = ? AND platform = ?', (day, platform)
+            ))
+            updates = []
+            for key, chunk in bitmap.chunks.items():
+                if key in stored:
+                    chunk = UserBitmap.union(UserBitmap({key: chunk_from_bytes(stored[key])}),
+                                             UserBitmap({key: chunk})).chunks[key]
+                updates.append((day, platform, key, chunk_to_bytes(chunk)))
+            conn.executemany(
+                'INSERT OR REPLACE INTO user_bitmaps (day, platform, chunk, bits) VALUES (?, ?, ?, ?)',
+                updates
+            )
+
+    @staticmethod
+    def add_rows(conn, rows: Sequence[tuple]):
+        """Add the users of activity rows (user_id, timestamp, day, activity_type, platform, ...)"""
+        ids = lookup_ids(conn, {row[0] for row in rows})
+        by_group = defaultdict(list)
+        for row in rows:
+            user_id = ids[row[0]]
+            by_group[row[2], ALL_PLATFORMS].append(user_id)
+            if row[4] is not None:
+                by_group[row[2], row[4]].append(user_id)
+        BitmapIndex.add(conn, {
+            group: UserBitmap.from_ids(np.array(values, dtype=np.int64))
+            for group, values in by_group.items()
+        })
+
+    @staticmethod
+    def load(conn, start_day: int, end_day: int,
+             platform: str = ALL_PLATFORMS) -> Dict[int, UserBitmap]:
+        """{day: bitmap} for every day of the range with active users"""
+        days = defaultdict(dict)
+        for day, key, bits in conn.execute('''
+            SELECT day, chunk, bits FROM user_bitmaps
+            WHERE platform = ? AND day BETWEEN ? AND ?
+        ''', (platform, start_day, end_day)):
+            days[day][key] = chunk_from_bytes(bits)
+        return {day: UserBitmap(chunks) for day, chunks in sorted(days.items())}
+
+    @staticmethod
+    def drop_days(conn, first_day: int, last_day: int):
+        conn.execute('DELETE FROM user_bitmaps WHERE day BETWEEN ? AND ?', (first_day, last_day))
+
+    def _rebuild_day(self, conn, day: int):
+        self.drop_days(conn, day, day)
+        day_ids, platform_ids = [], defaultdict(list)
+        cursor = conn.execute(f'''
+            SELECT DISTINCT u.id, a.platform
+            FROM {activity_source(conn, day, day)} AS a
+            JOIN users AS u ON u.user_id = a.user_id
+            WHERE a.day = ?
+        ''', (day,))
+        for user_id, platform in cursor:
+            day_ids.append(user_id)
+            if platform is not None:
+                platform_ids[platform].append(user_id)
+        groups = {(day, ALL_PLATFORMS): UserBitmap.from_ids(np.array(day_ids, dtype=np.int64))}
+        for platform, values in platform_ids.items():
+            groups[day, platform] = UserBitmap.from_ids(np.array(values, dtype=np.int64))
+        self.add(conn, groups)
+
+    def rebuild(self, start_day: Optional[int] = None, end_day: Optional[int] = None) -> int:
+        """Recompute the bitmaps of every day with raw events in the range, return how many"""
+        from .partition import activity_tables
+
+        with self.pool.reader() as conn:
+            days = sorted({
+                row[0]
+                for table in activity_tables(conn)
+                for row in conn.execute(f'''
+                    SELECT DISTINCT day FROM {table} WHERE day BETWEEN ? AND ?
+                ''', (-(1 << 31) if start_day is None else start_day,
+                      (1 << 31) if end_day is None else end_day))
+            })
+        for i in range(0, len(days), self.days_per_transaction):
+            with self.pool.writer() as conn:
+                for day in days[i:i + self.days_per_transaction]:
+                    self._rebuild_day(conn, day)
+        if days and self.pool.cache is not None:
+            self.pool.cache.invalidate_days(days)
+        return len(days)
+
+def main():
+    from .pool import ConnectionPool
+
+    parser = argparse.ArgumentParser(description='Rebuild per-day user bitmaps from raw events')
+    parser.add_argument('db_path', nargs='?', default='dau_tracking.db')
+    args = parser.parse_args()
+
+    pool = ConnectionPool(args.db_path)
+    try:
+        rebuilt = BitmapIndex(pool).rebuild()
+    finally:
+        pool.close()
+    print(f"{args.db_path}: rebuilt user bitmaps of {rebuilt} days")
+
+if __name__ == '__main__':
+    main()
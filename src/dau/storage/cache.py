@@ -0,0 +1,154 @@
+"""In-process cache of query results keyed by query and day window
+
+Past days rarely change, so results over closed windows (ending before
+today) are kept until they are evicted or a write touches one of their
+days. Results over windows that include today also expire after ``ttl``
+seconds, which bounds staleness from writers in other processes.
+
+``DAUTracker`` invalidates the days it writes after every commit, so with
+one writer process a cached answer is never stale. Create the cache on the
+shared pool to enable it everywhere::
+
+    pool = ConnectionPool('dau_tracking.db', cache=QueryCache(max_entries=512, ttl=30))
+    report = DAUReport(pool=pool)
+
+A result computed while a write invalidated one of its days is returned
+but not stored, so a slow query racing a writer cannot cache a stale answer.
+
+Cached values are shared between callers and must not be modified.
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Hashable, Iterable, List, Optional, Tuple
+from .schema import epoch_day
+from .timezones import DAY_MARGIN, zone_day_source
+
+class QueryCache:
+    """LRU cache with per-entry day windows and TTL for open windows"""
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 60.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # key -> (value, start_day, end_day, expires_at or None)
+        self._entries = OrderedDict()
+        # Bumped by every invalidation; day -> generation of its last invalidation
+        self._generation = 0
+        self._invalidated = {}
+        self._cleared = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, start_day: int, end_day: int, compute: Callable[[], Any]) -> Any:
+        """Cached result for key, computing and storing it on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at = entry[3]
+                if expires_at is None or time.monotonic() < expires_at:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                del self._entries[key]
+            self.misses += 1
+            generation = self._generation
+
+        value = compute()
+        today = epoch_day(datetime.now())
+        expires_at = None if end_day < today else time.monotonic() + self.ttl
+        with self._lock:
+            if self._changed_since(generation, start_day, end_day):
+                return value
+            self._entries[key] = (value, start_day, end_day, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def _changed_since(self, generation: int, start_day: int, end_day: int) -> bool:
+        if self._cleared > generation:
+            return True
+        if self._generation == generation:
+            return False
+        return any(self._invalidated.get(day, 0) > generation for day in range(start_day, end_day + 1))
+
+    def invalidate_days(self, days: Iterable[int]):
+        """Drop every entry whose window contains one of days"""
+        days = sorted(set(days))
+        if not days:
+            return
+        first, last = days[0], days[-1]
+        with self._lock:
+            self._generation += 1
+            for day in days:
+                self._invalidated[day] = self._generation
+            stale = [
+                key for key, (_, start_day, end_day, _) in self._entries.items()
+                if start_day <= last and end_day >= first and
+                any(start_day <= day <= end_day for day in days)
+            ]
+            for key in stale:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._cleared = self._generation
+            self._entries.clear()
+
+def cached(pool, key: Hashable, start_day: int, end_day: int, compute: Callable[[], Any]) -> Any:
+    """compute() through the pool's cache, or directly when it has none"""
+    cache = getattr(pool, 'cache', None)
+    if cache is None:
+        return compute()
+    return cache.get(key, start_day, end_day, compute)
+
+def daily_active_users(pool, start_day: int, end_day: int,
+                       timezone: Optional[str] = None) -> List[Tuple[int, int]]:
+    """(day, distinct users) for the range, caching closed days apart from today
+
+    Completed days are rolled up before they are read, so only today is
+    counted from raw events. With a cache, writes to today then only
+    invalidate the one-day tail instead of the whole window.
+
+    With a timezone, days are that zone's stored day buckets (see
+    ``storage.timezones``) and are counted from raw events.
+    """
+    from .rollup import RollupManager
+
+    if timezone is not None:
+        return cached(pool, ('daily_active_users', timezone, start_day, end_day),
+                      start_day - DAY_MARGIN, end_day + DAY_MARGIN,
+                      lambda: _timezone_daily_active_users(pool, start_day, end_day, timezone))
+
+    today = epoch_day(datetime.now())
+
+    def compute(start: int, end: int):
+        RollupManager(pool).refresh_closed(start, end, today)
+        with pool.snapshot() as conn:
+            return RollupManager.daily_active_users(conn, start, end)
+
+    if getattr(pool, 'cache', None) is None or not start_day < today <= end_day:
+        return cached(pool, ('daily_active_users', start_day, end_day), start_day, end_day,
+                      lambda: compute(start_day, end_day))
+    closed = cached(pool, ('daily_active_users', start_day, today - 1), start_day, today - 1,
+                    lambda: compute(start_day, today - 1))
+    current = cached(pool, ('daily_active_users', today, end_day), today, end_day,
+                     lambda: compute(today, end_day))
+    return closed + current
+
+def _timezone_daily_active_users(pool, start_day: int, end_day: int, timezone: str) -> List[Tuple[int, int]]:
+    with pool.snapshot() as conn:
+        column, source, where, params = zone_day_source(conn, start_day, end_day, timezone)
+        return conn.execute(f'''
+            SELECT {column}, COUNT(DISTINCT user_id)
+            FROM {source}
+            WHERE {where}
+            GROUP BY {column}
+            ORDER BY {column}
+        ''', params).fetchall()
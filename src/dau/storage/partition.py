@@ -0,0 +1,272 @@
+"""Time-partitioned storage for user activities
+
+Once partitioning is enabled (by ``'day'`` or ``'month'``), new events are
+written to one table per period, ``user_activities_m202502`` or
+``user_activities_d20250216``, each with the same columns and indexes as
+``user_activities``. The ``activity_partitions`` catalog records the day
+range of every partition table. ``user_activities`` itself keeps the
+events written before partitioning until ``partition_existing`` moves them.
+
+Readers call ``activity_source`` for the FROM clause of a day-range query,
+which names only the partitions overlapping the range, so query cost
+follows the window rather than the whole history. Retention works on whole
+partitions: old partitions are dropped with ``DROP TABLE`` instead of large
+DELETEs, and rolled-up partitions can be compacted, keeping only their
+daily rollups.
+
+Run retention by hand or from a scheduler with::
+
+    python -m src.dau.storage.partition dau_tracking.db --keep-days 400 --compact-after 90
+"""
+import argparse
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from .schema import ACTIVITY_INDEXES, day_to_date, epoch_day, get_setting, set_setting
+from .timezones import DayBuckets, timezone_columns
+
+GRANULARITIES = ('day', 'month')
+
+ACTIVITY_COLUMNS = (
+    'user_id', 'timestamp', 'day', 'activity_type', 'platform',
+    'region', 'device', 'session_duration', 'metadata'
+)
+
+def partition_bounds(day: int, granularity: str) -> Tuple[str, int, int]:
+    """(table name, first day, last day) of the partition holding day"""
+    value = day_to_date(day)
+    if granularity == 'day':
+        return f'user_activities_d{value:%Y%m%d}', day, day
+    if granularity == 'month':
+        first = value.replace(day=1)
+        following = first.replace(year=first.year + first.month // 12, month=first.month % 12 + 1)
+        first_day = epoch_day(first)
+        return f'user_activities_m{value:%Y%m}', first_day, epoch_day(following) - 1
+    raise ValueError(f"Unknown partition granularity {granularity}, choose from {', '.join(GRANULARITIES)}")
+
+def activity_tables(conn) -> List[str]:
+    """user_activities and every partition table, for schema changes"""
+    return ['user_activities'] + [
+        row[0] for row in conn.execute('SELECT name FROM activity_partitions ORDER BY first_day')
+    ]
+
+def layout_generation(conn) -> int:
+    """Counter bumped whenever stored events move between tables or are dropped
+
+    Readers that cache events by rowid reload everything when it changes.
+    """
+    return int(get_setting(conn, 'layout_generation', '0'))
+
+def _bump_layout_generation(conn):
+    set_setting(conn, 'layout_generation', str(layout_generation(conn) + 1))
+
+def activity_source(conn, start_day: int, end_day: int) -> str:
+    """FROM clause covering every event in the day range
+
+    A plain table name when one table holds the range, otherwise a UNION
+    ALL of the overlapping tables aliased as user_activities. WHERE terms
+    on day are pushed into each branch, so every table is searched by its
+    own day index.
+    """
+    tables = [
+        row[0] for row in conn.execute('''
+            SELECT name FROM activity_partitions
+            WHERE first_day <= ? AND last_day >= ?
+            ORDER BY first_day
+        ''', (end_day, start_day))
+    ]
+    if not tables:
+        return 'user_activities'
+    if conn.execute('SELECT 1 FROM user_activities WHERE day BETWEEN ? AND ? LIMIT 1',
+                    (start_day, end_day)).fetchone():
+        tables.insert(0, 'user_activities')
+    if len(tables) == 1:
+        return tables[0]
+    return '(' + ' UNION ALL '.join(f'SELECT * FROM {table}' for table in tables) + ') AS user_activities'
+
+def _create_partition(conn, name: str, first_day: int, last_day: int):
+    ddl = conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'user_activities'"
+    ).fetchone()[0]
+    # Same columns, in the same order, as user_activities
+    conn.execute(ddl.replace('user_activities', name, 1))
+    for index, index_columns in ACTIVITY_INDEXES.items():
+        conn.execute(f"CREATE INDEX {index.replace('user_activities', name)} ON {name} {index_columns}")
+    for column in timezone_columns(conn).values():
+        conn.execute(f'CREATE INDEX idx_{name}_{column}_user ON {name} ({column}, user_id)')
+    conn.execute('INSERT INTO activity_partitions (name, first_day, last_day) VALUES (?, ?, ?)',
+                 (name, first_day, last_day))
+
+def insert_activities(conn, rows: List[tuple]):
+    """Insert rows shaped like ACTIVITY_COLUMNS into the table for their day
+
+    The day in every configured timezone (see ``storage.timezones``) is
+    appended to each row on the way in.
+    """
+    columns = ACTIVITY_COLUMNS
+    zones = timezone_columns(conn)
+    if zones:
+        columns += tuple(zones.values())
+        buckets = DayBuckets(list(zones))
+        rows = [row + buckets(row[1]) for row in rows]
+    insert = f'''
+        INSERT INTO {{table}} ({', '.join(columns)})
+        VALUES ({', '.join('?' * len(columns))})
+    '''
+    granularity = get_setting(conn, 'partition_by')
+    if granularity is None:
+        conn.executemany(insert.format(table='user_activities'), rows)
+        return
+
+    bounds = {}
+    tables: Dict[str, List[tuple]] = {}
+    for row in rows:
+        day = row[2]
+        if day not in bounds:
+            bounds[day] = partition_bounds(day, granularity)
+        tables.setdefault(bounds[day][0], []).append(row)
+
+    known = {row[0] for row in conn.execute('SELECT name FROM activity_partitions')}
+    for name, first_day, last_day in set(bounds.values()):
+        if name not in known:
+            _create_partition(conn, name, first_day, last_day)
+    for name, table_rows in tables.items():
+        conn.executemany(insert.format(table=name), table_rows)
+
+class PartitionManager:
+    def __init__(self, pool):
+        self.pool = pool
+
+    def granularity(self) -> Optional[str]:
+        with self.pool.reader() as conn:
+            return get_setting(conn, 'partition_by')
+
+    def enable(self, granularity: str = 'month'):
+        """Route new events to per-day or per-month partitions"""
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"Unknown partition granularity {granularity}, choose from {', '.join(GRANULARITIES)}")
+        with self.pool.writer() as conn:
+            set_setting(conn, 'partition_by', granularity)
+
+    def disable(self):
+        """Write new events to user_activities again; existing partitions stay readable"""
+        with self.pool.writer() as conn:
+            set_setting(conn, 'partition_by', None)
+
+    def partitions(self) -> List[Tuple[str, int, int]]:
+        """(table name, first day, last day) of every partition, oldest first"""
+        with self.pool.reader() as conn:
+            return conn.execute(
+                'SELECT name, first_day, last_day FROM activity_partitions ORDER BY first_day'
+            ).fetchall()
+
+    def partition_existing(self, pause: float = 0.0) -> int:
+        """Move events from user_activities into partitions, one partition per transaction
+
+        Returns the number of events moved.
+        """
+        with self.pool.reader() as conn:
+            granularity = get_setting(conn, 'partition_by')
+            days = [row[0] for row in conn.execute('SELECT DISTINCT day FROM user_activities ORDER BY day')]
+        if granularity is None:
+            raise ValueError('Partitioning is not enabled, call PartitionManager.enable()')
+
+        ranges = sorted({partition_bounds(day, granularity) for day in days}, key=lambda bounds: bounds[1])
+        moved = 0
+        for name, first_day, last_day in ranges:
+            with self.pool.writer() as conn:
+                columns = ', '.join(ACTIVITY_COLUMNS + tuple(timezone_columns(conn).values()))
+                if not conn.execute('SELECT 1 FROM activity_partitions WHERE name = ?', (name,)).fetchone():
+                    _create_partition(conn, name, first_day, last_day)
+                moved += conn.execute(f'''
+                    INSERT INTO {name} ({columns})
+                    SELECT {columns} FROM user_activities WHERE day BETWEEN ? AND ?
+                ''', (first_day, last_day)).rowcount
+                conn.execute('DELETE FROM user_activities WHERE day BETWEEN ? AND ?', (first_day, last_day))
+                _bump_layout_generation(conn)
+            if pause:
+                time.sleep(pause)
+
+        with self.pool.writer() as conn:
+            for name, _, _ in ranges:
+                conn.execute(f'ANALYZE {name}')
+        return moved
+
+    def _drop(self, conn, name: str):
+        conn.execute(f'DROP TABLE {name}')
+        conn.execute('DELETE FROM activity_partitions WHERE name = ?', (name,))
+        _bump_layout_generation(conn)
+
+    def apply_retention(self, keep_days: Optional[int] = None, compact_after_days: Optional[int] = None,
+                        today: Optional[datetime] = None) -> Dict[str, List[str]]:
+        """Drop and compact whole partitions that ended before the cutoffs
+
+        Partitions older than keep_days are dropped together with their
+        rollups and user bitmaps. Partitions older than compact_after_days
+        have their dirty days rolled up and then lose their raw events, so
+        trends, sketch-based counts and user set queries over them still
+        work from the rollups and bitmaps. Returns
+        the names of the dropped and compacted partitions.
+        """
+        from .rollup import RollupManager
+
+        today_day = epoch_day(today or datetime.now())
+        dropped, compacted = [], []
+
+        if keep_days is not None:
+            cutoff = today_day - keep_days
+            with self.pool.writer() as conn:
+                for name, first_day, last_day in conn.execute(
+                        'SELECT name, first_day, last_day FROM activity_partitions WHERE last_day < ?',
+                        (cutoff,)).fetchall():
+                    self._drop(conn, name)
+                    conn.execute('DELETE FROM daily_rollups WHERE day BETWEEN ? AND ?', (first_day, last_day))
+                    conn.execute('DELETE FROM rollup_dirty WHERE day BETWEEN ? AND ?', (first_day, last_day))
+                    conn.execute('DELETE FROM user_bitmaps WHERE day BETWEEN ? AND ?', (first_day, last_day))
+                    dropped.append(name)
+
+        if compact_after_days is not None:
+            cutoff = today_day - compact_after_days
+            rollups = RollupManager(self.pool)
+            for name, first_day, last_day in self.partitions():
+                if last_day >= cutoff:
+                    break
+                rollups.refresh_days(day for day in rollups.dirty_days() if first_day <= day <= last_day)
+                with self.pool.writer() as conn:
+                    self._drop(conn, name)
+                    through = int(get_setting(conn, 'compacted_through', '-1'))
+                    set_setting(conn, 'compacted_through', str(max(through, last_day)))
+                compacted.append(name)
+
+        if (dropped or compacted) and self.pool.cache is not None:
+            self.pool.cache.clear()
+        return {'dropped': dropped, 'compacted': compacted}
+
+def main():
+    from .pool import ConnectionPool
+
+    parser = argparse.ArgumentParser(description='Manage time partitions of a DAU database')
+    parser.add_argument('db_path', nargs='?', default='dau_tracking.db')
+    parser.add_argument('--enable', choices=GRANULARITIES,
+                        help='Partition new events by day or month')
+    parser.add_argument('--partition-existing', action='store_true',
+                        help='Move events written before partitioning into partitions')
+    parser.add_argument('--keep-days', type=int, help='Drop partitions older than this')
+    parser.add_argument('--compact-after', type=int,
+                        help='Keep only rollups for partitions older than this')
+    args = parser.parse_args()
+
+    with ConnectionPool(args.db_path) as pool:
+        partitions = PartitionManager(pool)
+        if args.enable:
+            partitions.enable(args.enable)
+        if args.partition_existing:
+            print(f"Moved {partitions.partition_existing()} events into partitions")
+        if args.keep_days is not None or args.compact_after is not None:
+            result = partitions.apply_retention(args.keep_days, args.compact_after)
+            print(f"Dropped {len(result['dropped'])} partitions, compacted {len(result['compacted'])}")
+        print(f"{args.db_path}: {len(partitions.partitions())} partitions, "
+              f"partitioned by {partitions.granularity() or 'nothing'}")
+
+if __name__ == '__main__':
+    main()
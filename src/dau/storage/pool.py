@@ -0,0 +1,163 @@
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+from . import schema
+
+class ConnectionPool:
+    """Shared SQLite connections for one DAU database
+
+    The pool owns a single writer connection, serialized behind a lock, and
+    hands out up to ``readers`` read-only connections from a queue. The
+    database is switched to WAL journaling so reports and predictions can
+    read while ingestion is writing. Pass the same pool to ``DAUTracker``,
+    ``DAUReport`` and ``SimpleDAUPredictor`` to share it between them.
+
+    With ``synchronous='NORMAL'`` (the default) a commit survives an
+    application crash but the last transactions may be lost on power
+    failure; use ``'FULL'`` when every commit must reach the disk.
+
+    Opening a pool upgrades the database to the current schema unless
+    ``migrate=False`` is passed.
+
+    Pass a ``QueryCache`` as ``cache`` to share cached query results
+    between everything using the pool, see ``storage.cache``. Pass an
+    ``Instrumentation`` as ``instrumentation`` to time statements and
+    connection waits, see ``metrics.instrumentation``.
+    """
+
+    def __init__(self, db_path: str = 'dau_tracking.db', readers: int = 4,
+                 synchronous: str = 'NORMAL', cache_size: int = -65536,
+                 mmap_size: int = 256 * 1024 * 1024, timeout: float = 30.0,
+                 migrate: bool = True, cache=None, instrumentation=None):
+        self.db_path = db_path
+        self.cache = cache
+        self.instrumentation = instrumentation
+        # connection -> VM step counter, when instrumented
+        self._step_counters = {}
+        self.max_readers = readers
+        self.synchronous = synchronous
+        self.cache_size = cache_size
+        self.mmap_size = mmap_size
+        self.timeout = timeout
+        self.in_memory = db_path == ':memory:'
+
+        self._write_lock = threading.RLock()
+        self._readers = queue.LifoQueue()
+        self._reader_count = 0
+        self._reader_lock = threading.Lock()
+        self._all_readers = []
+        self._closed = False
+
+        self._writer = sqlite3.connect(db_path, timeout=timeout, check_same_thread=False)
+        if not self.in_memory:
+            self._writer.execute('PRAGMA journal_mode=WAL')
+        self._configure(self._writer)
+        if migrate:
+            schema.migrate(self)
+
+    def _configure(self, conn: sqlite3.Connection):
+        conn.execute(f'PRAGMA synchronous={self.synchronous}')
+        conn.execute(f'PRAGMA cache_size={int(self.cache_size)}')
+        conn.execute(f'PRAGMA mmap_size={int(self.mmap_size)}')
+        conn.execute(f'PRAGMA busy_timeout={int(self.timeout * 1000)}')
+        if self.instrumentation is not None:
+            self._step_counters[conn] = self.instrumentation.install(conn)
+
+    def _wrap(self, conn: sqlite3.Connection) -> sqlite3.Connection:
+        if self.instrumentation is None:
+            return conn
+        return self.instrumentation.wrap(conn, self._step_counters[conn])
+
+    def _open_reader(self) -> sqlite3.Connection:
+        uri = Path(self.db_path).resolve().as_uri() + '?mode=ro'
+        conn = sqlite3.connect(uri, uri=True, timeout=self.timeout, check_same_thread=False)
+        self._configure(conn)
+        return conn
+
+    @contextmanager
+    def writer(self) -> Iterator[sqlite3.Connection]:
+        """Borrow the writer connection inside a transaction
+
+        The transaction commits when the block exits and rolls back if it
+        raises. Only one thread holds the writer at a time.
+        """
+        started = time.perf_counter() if self.instrumentation is not None else None
+        with self._write_lock:
+            if started is not None:
+                self.instrumentation.record_wait('writer', time.perf_counter() - started)
+            if self._closed:
+                raise sqlite3.ProgrammingError('Connection pool is closed')
+            with self._writer:
+                yield self._wrap(self._writer)
+
+    @contextmanager
+    def reader(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a read-only connection, waiting if all of them are in use"""
+        if self.in_memory:
+            # In-memory databases are private to one connection
+            with self._write_lock:
+                yield self._wrap(self._writer)
+            return
+
+        started = time.perf_counter() if self.instrumentation is not None else None
+        try:
+            conn = self._readers.get_nowait()
+        except queue.Empty:
+            conn = None
+            with self._reader_lock:
+                if self._closed:
+                    raise sqlite3.ProgrammingError('Connection pool is closed')
+                if self._reader_count < self.max_readers:
+                    self._reader_count += 1
+                    conn = self._open_reader()
+                    self._all_readers.append(conn)
+            if conn is None:
+                try:
+                    conn = self._readers.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise sqlite3.OperationalError('Timed out waiting for a reader connection')
+        if started is not None:
+            self.instrumentation.record_wait('reader', time.perf_counter() - started)
+
+        try:
+            yield self._wrap(conn)
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._readers.put(conn)
+
+    @contextmanager
+    def snapshot(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a reader inside a read transaction
+
+        All statements run in the block see the same committed state, which
+        matters when one answer is assembled from several queries.
+        """
+        with self.reader() as conn:
+            if conn.in_transaction:
+                yield conn
+                return
+            conn.execute('BEGIN')
+            try:
+                yield conn
+            finally:
+                conn.rollback()
+
+    def close(self):
+        with self._write_lock, self._reader_lock:
+            if self._closed:
+                return
+            self._closed = True
+            for conn in self._all_readers:
+                conn.close()
+            self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,306 @@
+"""Daily rollups of distinct users and event counts
+
+``daily_rollups`` holds one row per day for the whole population
+(dimension ``'all'``) and one per day and value of each entry in
+``DIMENSIONS``. ``DAUTracker`` marks every day it writes to in
+``rollup_dirty``; ``RollupManager.refresh`` recomputes the dirty days
+from the raw events. Readers take clean days from the rollups and only
+recompute dirty days from ``user_activities``, so a fully refreshed window
+costs O(days) instead of O(events). Trend readers roll up the completed
+dirty days of their window as they go (``refresh_closed``), so consecutive
+calls over a sliding window only recompute today.
+
+Once ``enable_sketches`` has been called, every rollup row also carries a
+HyperLogLog sketch of its users. Sketches merge across days, which answers
+distinct users over arbitrary ranges (weekly/monthly actives, per-platform
+uniques over a window) approximately without touching raw events.
+
+Run the catch-up job by hand or from a scheduler with::
+
+    python -m src.dau.storage.rollup dau_tracking.db
+"""
+import argparse
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+from ..sketch.hyperloglog import HyperLogLog, precision_for_error
+from .partition import activity_source
+from .schema import epoch_day, get_setting, set_setting
+
+TOTAL = 'all'
+DIMENSIONS = ('activity_type', 'platform', 'region', 'device')
+
+def _value_expression(dimension: str) -> str:
+    if dimension == TOTAL:
+        return "''"
+    if dimension not in DIMENSIONS:
+        raise ValueError(f"Unknown rollup dimension: {dimension}")
+    return f"COALESCE({dimension}, '')"
+
+def _sliding_union(sketches: List[HyperLogLog], window: int) -> List[HyperLogLog]:
+    """Union of each run of window consecutive sketches ending at every position
+
+    Uses per-block prefix and suffix unions (van Herk/Gil-Werman) so each
+    position costs a constant number of merges regardless of the window.
+    """
+    n = len(sketches)
+    prefix = [None] * n
+    suffix = [None] * n
+    for i in range(n):
+        prefix[i] = sketches[i] if i % window == 0 else prefix[i - 1] | sketches[i]
+    for i in reversed(range(n)):
+        last_in_block = i % window == window - 1 or i == n - 1
+        suffix[i] = sketches[i] if last_in_block else suffix[i + 1] | sketches[i]
+
+    result = []
+    for i in range(n):
+        start = i - window + 1
+        result.append(prefix[i] if start <= 0 else suffix[start] | prefix[i])
+    return result
+
+class RollupManager:
+    def __init__(self, pool, days_per_transaction: int = 7):
+        self.pool = pool
+        self.days_per_transaction = days_per_transaction
+
+    def dirty_days(self) -> List[int]:
+        with self.pool.reader() as conn:
+            return [row[0] for row in conn.execute('SELECT day FROM rollup_dirty ORDER BY day')]
+
+    def enable_sketches(self, error: float = 0.01):
+        """Keep HyperLogLog sketches with the given relative standard error and backfill them"""
+        with self.pool.writer() as conn:
+            set_setting(conn, 'hll_precision', str(precision_for_error(error)))
+            conn.execute('INSERT OR IGNORE INTO rollup_dirty (day) SELECT day FROM daily_rollups')
+        self.refresh()
+
+    def disable_sketches(self):
+        with self.pool.writer() as conn:
+            set_setting(conn, 'hll_precision', None)
+            conn.execute('UPDATE daily_rollups SET sketch = NULL')
+
+    @staticmethod
+    def sketch_precision(conn) -> Optional[int]:
+        precision = get_setting(conn, 'hll_precision')
+        return int(precision) if precision is not None else None
+
+    def _rebuild_day(self, conn, day: int, precision: Optional[int]):
+        conn.execute('DELETE FROM daily_rollups WHERE day = ?', (day,))
+        source = activity_source(conn, day, day)
+        for dimension in (TOTAL,) + DIMENSIONS:
+            value = _value_expression(dimension)
+            conn.execute(f'''
+                INSERT INTO daily_rollups (day, dimension, value, users, events, metadata_bytes)
+                SELECT day, ?, {value}, COUNT(DISTINCT user_id), COUNT(*),
+                       COALESCE(SUM(LENGTH(metadata)), 0)
+                FROM {source}
+                WHERE day = ?
+                GROUP BY {value}
+            ''', (dimension, day))
+
+            if precision is not None:
+                sketches = defaultdict(lambda: HyperLogLog(precision))
+                for key, user_id in conn.execute(f'''
+                    SELECT DISTINCT {value}, user_id FROM {source} WHERE day = ?
+                ''', (day,)):
+                    sketches[key].add(user_id)
+                conn.executemany('''
+                    UPDATE daily_rollups SET sketch = ?
+                    WHERE day = ? AND dimension = ? AND value = ?
+                ''', [(sketch.to_bytes(), day, dimension, key) for key, sketch in sketches.items()])
+
+        conn.execute('DELETE FROM rollup_dirty WHERE day = ?', (day,))
+
+    def refresh_days(self, days: Iterable[int]) -> int:
+        """Recompute the rollups of the given days, return how many were rebuilt"""
+        days = sorted(set(days))
+        for i in range(0, len(days), self.days_per_transaction):
+            with self.pool.writer() as conn:
+                precision = self.sketch_precision(conn)
+                # Compacted days have no raw events left to rebuild from
+                compacted_through = int(get_setting(conn, 'compacted_through', '-1'))
+                for day in days[i:i + self.days_per_transaction]:
+                    if day <= compacted_through:
+                        conn.execute('DELETE FROM rollup_dirty WHERE day = ?', (day,))
+                    else:
+                        self._rebuild_day(conn, day, precision)
+        return len(days)
+
+    def refresh(self) -> int:
+        """Catch up every dirty day, return how many days were rebuilt"""
+        return self.refresh_days(self.dirty_days())
+
+    def refresh_closed(self, start_day: int, end_day: int, today: Optional[int] = None) -> int:
+        """Roll up the dirty days of the range that are over, return how many
+
+        Readers call this before reading a window so every completed day is
+        computed from raw events once and read from daily_rollups after
+        that; only today, which is still receiving events, stays dirty.
+        """
+        if today is None:
+            today = epoch_day(datetime.now())
+        end_day = min(end_day, today - 1)
+        if end_day < start_day:
+            return 0
+        with self.pool.reader() as conn:
+            days = [row[0] for row in conn.execute(
+                'SELECT day FROM rollup_dirty WHERE day BETWEEN ? AND ?', (start_day, end_day)
+            )]
+        return self.refresh_days(days) if days else 0
+
+    @staticmethod
+    def daily_active_users(conn, start_day: int, end_day: int) -> List[Tuple[int, int]]:
+        """(day, distinct users) for every active day in the range
+
+        Clean days come from the rollups and dirty days are counted from the
+        raw events. Run it inside a read transaction (``pool.snapshot()``)
+        so a concurrent refresh cannot move a day between the two queries.
+        """
+        rows = dict(conn.execute('''
+            SELECT day, users
+            FROM daily_rollups
+            WHERE dimension = ? AND day BETWEEN ? AND ?
+        ''', (TOTAL, start_day, end_day)))
+        rows.update(conn.execute(f'''
+            SELECT day, COUNT(DISTINCT user_id)
+            FROM {activity_source(conn, start_day, end_day)}
+            WHERE day IN (
+                SELECT day FROM rollup_dirty WHERE day BETWEEN ? AND ?
+            )
+            GROUP BY day
+        ''', (start_day, end_day)))
+        return sorted(rows.items())
+
+    @staticmethod
+    def daily_dimension_users(conn, dimension: str, start_day: int,
+                              end_day: int) -> List[Tuple[str, int, int]]:
+        """(value, day, distinct users) for one dimension, sorted by value and day
+
+        Same clean/dirty split as daily_active_users; run it inside
+        ``pool.snapshot()``.
+        """
+        value = _value_expression(dimension)
+        rows = {
+            (key, day): users for key, day, users in conn.execute('''
+                SELECT value, day, users
+                FROM daily_rollups
+                WHERE dimension = ? AND day BETWEEN ? AND ?
+                  AND day NOT IN (SELECT day FROM rollup_dirty WHERE day BETWEEN ? AND ?)
+            ''', (dimension, start_day, end_day, start_day, end_day))
+        }
+        for key, day, users in conn.execute(f'''
+            SELECT {value}, day, COUNT(DISTINCT user_id)
+            FROM {activity_source(conn, start_day, end_day)}
+            WHERE day IN (
+                SELECT day FROM rollup_dirty WHERE day BETWEEN ? AND ?
+            )
+            GROUP BY {value}, day
+        ''', (start_day, end_day)):
+            rows[key, day] = users
+        return [key + (users,) for key, users in sorted(rows.items())]
+
+    @classmethod
+    def daily_sketches(cls, conn, start_day: int, end_day: int,
+                       dimension: str = TOTAL) -> Dict[int, Dict[str, HyperLogLog]]:
+        """{day: {value: sketch}} for every active day in the range
+
+        Dirty days have no stored sketch yet and are sketched from the raw
+        events. Run it inside ``pool.snapshot()``.
+        """
+        precision = cls.sketch_precision(conn)
+        if precision is None:
+            raise ValueError('HyperLogLog sketches are not enabled, call RollupManager.enable_sketches()')
+
+        days = defaultdict(dict)
+        for day, value, blob in conn.execute('''
+            SELECT day, value, sketch
+            FROM daily_rollups
+            WHERE dimension = ? AND day BETWEEN ? AND ?
+              AND day NOT IN (SELECT day FROM rollup_dirty WHERE day BETWEEN ? AND ?)
+        ''', (dimension, start_day, end_day, start_day, end_day)):
+            days[day][value] = HyperLogLog.from_bytes(blob)
+
+        for day, value, user_id in conn.execute(f'''
+            SELECT DISTINCT day, {_value_expression(dimension)}, user_id
+            FROM {activity_source(conn, start_day, end_day)}
+            WHERE day IN (
+                SELECT day FROM rollup_dirty WHERE day BETWEEN ? AND ?
+            )
+        ''', (start_day, end_day)):
+            sketches = days[day]
+            if value not in sketches:
+                sketches[value] = HyperLogLog(precision)
+            sketches[value].add(user_id)
+
+        return days
+
+    @classmethod
+    def approximate_unique_users(cls, conn, start_day: int, end_day: int,
+                                 dimension: str = TOTAL) -> Dict[str, int]:
+        """Approximate distinct users over the whole range, per dimension value"""
+        merged = {}
+        for sketches in cls.daily_sketches(conn, start_day, end_day, dimension).values():
+            for value, sketch in sketches.items():
+                merged[value] = merged[value].merge(sketch) if value in merged else sketch
+        return {value: sketch.count() for value, sketch in merged.items()}
+
+    @classmethod
+    def rolling_active_users(cls, conn, start_day: int, end_day: int,
+                             window: int) -> List[Tuple[int, int]]:
+        """(day, approximate distinct users over the window days ending at day)"""
+        first_day = start_day - window + 1
+        daily = cls.daily_sketches(conn, first_day, end_day)
+        precision = cls.sketch_precision(conn)
+        empty = HyperLogLog(precision)
+        sketches = [daily.get(day, {}).get('', empty) for day in range(first_day, end_day + 1)]
+        unions = _sliding_union(sketches, window)
+        return [
+            (day, unions[day - first_day].count())
+            for day in range(start_day, end_day + 1)
+        ]
+
+    @staticmethod
+    def dimension_totals(conn, start_day: int, end_day: int,
+                         dimension: str) -> Dict[str, Tuple[int, int]]:
+        """{value: (events, metadata bytes)} over the range"""
+        value = _value_expression(dimension)
+        totals = defaultdict(lambda: [0, 0])
+        for key, events, metadata_bytes in conn.execute('''
+            SELECT value, SUM(events), SUM(metadata_bytes)
+            FROM daily_rollups
+            WHERE dimension = ? AND day BETWEEN ? AND ?
+              AND day NOT IN (SELECT day FROM rollup_dirty WHERE day BETWEEN ? AND ?)
+            GROUP BY value
+        ''', (dimension, start_day, end_day, start_day, end_day)):
+            totals[key][0] += events
+            totals[key][1] += metadata_bytes
+        for key, events, metadata_bytes in conn.execute(f'''
+            SELECT {value}, COUNT(*), COALESCE(SUM(LENGTH(metadata)), 0)
+            FROM {activity_source(conn, start_day, end_day)}
+            WHERE day IN (
+                SELECT day FROM rollup_dirty WHERE day BETWEEN ? AND ?
+            )
+            GROUP BY {value}
+        ''', (start_day, end_day)):
+            totals[key][0] += events
+            totals[key][1] += metadata_bytes
+        return {key: tuple(total) for key, total in totals.items()}
+
+def main():
+    from .pool import ConnectionPool
+
+    parser = argparse.ArgumentParser(description='Rebuild daily rollups for days with new activity')
+    parser.add_argument('db_path', nargs='?', default='dau_tracking.db')
+    parser.add_argument('--sketch-error', type=float,
+                        help='Enable HyperLogLog sketches with this relative standard error')
+    args = parser.parse_args()
+
+    with ConnectionPool(args.db_path) as pool:
+        rollups = RollupManager(pool)
+        if args.sketch_error:
+            rollups.enable_sketches(args.sketch_error)
+        rebuilt = rollups.refresh()
+    print(f"{args.db_path}: rebuilt rollups for {rebuilt} days")
+
+if __name__ == '__main__':
+    main()
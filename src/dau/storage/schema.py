@@ -0,0 +1,322 @@
+"""Versioned storage schema for the DAU database
+
+The schema version is kept in ``PRAGMA user_version``. ``migrate`` brings a
+database of any older version up to ``SCHEMA_VERSION``; it runs whenever a
+``ConnectionPool`` opens a database and can also be run by hand::
+
+    python -m src.dau.storage.schema dau_tracking.db
+"""
+import argparse
+import time
+from datetime import date, datetime
+from typing import Optional, Union
+from ..models.metadata import PROMOTED_FIELDS, decode_metadata, encode_metadata
+
+SCHEMA_VERSION = 8
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+# julianday() of 1970-01-01, used to derive day numbers inside SQLite
+EPOCH_JULIAN_DAY = 2440587.5
+
+ACTIVITY_INDEXES = {
+    'idx_user_activities_day_user': '(day, user_id)',
+    'idx_user_activities_activity_day_user': '(activity_type, day, user_id)',
+    'idx_user_activities_platform_day_user': '(platform, day, user_id)',
+    'idx_user_activities_region_day_user': '(region, day, user_id)',
+    'idx_user_activities_device_day_user': '(device, day, user_id)',
+}
+
+PROMOTED_COLUMN_TYPES = {
+    'region': 'TEXT',
+    'device': 'TEXT',
+    'session_duration': 'INTEGER',
+}
+
+def epoch_day(value: Union[date, datetime]) -> int:
+    """Day number (days since 1970-01-01) of the calendar date of value"""
+    if isinstance(value, datetime):
+        value = value.date()
+    return value.toordinal() - EPOCH_ORDINAL
+
+def day_to_date(day: int) -> date:
+    return date.fromordinal(day + EPOCH_ORDINAL)
+
+def get_version(conn) -> int:
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def get_setting(conn, key: str, default: Optional[str] = None) -> Optional[str]:
+    row = conn.execute('SELECT value FROM dau_settings WHERE key = ?', (key,)).fetchone()
+    return row[0] if row else default
+
+def set_setting(conn, key: str, value: Optional[str]):
+    """Store a database-wide setting, or remove it when value is None"""
+    if value is None:
+        conn.execute('DELETE FROM dau_settings WHERE key = ?', (key,))
+    else:
+        conn.execute('INSERT OR REPLACE INTO dau_settings (key, value) VALUES (?, ?)', (key, value))
+
+def _table_columns(conn, table: str):
+    return [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+
+def _create_activity_table(conn):
+    conn.execute('''
+        CREATE TABLE user_activities (
+            id INTEGER PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            day INTEGER NOT NULL,
+            activity_type TEXT,
+            platform TEXT,
+            metadata TEXT
+        )
+    ''')
+
+def _create_activity_indexes(conn):
+    columns = set(_table_columns(conn, 'user_activities'))
+    for name, index_columns in ACTIVITY_INDEXES.items():
+        # Indexes on columns added by later versions are created by those migrations
+        if index_columns.strip('()').split(', ')[0] in columns:
+            conn.execute(f'CREATE INDEX IF NOT EXISTS {name} ON user_activities {index_columns}')
+
+def _migrate_to_v1(pool, chunk_size: int, pause: float):
+    """Add the integer day column and covering indexes
+
+    Existing rows are backfilled in rowid ranges of chunk_size, each in its
+    own short transaction, so other writers can interleave between chunks.
+    """
+    with pool.writer() as conn:
+        columns = _table_columns(conn, 'user_activities')
+        if not columns:
+            _create_activity_table(conn)
+        elif 'day' not in columns:
+            conn.execute('ALTER TABLE user_activities ADD COLUMN day INTEGER')
+        max_rowid = conn.execute('SELECT MAX(rowid) FROM user_activities').fetchone()[0] or 0
+
+    # The date part of the stored ISO string is the wall-clock day, the
+    # same value epoch_day() computes for new rows
+    for low in range(0, max_rowid + 1, chunk_size):
+        with pool.writer() as conn:
+            conn.execute(f'''
+                UPDATE user_activities
+                SET day = CAST(julianday(substr(timestamp, 1, 10)) - {EPOCH_JULIAN_DAY} AS INTEGER)
+                WHERE rowid >= ? AND rowid < ? AND day IS NULL
+            ''', (low, low + chunk_size))
+        if pause:
+            time.sleep(pause)
+
+    with pool.writer() as conn:
+        # Rows written by older code while the backfill was running
+        conn.execute(f'''
+            UPDATE user_activities
+            SET day = CAST(julianday(substr(timestamp, 1, 10)) - {EPOCH_JULIAN_DAY} AS INTEGER)
+            WHERE day IS NULL
+        ''')
+        _create_activity_indexes(conn)
+        conn.execute('ANALYZE user_activities')
+        conn.execute('PRAGMA user_version = 1')
+
+def _migrate_to_v2(pool, chunk_size: int, pause: float):
+    """Add the daily rollup tables
+
+    Every day already present in user_activities starts out dirty, so the
+    first rollup refresh backfills it.
+    """
+    with pool.writer() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS daily_rollups (
+                day INTEGER NOT NULL,
+                dimension TEXT NOT NULL,
+                value TEXT NOT NULL,
+                users INTEGER NOT NULL,
+                events INTEGER NOT NULL,
+                PRIMARY KEY (day, dimension, value)
+            ) WITHOUT ROWID
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS rollup_dirty (
+                day INTEGER PRIMARY KEY
+            ) WITHOUT ROWID
+        ''')
+        conn.execute('''
+            INSERT OR IGNORE INTO rollup_dirty (day)
+            SELECT DISTINCT day FROM user_activities
+        ''')
+        conn.execute('PRAGMA user_version = 2')
+
+def _migrate_to_v3(pool, chunk_size: int, pause: float):
+    """Add database-wide settings and sketch/metadata columns to the rollups"""
+    with pool.writer() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS dau_settings (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        ''')
+        columns = _table_columns(conn, 'daily_rollups')
+        if 'metadata_bytes' not in columns:
+            conn.execute('ALTER TABLE daily_rollups ADD COLUMN metadata_bytes INTEGER NOT NULL DEFAULT 0')
+        if 'sketch' not in columns:
+            conn.execute('ALTER TABLE daily_rollups ADD COLUMN sketch BLOB')
+        # Existing rollups have no metadata size yet
+        conn.execute('INSERT OR IGNORE INTO rollup_dirty (day) SELECT DISTINCT day FROM daily_rollups')
+        conn.execute('PRAGMA user_version = 3')
+
+def _migrate_to_v4(pool, chunk_size: int, pause: float):
+    """Promote hot metadata keys to columns and re-encode metadata as JSON
+
+    Rows are converted in rowid chunks, each in its own transaction. Rows
+    whose legacy metadata cannot be parsed are left untouched.
+    """
+    with pool.writer() as conn:
+        columns = _table_columns(conn, 'user_activities')
+        for column, column_type in PROMOTED_COLUMN_TYPES.items():
+            if column not in columns:
+                conn.execute(f'ALTER TABLE user_activities ADD COLUMN {column} {column_type}')
+        max_rowid = conn.execute('SELECT MAX(rowid) FROM user_activities').fetchone()[0] or 0
+
+    promoted = ', '.join(PROMOTED_FIELDS)
+    assignments = ', '.join(f'{column} = ?' for column in PROMOTED_FIELDS)
+    for low in range(0, max_rowid + 1, chunk_size):
+        with pool.writer() as conn:
+            updates = []
+            for rowid, blob, *values in conn.execute(f'''
+                SELECT rowid, metadata, {promoted}
+                FROM user_activities
+                WHERE rowid >= ? AND rowid < ? AND metadata IS NOT NULL
+            ''', (low, low + chunk_size)).fetchall():
+                try:
+                    metadata = decode_metadata(blob, *values)
+                except ValueError:
+                    continue
+                updates.append(encode_metadata(metadata) + (rowid,))
+            conn.executemany(f'''
+                UPDATE user_activities SET {assignments}, metadata = ? WHERE rowid = ?
+            ''', updates)
+        if pause:
+            time.sleep(pause)
+
+    with pool.writer() as conn:
+        _create_activity_indexes(conn)
+        conn.execute('ANALYZE user_activities')
+        # Rollups gain region and device dimensions
+        conn.execute('INSERT OR IGNORE INTO rollup_dirty (day) SELECT DISTINCT day FROM user_activities')
+        conn.execute('PRAGMA user_version = 4')
+
+def _migrate_to_v5(pool, chunk_size: int, pause: float):
+    """Add the catalog of time partitions, empty until partitioning is enabled"""
+    with pool.writer() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS activity_partitions (
+                name TEXT PRIMARY KEY,
+                first_day INTEGER NOT NULL,
+                last_day INTEGER NOT NULL
+            )
+        ''')
+        conn.execute('PRAGMA user_version = 5')
+
+def _migrate_to_v6(pool, chunk_size: int, pause: float):
+    """Add the users table: a compact integer id and first-seen day per user
+
+    Backfilled from every activity table, one table per transaction.
+    """
+    from .partition import activity_tables
+
+    with pool.writer() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY,
+                user_id TEXT NOT NULL UNIQUE,
+                first_day INTEGER NOT NULL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_users_first_day ON users (first_day)')
+        tables = activity_tables(conn)
+
+    for table in tables:
+        with pool.writer() as conn:
+            conn.execute(f'''
+                INSERT INTO users (user_id, first_day)
+                SELECT user_id, MIN(day) FROM {table} WHERE true GROUP BY user_id ORDER BY MIN(day)
+                ON CONFLICT (user_id) DO UPDATE SET first_day = excluded.first_day
+                WHERE excluded.first_day < users.first_day
+            ''')
+        if pause:
+            time.sleep(pause)
+
+    with pool.writer() as conn:
+        conn.execute('PRAGMA user_version = 6')
+
+def _migrate_to_v7(pool, chunk_size: int, pause: float):
+    """Add per-day and per-day-and-platform user bitmaps, backfilled from raw events"""
+    from .bitmap import BitmapIndex
+
+    with pool.writer() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS user_bitmaps (
+                day INTEGER NOT NULL,
+                platform TEXT NOT NULL,
+                chunk INTEGER NOT NULL,
+                bits BLOB NOT NULL,
+                PRIMARY KEY (day, platform, chunk)
+            ) WITHOUT ROWID
+        ''')
+    BitmapIndex(pool).rebuild()
+    with pool.writer() as conn:
+        conn.execute('PRAGMA user_version = 7')
+
+def _migrate_to_v8(pool, chunk_size: int, pause: float):
+    """Add the catalog of timezones with stored day buckets, see storage.timezones"""
+    with pool.writer() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS day_timezones (
+                timezone TEXT PRIMARY KEY,
+                column_name TEXT NOT NULL UNIQUE
+            )
+        ''')
+        conn.execute('PRAGMA user_version = 8')
+
+MIGRATIONS = {
+    1: _migrate_to_v1,
+    2: _migrate_to_v2,
+    3: _migrate_to_v3,
+    4: _migrate_to_v4,
+    5: _migrate_to_v5,
+    6: _migrate_to_v6,
+    7: _migrate_to_v7,
+    8: _migrate_to_v8,
+}
+
+def migrate(pool, chunk_size: int = 50000, pause: float = 0.0) -> int:
+    """Upgrade the database behind pool to SCHEMA_VERSION, return the new version"""
+    with pool.writer() as conn:
+        version = get_version(conn)
+
+    while version < SCHEMA_VERSION:
+        version += 1
+        MIGRATIONS[version](pool, chunk_size, pause)
+
+    return version
+
+def main():
+    from .pool import ConnectionPool
+
+    parser = argparse.ArgumentParser(description='Upgrade a DAU database to the current schema')
+    parser.add_argument('db_path', nargs='?', default='dau_tracking.db')
+    parser.add_argument('--chunk-size', type=int, default=50000,
+                        help='Rows backfilled per transaction')
+    parser.add_argument('--pause', type=float, default=0.0,
+                        help='Seconds to sleep between chunks to let other writers in')
+    args = parser.parse_args()
+
+    pool = ConnectionPool(args.db_path, migrate=False)
+    try:
+        with pool.writer() as conn:
+            before = get_version(conn)
+        after = migrate(pool, args.chunk_size, args.pause)
+    finally:
+        pool.close()
+    print(f"{args.db_path}: schema version {before} -> {after}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+"""Per-timezone day buckets computed at ingest
+
+The ``day`` column of every event is the calendar date of its timestamp as
+written: the wall-clock date for naive timestamps (taken to be in the local
+timezone of the writing process) and the date at the timestamp's own
+offset otherwise. Teams spread over several regions usually want days in a
+fixed zone instead, such as UTC or the business's home timezone.
+
+``TimezoneManager.add`` registers such a zone. Every activity table gets an
+extra integer column, ``day_utc`` or ``day_europe_berlin``, with a
+``(column, user_id)`` index, backfilled from the stored timestamps. From
+then on the tracker stores the day number in every configured zone with
+each event, so queries filter and group on integers just like on ``day``.
+Pass ``timezone='UTC'`` to the DAU queries of ``DAUTracker``, ``DAUReport``
+and ``SimpleDAUPredictor`` to count by those days.
+
+Daily rollups, user bitmaps and partitions stay keyed by ``day``, so
+timezone queries read raw events and cannot see compacted partitions.
+
+Manage zones from the command line::
+
+    python -m src.dau.storage.timezones dau_tracking.db --add UTC --add America/New_York
+"""
+import argparse
+import re
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+from zoneinfo import ZoneInfo
+from .schema import epoch_day
+
+# UTC offsets run from -12:00 to +14:00, so a day in one zone can be up to
+# two days off the stored day of the same event
+DAY_MARGIN = 2
+
+def column_name(timezone: str) -> str:
+    """Day column for an IANA timezone name, e.g. day_america_new_york"""
+    return 'day_' + re.sub('[^a-z0-9]+', '_', timezone.lower()).strip('_')
+
+def timezone_columns(conn) -> Dict[str, str]:
+    """{timezone: day column} of every configured timezone"""
+    return dict(conn.execute('SELECT timezone, column_name FROM day_timezones ORDER BY column_name'))
+
+def day_column(conn, timezone: Optional[str] = None) -> str:
+    """Column holding day numbers in timezone, ``day`` when it is None"""
+    if timezone is None:
+        return 'day'
+    row = conn.execute('SELECT column_name FROM day_timezones WHERE timezone = ?', (timezone,)).fetchone()
+    if row is None:
+        raise ValueError(f'No day buckets for timezone {timezone}, add it with TimezoneManager.add()')
+    return row[0]
+
+def zone_day_source(conn, start_day: int, end_day: int,
+                    timezone: Optional[str] = None) -> Tuple[str, str, str, tuple]:
+    """(day column, FROM clause, WHERE clause, parameters) for events on days in timezone
+
+    The WHERE clause also bounds the stored day, so only the partitions
+    and index ranges that can hold those days are read.
+    """
+    from .partition import activity_source
+
+    column = day_column(conn, timezone)
+    margin = 0 if timezone is None else DAY_MARGIN
+    first, last = start_day - margin, end_day + margin
+    return (column, activity_source(conn, first, last),
+            f'{column} BETWEEN ? AND ? AND day BETWEEN ? AND ?', (start_day, end_day, first, last))
+
+def now(timezone: Optional[str] = None) -> datetime:
+    """Current wall-clock time in timezone (naive), local time when it is None"""
+    if timezone is None:
+        return datetime.now()
+    return datetime.now(ZoneInfo(timezone)).replace(tzinfo=None)
+
+def local_day(value: datetime, timezone: Optional[str] = None) -> int:
+    """Day number of value in timezone
+
+    Naive values are already taken to be wall-clock times in timezone;
+    aware ones are converted first.
+    """
+    if timezone is not None and value.tzinfo is not None:
+        value = value.astimezone(ZoneInfo(timezone))
+    return epoch_day(value)
+
+class DayBuckets:
+    """Day numbers of stored timestamps in a fixed set of timezones
+
+    Conversions are cached by minute and UTC offset, so a batch of events
+    costs one zone lookup per distinct minute.
+    """
+
+    def __init__(self, timezones: Sequence[str]):
+        self.zones = [ZoneInfo(timezone) for timezone in timezones]
+        self._cache: Dict[str, tuple] = {}
+
+    def __call__(self, timestamp: str) -> tuple:
+        """Day number in every zone of an ISO timestamp as stored"""
+        tail = timestamp[19:]
+        offset = ''
+        for sign in '+-':
+            position = tail.find(sign)
+            if position >= 0:
+                offset = tail[position:]
+                break
+        if tail.endswith('Z'):
+            offset = '+00:00'
+        key = timestamp[:16] + offset
+        days = self._cache.get(key)
+        if days is None:
+            # Naive datetimes convert from the local timezone
+            value = datetime.fromisoformat(key)
+            days = self._cache[key] = tuple(epoch_day(value.astimezone(zone)) for zone in self.zones)
+        return days
+
+class TimezoneManager:
+    def __init__(self, pool):
+        self.pool = pool
+
+    def timezones(self) -> Dict[str, str]:
+        """{timezone: day column} of every configured timezone"""
+        with self.pool.reader() as conn:
+            return timezone_columns(conn)
+
+    def add(self, timezone: str, chunk_size: int = 50000, pause: float = 0.0) -> str:
+        """Store day numbers in timezone for past and future events, return the column
+
+        Existing events are backfilled chunk by chunk, one transaction per
+        chunk, so other writers are only blocked briefly. Adding a zone
+        again resumes an interrupted backfill.
+        """
+        from .partition import activity_tables
+
+        ZoneInfo(timezone)
+        column = column_name(timezone)
+        with self.pool.writer() as conn:
+            if not conn.execute('SELECT 1 FROM day_timezones WHERE timezone = ?', (timezone,)).fetchone():
+                if conn.execute('SELECT 1 FROM day_timezones WHERE column_name = ?', (column,)).fetchone():
+                    raise ValueError(f'Timezone {timezone} maps to day column {column}, which is already used')
+                for table in activity_tables(conn):
+                    conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} INTEGER')
+                # Registered before the backfill so concurrent writes fill the column
+                conn.execute('INSERT INTO day_timezones (timezone, column_name) VALUES (?, ?)',
+                             (timezone, column))
+            tables = activity_tables(conn)
+
+        buckets = DayBuckets([timezone])
+        for table in tables:
+            # By rowid: databases upgraded from the first layout have no id column
+            last_rowid = 0
+            while True:
+                with self.pool.writer() as conn:
+                    rows = conn.execute(f'''
+                        SELECT rowid, timestamp FROM {table}
+                        WHERE rowid > ? AND {column} IS NULL
+                        ORDER BY rowid LIMIT ?
+                    ''', (last_rowid, chunk_size)).fetchall()
+                    if not rows:
+                        break
+                    conn.executemany(f'UPDATE {table} SET {column} = ? WHERE rowid = ?',
+                                     [(buckets(timestamp)[0], rowid) for rowid, timestamp in rows])
+                last_rowid = rows[-1][0]
+                if pause:
+                    time.sleep(pause)
+            with self.pool.writer() as conn:
+                conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_{column}_user ON {table} ({column}, user_id)')
+
+        if self.pool.cache is not None:
+            self.pool.cache.clear()
+        return column
+
+    def remove(self, timezone: str):
+        """Stop storing day numbers in timezone and drop its column"""
+        from .partition import activity_tables
+
+        with self.pool.writer() as conn:
+            column = day_column(conn, timezone)
+            for table in activity_tables(conn):
+                conn.execute(f'DROP INDEX IF EXISTS idx_{table}_{column}_user')
+                conn.execute(f'ALTER TABLE {table} DROP COLUMN {column}')
+            conn.execute('DELETE FROM day_timezones WHERE timezone = ?', (timezone,))
+        if self.pool.cache is not None:
+            self.pool.cache.clear()
+
+def main():
+    from .pool import ConnectionPool
+
+    parser = argparse.ArgumentParser(description='Manage per-timezone day buckets of a DAU database')
+    parser.add_argument('db_path', nargs='?', default='dau_tracking.db')
+    parser.add_argument('--add', action='append', default=[], metavar='TIMEZONE',
+                        help='Store day numbers in this IANA timezone, e.g. UTC or Europe/Berlin')
+    parser.add_argument('--remove', action='append', default=[], metavar='TIMEZONE')
+    parser.add_argument('--chunk-size', type=int, default=50000,
+                        help='Rows backfilled per transaction')
+    parser.add_argument('--pause', type=float, default=0.0,
+                        help='Seconds to sleep between chunks to let other writers in')
+    args = parser.parse_args()
+
+    pool = ConnectionPool(args.db_path)
+    try:
+        manager = TimezoneManager(pool)
+        for timezone in args.remove:
+            manager.remove(timezone)
+            print(f"Removed day buckets for {timezone}")
+        for timezone in args.add:
+            started = time.perf_counter()
+            column = manager.add(timezone, args.chunk_size, args.pause)
+            print(f"Day buckets for {timezone} in {column} ({time.perf_counter() - started:.1f}s)")
+        timezones: List[str] = [f'{timezone} ({column})' for timezone, column in manager.timezones().items()]
+        print(f"Timezones: {', '.join(timezones) or 'none'}")
+    finally:
+        pool.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""Asyncio front end for DAUTracker
+
+``AsyncDAUTracker.log_activity`` only converts the event to a row and puts
+it on a bounded ``asyncio.Queue``; a drain task takes everything queued,
+up to ``batch_size`` rows, and inserts it on a single dedicated writer
+thread while the event loop keeps accepting events. When the queue is
+full, ``log_activity`` waits, which pushes back on the producers instead
+of growing memory.
+
+    async with AsyncDAUTracker('dau_tracking.db') as tracker:
+        await tracker.log_activity(activity)
+        count = await tracker.get_daily_active_user_count()
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Iterable, Optional, Union
+from ..models.activity_batch import ActivityBatch
+from ..models.user_activity import UserActivity
+from ..storage.pool import ConnectionPool
+from .tracker import DAUTracker
+
+class AsyncDAUTracker:
+    """Non-blocking ingestion into a DAUTracker
+
+    Queued events are durable once ``flush()`` returns. If a batch fails to
+    insert, its error is raised from the next ``flush()`` or ``close()``.
+    """
+
+    def __init__(self, db_path: str = 'dau_tracking.db', max_queue: int = 100000,
+                 batch_size: int = 10000, pool: Optional[ConnectionPool] = None,
+                 rollup_interval: Optional[float] = None):
+        self.tracker = DAUTracker(db_path, batch_size=batch_size, pool=pool,
+                                  rollup_interval=rollup_interval)
+        self.batch_size = batch_size
+        self._queue = asyncio.Queue(maxsize=max_queue)
+        # One thread keeps inserts in order and off the event loop
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='dau-writer')
+        self._drain_task = None
+        self._error = None
+
+    @property
+    def queued(self) -> int:
+        """Events waiting to be written"""
+        return self._queue.qsize()
+
+    def _ensure_draining(self):
+        if self._drain_task is None:
+            self._drain_task = asyncio.get_running_loop().create_task(self._drain())
+
+    async def _drain(self):
+        loop = asyncio.get_running_loop()
+        queue = self._queue
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < self.batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+            try:
+                await loop.run_in_executor(self._writer, self.tracker._insert_rows, batch)
+            except Exception as exc:
+                self._error = exc
+            finally:
+                for _ in batch:
+                    queue.task_done()
+
+    async def log_activity(self, activity: UserActivity):
+        """Queue one activity, waiting while the queue is full"""
+        self._ensure_draining()
+        await self._queue.put(DAUTracker._to_row(activity))
+
+    async def log_activities(self, activities: Union[ActivityBatch, Iterable[UserActivity]]) -> int:
+        rows = activities.rows() if isinstance(activities, ActivityBatch) else map(DAUTracker._to_row, activities)
+        return await self.log_rows(rows)
+
+    async def log_rows(self, rows: Iterable[tuple]) -> int:
+        """Queue rows already shaped like DAUTracker._to_row, return how many"""
+        self._ensure_draining()
+        count = 0
+        for row in rows:
+            await self._queue.put(row)
+            count += 1
+        return count
+
+    async def flush(self):
+        """Wait until every queued activity has been written"""
+        if self._drain_task is not None:
+            await self._queue.join()
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    async def close(self):
+        try:
+            await self.flush()
+        finally:
+            if self._drain_task is not None:
+                self._drain_task.cancel()
+                try:
+                    await self._drain_task
+                except asyncio.CancelledError:
+                    pass
+                self._drain_task = None
+            await asyncio.get_running_loop().run_in_executor(self._writer, self.tracker.close)
+            self._writer.shutdown()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def get_daily_active_user_count(self, date: Optional[datetime] = None,
+                                          timezone: Optional[str] = None) -> int:
+        """Flush, then count on a reader thread so the loop is not blocked"""
+        await self.flush()
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self.tracker.get_daily_active_user_count, date, timezone
+        )
+
+    async def get_active_user_count(self, start_date: datetime, end_date: Optional[datetime] = None,
+                                    approximate: bool = False, timezone: Optional[str] = None) -> int:
+        await self.flush()
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self.tracker.get_active_user_count, start_date, end_date, approximate, timezone
+        )
+
+    async def get_rolling_active_users(self, window: int = 7, date: Optional[datetime] = None,
+                                       approximate: bool = False, timezone: Optional[str] = None) -> int:
+        await self.flush()
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self.tracker.get_rolling_active_users, window, date, approximate, timezone
+        )
@@ -0,0 +1,133 @@
+"""DAU tracking spread over several SQLite files
+
+``ShardedDAUTracker`` hashes ``user_id`` to one of N database files, each
+with its own ``DAUTracker`` and writer connection, so N writers commit in
+parallel. A user always lives on one shard, so distinct-user counts from
+the shards simply add up and merged answers stay exact.
+
+Writes and queries fan out over a thread pool with one worker per shard;
+SQLite releases the GIL while it executes statements, so the shards'
+work overlaps.
+"""
+import zlib
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Union
+from ..models.activity_batch import ActivityBatch
+from ..models.user_activity import UserActivity
+from ..reporting.report import DAUReport
+from .tracker import DAUTracker
+
+def shard_paths(db_path: str, shards: int) -> List[str]:
+    """dau_tracking.db -> dau_tracking.shard0.db, dau_tracking.shard1.db, ..."""
+    path = Path(db_path)
+    return [str(path.with_name(f'{path.stem}.shard{i}{path.suffix}')) for i in range(shards)]
+
+class ShardedDAUTracker:
+    def __init__(self, db_path: str = 'dau_tracking.db', shards: int = 4,
+                 db_paths: Optional[Sequence[str]] = None, batch_size: int = 10000,
+                 output_dir: str = 'reports', rollup_interval: Optional[float] = None):
+        self.db_paths = list(db_paths) if db_paths else shard_paths(db_path, shards)
+        self.trackers = [
+            DAUTracker(path, batch_size=batch_size, rollup_interval=rollup_interval)
+            for path in self.db_paths
+        ]
+        self.reports = [DAUReport(output_dir=output_dir, pool=tracker.pool) for tracker in self.trackers]
+        self.batch_size = batch_size
+        self._executor = ThreadPoolExecutor(max_workers=len(self.trackers),
+                                            thread_name_prefix='dau-shard')
+
+    @property
+    def shards(self) -> int:
+        return len(self.trackers)
+
+    def shard_for(self, user_id: str) -> int:
+        """Stable shard index of a user, the same in every process"""
+        return zlib.crc32(user_id.encode()) % len(self.trackers)
+
+    def _fan_out(self, call: Callable[[int], Any]) -> List[Any]:
+        return list(self._executor.map(call, range(len(self.trackers))))
+
+    def log_activity(self, activity: UserActivity):
+        self.trackers[self.shard_for(activity.user_id)].log_activity(activity)
+
+    def log_activities(self, activities: Union[ActivityBatch, Iterable[UserActivity]]) -> int:
+        """Split activities by shard and insert every shard's rows in parallel"""
+        rows = activities.rows() if isinstance(activities, ActivityBatch) else map(DAUTracker._to_row, activities)
+        shard_for = self.shard_for
+        by_shard = defaultdict(list)
+        total = 0
+        for row in rows:
+            by_shard[shard_for(row[0])].append(row)
+            total += 1
+            if total % (self.batch_size * len(self.trackers)) == 0:
+                self._write(by_shard)
+                by_shard = defaultdict(list)
+        self._write(by_shard)
+        return total
+
+    def _write(self, by_shard: Dict[int, List[tuple]]):
+        def write(shard: int):
+            rows = by_shard.get(shard)
+            if rows:
+                self.trackers[shard]._insert_rows(rows)
+        self._fan_out(write)
+
+    def flush(self):
+        self._fan_out(lambda shard: self.trackers[shard].flush())
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            for tracker, report in zip(self.trackers, self.reports):
+                report.close()
+                tracker.close()
+            self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def get_daily_active_users(self, date: Optional[datetime] = None,
+                               timezone: Optional[str] = None) -> List[str]:
+        return [
+            user_id
+            for users in self._fan_out(lambda shard: self.trackers[shard].get_daily_active_users(date, timezone))
+            for user_id in users
+        ]
+
+    def get_daily_active_user_count(self, date: Optional[datetime] = None,
+                                    timezone: Optional[str] = None) -> int:
+        return sum(self._fan_out(lambda shard: self.trackers[shard].get_daily_active_user_count(date, timezone)))
+
+    def get_active_user_count(self, start_date: datetime, end_date: Optional[datetime] = None,
+                              approximate: bool = False, timezone: Optional[str] = None) -> int:
+        """Exact sums for exact counts; approximate counts add each shard's estimate"""
+        return sum(self._fan_out(
+            lambda shard: self.trackers[shard].get_active_user_count(start_date, end_date, approximate, timezone)
+        ))
+
+    def get_dau_trend(self, days: int = 30, timezone: Optional[str] = None) -> List[Dict[str, int]]:
+        totals = defaultdict(int)
+        for trend in self._fan_out(lambda shard: self.reports[shard].get_dau_trend(days, timezone)):
+            for row in trend:
+                totals[row['date']] += row['daily_active_users']
+        return [
+            {'date': date, 'daily_active_users': users}
+            for date, users in sorted(totals.items())
+        ]
+
+    def get_activity_distribution(self, start_date: datetime = None,
+                                  end_date: datetime = None) -> Dict[str, Dict[str, int]]:
+        merged = defaultdict(lambda: {'unique_users': 0, 'total_activities': 0})
+        for distribution in self._fan_out(
+                lambda shard: self.reports[shard].get_activity_distribution(start_date, end_date)):
+            for activity_type, stats in distribution.items():
+                merged[activity_type]['unique_users'] += stats['unique_users']
+                merged[activity_type]['total_activities'] += stats['total_activities']
+        return dict(merged)
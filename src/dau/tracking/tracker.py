@@ -1,54 +1,272 @@
-import sqlite3
+import time
 from datetime import datetime, timedelta
-from typing import List, Optional
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional, Union
+from ..metrics.instrumentation import instrumented
+from ..models.activity_batch import ActivityBatch
+from ..models.metadata import PROMOTED_FIELDS, decode_metadata, encode_metadata
 from ..models.user_activity import UserActivity
+from ..storage.bitmap import ALL_PLATFORMS, BitmapIndex, UserBitmap, lookup_user_ids
+from ..storage.partition import activity_source, insert_activities
+from ..storage.pool import ConnectionPool
+from ..storage.rollup import RollupManager
+from ..storage.schema import epoch_day
+from ..storage.timezones import local_day, now, zone_day_source
 
 class DAUTracker:
-    def __init__(self, db_path: str = 'dau_tracking.db'):
-        self.db_path = db_path
-        self._create_table()
-
-    def _create_table(self):
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS user_activities (
-                    user_id TEXT,
-                    timestamp TEXT,
-                    activity_type TEXT,
-                    platform TEXT,
-                    metadata TEXT
-                )
-            ''')
+    """Log user activities to SQLite and answer daily active user queries
+
+    Durability by write mode:
+
+    - ``log_activity`` (default, unbuffered): every call commits its own
+      transaction, so the row is on disk once the call returns.
+    - ``log_activities``: rows are inserted with one ``executemany``
+      transaction per ``batch_size`` rows. Each committed batch is durable;
+      if a batch fails it is rolled back as a whole and earlier batches stay.
+    - ``buffered=True``: ``log_activity`` only appends to an in-memory
+      buffer, which is written as one transaction when it holds
+      ``batch_size`` rows, when ``flush_interval`` seconds have passed since
+      the last flush (checked on the next ``log_activity`` call), on
+      ``flush()``/``close()`` and when a ``with`` block exits. Buffered rows
+      that have not been flushed are lost if the process dies.
+
+    A committed transaction is additionally subject to the pool's
+    ``synchronous`` setting, see ``ConnectionPool``.
+
+    Every write marks its days dirty for the daily rollups. With
+    ``rollup_interval`` set, the tracker also rebuilds the dirty days after
+    a write once that many seconds have passed since its last rebuild;
+    otherwise run ``RollupManager.refresh`` separately.
+
+    Every write also keeps each user's first-seen day in ``users`` current
+    for cohort analysis, and adds the users to the per-day and per-platform
+    bitmaps behind ``get_active_user_set``.
+
+    When the pool has a ``QueryCache``, cached results covering the written
+    days are dropped after each commit.
+    """
+
+    def __init__(self, db_path: str = 'dau_tracking.db', buffered: bool = False,
+                 batch_size: int = 10000, flush_interval: float = 1.0,
+                 pool: Optional[ConnectionPool] = None,
+                 rollup_interval: Optional[float] = None):
+        self._owns_pool = pool is None
+        self.pool = pool or ConnectionPool(db_path)
+        self.db_path = self.pool.db_path
+        self.buffered = buffered
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer = []
+        self._last_flush = time.monotonic()
+        self.rollups = RollupManager(self.pool)
+        self.rollup_interval = rollup_interval
+        self._last_rollup = time.monotonic()
+
+    @staticmethod
+    def _to_row(activity: UserActivity) -> tuple:
+        return (
+            activity.user_id,
+            activity.timestamp.isoformat(),
+            epoch_day(activity.timestamp),
+            activity.activity_type,
+            activity.platform
+        ) + encode_metadata(activity.metadata)
 
+    def _insert_rows(self, rows: List[tuple]):
+        days = {row[2] for row in rows}
+        first_days = {}
+        for row in rows:
+            user_id, day = row[0], row[2]
+            if first_days.get(user_id, day) >= day:
+                first_days[user_id] = day
+        with self.pool.writer() as conn:
+            insert_activities(conn, rows)
+            conn.executemany(
+                'INSERT OR IGNORE INTO rollup_dirty (day) VALUES (?)',
+                [(day,) for day in days]
+            )
+            conn.executemany('''
+                INSERT INTO users (user_id, first_day) VALUES (?, ?)
+                ON CONFLICT (user_id) DO UPDATE SET first_day = excluded.first_day
+                WHERE excluded.first_day < users.first_day
+            ''', first_days.items())
+            BitmapIndex.add_rows(conn, rows)
+        if self.pool.cache is not None:
+            self.pool.cache.invalidate_days(days)
+
+        if (self.rollup_interval is not None and
+                time.monotonic() - self._last_rollup >= self.rollup_interval):
+            self.rollups.refresh()
+            self._last_rollup = time.monotonic()
+
+    @instrumented
     def log_activity(self, activity: UserActivity):
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute('''
-                INSERT INTO user_activities 
-                (user_id, timestamp, activity_type, platform, metadata) 
-                VALUES (?, ?, ?, ?, ?)
-            ''', (
-                activity.user_id, 
-                activity.timestamp.isoformat(), 
-                activity.activity_type, 
-                activity.platform, 
-                str(activity.metadata)
-            ))
-
-    def get_daily_active_users(self, date: Optional[datetime] = None) -> List[str]:
+        if not self.buffered:
+            self._insert_rows([self._to_row(activity)])
+            return
+
+        self._buffer.append(self._to_row(activity))
+        if (len(self._buffer) >= self.batch_size or
+                time.monotonic() - self._last_flush >= self.flush_interval):
+            self.flush()
+
+    @instrumented
+    def log_activities(self, activities: Union[ActivityBatch, Iterable[UserActivity]]) -> int:
+        """Insert activities in bulk, one transaction per batch_size rows
+
+        An ActivityBatch is read column by column without creating a
+        UserActivity per event.
+        """
+        self.flush()
+        if isinstance(activities, ActivityBatch):
+            rows = activities.rows()
+        else:
+            rows = map(self._to_row, activities)
+        total = 0
+        while True:
+            batch = list(islice(rows, self.batch_size))
+            if not batch:
+                break
+            self._insert_rows(batch)
+            total += len(batch)
+        return total
+
+    @instrumented
+    def flush(self):
+        """Write any buffered activities in a single transaction"""
+        if self._buffer:
+            rows, self._buffer = self._buffer, []
+            self._insert_rows(rows)
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        self.flush()
+        if self._owns_pool:
+            self.pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def get_activities(self, start_date: datetime, end_date: Optional[datetime] = None) -> Iterator[UserActivity]:
+        """Yield the activities logged from start_date to end_date inclusive, by day"""
+        if end_date is None:
+            end_date = datetime.now()
+
+        start_day, end_day = epoch_day(start_date), epoch_day(end_date)
+
+        self.flush()
+        with self.pool.snapshot() as conn:
+            cursor = conn.execute(f'''
+                SELECT user_id, timestamp, activity_type, platform, metadata,
+                       {', '.join(PROMOTED_FIELDS)}
+                FROM {activity_source(conn, start_day, end_day)}
+                WHERE day BETWEEN ? AND ?
+                ORDER BY day
+            ''', (start_day, end_day))
+            for user_id, timestamp, activity_type, platform, metadata, *promoted in cursor:
+                yield UserActivity(
+                    user_id=user_id,
+                    timestamp=datetime.fromisoformat(timestamp),
+                    activity_type=activity_type,
+                    platform=platform,
+                    metadata=decode_metadata(metadata, *promoted)
+                )
+
+    @instrumented
+    def get_daily_active_users(self, date: Optional[datetime] = None,
+                               timezone: Optional[str] = None) -> List[str]:
+        """user_ids active on date, a day in timezone when given (see storage.timezones)"""
         if date is None:
-            date = datetime.now()
-        
-        start_of_day = date.replace(hour=0, minute=0, second=0, microsecond=0)
-        end_of_day = start_of_day + timedelta(days=1)
-
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute('''
-                SELECT DISTINCT user_id 
-                FROM user_activities 
-                WHERE timestamp >= ? AND timestamp < ?
-            ''', (start_of_day.isoformat(), end_of_day.isoformat()))
-            
+            date = now(timezone)
+        return self._active_user_ids(local_day(date, timezone), local_day(date, timezone), timezone)
+
+    def _active_user_ids(self, start_day: int, end_day: int, timezone: Optional[str] = None) -> List[str]:
+        self.flush()
+        with self.pool.snapshot() as conn:
+            _, source, where, params = zone_day_source(conn, start_day, end_day, timezone)
+            cursor = conn.execute(f'SELECT DISTINCT user_id FROM {source} WHERE {where}', params)
+
             return [row[0] for row in cursor.fetchall()]
 
-    def get_daily_active_user_count(self, date: Optional[datetime] = None) -> int:
-        return len(self.get_daily_active_users(date))
+    @instrumented
+    def get_daily_active_user_count(self, date: Optional[datetime] = None,
+                                    timezone: Optional[str] = None) -> int:
+        if timezone is not None:
+            return len(self.get_daily_active_users(date, timezone))
+        return len(self.get_active_user_set(date))
+
+    @instrumented
+    def get_active_user_count(self, start_date: datetime, end_date: Optional[datetime] = None,
+                              approximate: bool = False, timezone: Optional[str] = None) -> int:
+        """Distinct users active on any day from start_date to end_date inclusive
+
+        Exact counts come from the union of the daily user bitmaps. With
+        approximate=True the count is merged from the daily HyperLogLog
+        sketches (see RollupManager.enable_sketches) instead. With a
+        timezone, days are that zone's stored day buckets and the count
+        comes from raw events.
+        """
+        if timezone is not None:
+            if approximate:
+                raise ValueError('Approximate counts are only kept for stored days, not per timezone')
+            if end_date is None:
+                end_date = now(timezone)
+            return len(self._active_user_ids(local_day(start_date, timezone), local_day(end_date, timezone),
+                                              timezone))
+        if approximate:
+            if end_date is None:
+                end_date = datetime.now()
+            self.flush()
+            with self.pool.snapshot() as conn:
+                counts = RollupManager.approximate_unique_users(conn, epoch_day(start_date), epoch_day(end_date))
+            return counts.get('', 0)
+        return len(self.get_active_user_set(start_date, end_date))
+
+    @instrumented
+    def get_active_user_set(self, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None,
+                            platform: Optional[str] = None) -> UserBitmap:
+        """Bitmap of the users active from start_date (default today) to end_date inclusive
+
+        end_date defaults to start_date; platform restricts to events from
+        that platform. Combine sets with ``|``, ``&`` and ``-`` or with
+        ``union``/``intersection``/``difference``.
+        """
+        if start_date is None:
+            start_date = datetime.now()
+        if end_date is None:
+            end_date = start_date
+
+        self.flush()
+        with self.pool.snapshot() as conn:
+            days = BitmapIndex.load(conn, epoch_day(start_date), epoch_day(end_date),
+                                    ALL_PLATFORMS if platform is None else platform)
+        return UserBitmap.union(*days.values())
+
+    @staticmethod
+    def union(*sets: UserBitmap) -> UserBitmap:
+        return UserBitmap.union(*sets)
+
+    @staticmethod
+    def intersection(first: UserBitmap, *others: UserBitmap) -> UserBitmap:
+        return UserBitmap.intersection(first, *others)
+
+    @staticmethod
+    def difference(first: UserBitmap, *others: UserBitmap) -> UserBitmap:
+        return first.difference(*others)
+
+    @instrumented
+    def resolve_users(self, users: UserBitmap) -> List[str]:
+        """user_id strings of the users in a set"""
+        with self.pool.reader() as conn:
+            return lookup_user_ids(conn, users.to_ids())
+
+    @instrumented
+    def get_rolling_active_users(self, window: int = 7, date: Optional[datetime] = None,
+                                 approximate: bool = False, timezone: Optional[str] = None) -> int:
+        """Distinct users over the window days ending at date, e.g. WAU for 7 or MAU for 30"""
+        if date is None:
+            date = now(timezone)
+        return self.get_active_user_count(date - timedelta(days=window - 1), date, approximate, timezone)
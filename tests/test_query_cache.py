@@ -0,0 +1,33 @@
+from src.dau.storage.cache import QueryCache
+
+def test_invalidation_during_compute_is_not_cached():
+    cache = QueryCache()
+
+    def racing_compute():
+        # A writer commits day 5 while the query is still running
+        cache.invalidate_days([5])
+        return 'stale'
+
+    assert cache.get('key', 1, 10, racing_compute) == 'stale'
+    assert cache.get('key', 1, 10, lambda: 'fresh') == 'fresh'
+    assert cache.get('key', 1, 10, lambda: 'recomputed') == 'fresh'
+
+def test_invalidation_outside_window_keeps_result():
+    cache = QueryCache()
+
+    def compute():
+        cache.invalidate_days([20])
+        return 'value'
+
+    assert cache.get('key', 1, 10, compute) == 'value'
+    assert cache.get('key', 1, 10, lambda: 'other') == 'value'
+
+def test_clear_during_compute_is_not_cached():
+    cache = QueryCache()
+
+    def compute():
+        cache.clear()
+        return 'stale'
+
+    cache.get('key', 1, 10, compute)
+    assert cache.get('key', 1, 10, lambda: 'fresh') == 'fresh'